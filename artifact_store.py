@@ -0,0 +1,222 @@
+'''Content-addressed artifact store shared by all projects.
+
+    cache_directory/artifacts/
+        blobs/<aa>/<sha256>    every distinct artifact file, stored once
+        index.sqlite           which artifacts (file name, name, version, tag)
+                               were produced by which build fingerprint
+
+    - Identical files (same sha256) are stored once, whatever their name
+    - The artifacts of a build fingerprint are a primary key lookup
+    - Retention: least recently used blobs are evicted past a total size,
+      an age, and/or a number of artifacts
+'''
+
+import os, sys, stat, time, shutil, sqlite3, hashlib, functools, subprocess, threading
+from print_tricks import pt
+
+from fix_and_optimize import DEFAULT_EXCLUDED_FOLDERS
+from wheel_restamper import parse_wheel_filename
+
+
+## Sets `tag`, in this interpreter or (with a print) in another one
+_INTERPRETER_TAG_SCRIPT = """
+import sys, sysconfig, platform
+## The extension ABI (e.g. cpython-311-x86_64-linux-gnu, cp311-win_amd64), which also tells free-threaded builds apart
+abi = sysconfig.get_config_var('SOABI') or '.'.join((sysconfig.get_config_var('EXT_SUFFIX') or '').split('.')[1:-1])
+## glibc and musl builds share the SOABI on older interpreters
+libc = ''.join(platform.libc_ver()) if sys.platform.startswith('linux') else ''
+parts = [sys.implementation.name, f'{sys.version_info[0]}.{sys.version_info[1]}', sysconfig.get_platform(), abi, libc]
+tag = '-'.join(part.replace('-', '_').replace(' ', '_') for part in parts if part)
+"""
+
+@functools.lru_cache(maxsize=None)
+def interpreter_tag(python_executable=None):
+    '''e.g. "cpython-3.11-linux_x86_64-cpython_311_x86_64_linux_gnu-glibc2.36". Wheels (and
+    resolutions) differ per interpreter, architecture, ABI and libc.'''
+    if python_executable is None or python_executable == sys.executable:
+        namespace = {}
+        exec(_INTERPRETER_TAG_SCRIPT, namespace)
+        return namespace['tag']
+    return subprocess.run([python_executable, '-c', _INTERPRETER_TAG_SCRIPT + 'print(tag)'],
+        check=True, capture_output=True, text=True).stdout.strip()
+
+def remove_file(path):
+    '''os.remove that also removes read-only files (Windows refuses to, and
+    blobs of older stores, which may be linked anywhere, are read-only).'''
+    try:
+        os.remove(path)
+    except PermissionError:
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        os.remove(path)
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def source_fingerprint(project_directory, pyproject_path=None, backend='build', python_tag=None, excluded_folders=None):
+    '''Hash of everything a build depends on: the source files (paths and
+    contents), the pyproject (which may live outside the tree), the build
+    backend and the interpreter tag.'''
+    excludes = set(DEFAULT_EXCLUDED_FOLDERS) | set(f for f in (excluded_folders or []) if f)
+    fingerprint = hashlib.sha256(f'{backend}\0{python_tag or interpreter_tag()}\0'.encode('utf-8'))
+    for root, dirs, files in os.walk(project_directory):
+        dirs[:] = sorted(d for d in dirs if d not in excludes and not d.endswith('.egg-info'))
+        for file in sorted(files):
+            if file.endswith(('.pyc', '.pyo')):
+                continue
+            path = os.path.join(root, file)
+            relative_path = os.path.relpath(path, project_directory).replace(os.sep, '/')
+            fingerprint.update(f'{relative_path}\0{file_digest(path)}\0'.encode('utf-8'))
+    if pyproject_path and os.path.exists(pyproject_path):
+        fingerprint.update(f'pyproject\0{file_digest(pyproject_path)}\0'.encode('utf-8'))
+    return fingerprint.hexdigest()
+
+def describe_artifact(filename):
+    '''(name, version, tag) of a wheel or sdist file name.'''
+    if filename.endswith('.whl'):
+        return parse_wheel_filename(filename)
+    for extension in ('.tar.gz', '.zip'):
+        if filename.endswith(extension):
+            name, _, version = filename[:-len(extension)].rpartition('-')
+            return name, version, 'sdist'
+    raise ValueError(f'Unknown artifact type: {filename}')
+
+
+class ArtifactStore:
+    def __init__(self, cache_directory, max_bytes=2 * 1024 ** 3, max_age_days=90, max_artifacts=None):
+        self.root_directory = os.path.join(cache_directory, 'artifacts')
+        self.blobs_directory = os.path.join(self.root_directory, 'blobs')
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.max_artifacts = max_artifacts
+        self.lock = threading.Lock()
+        os.makedirs(self.blobs_directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(os.path.join(self.root_directory, 'index.sqlite'), check_same_thread=False)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS artifacts (
+                fingerprint TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                digest TEXT NOT NULL REFERENCES blobs (digest),
+                name TEXT NOT NULL,
+                version TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (fingerprint, filename)
+            );
+            CREATE INDEX IF NOT EXISTS artifacts_by_release ON artifacts (name, version, tag);
+            CREATE INDEX IF NOT EXISTS artifacts_by_digest ON artifacts (digest);
+        ''')
+        self.connection.commit()
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs_directory, digest[:2], digest)
+
+    def add(self, path, fingerprint):
+        '''Stores the file (once per content) and records it under `fingerprint`.'''
+        digest = file_digest(path)
+        filename = os.path.basename(path)
+        name, version, tag = describe_artifact(filename)
+        now = time.time()
+        blob_path = self.blob_path(digest)
+        with self.lock:
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                temp_path = f'{blob_path}.{os.getpid()}.tmp'
+                ## Blobs may be hardlinked out, so nothing writes to them (or their links) in place:
+                ## links are replaced, never edited. They aren't made read-only, as Windows can't remove those.
+                shutil.copyfile(path, temp_path)
+                os.replace(temp_path, blob_path)
+            self.connection.execute(
+                'INSERT OR IGNORE INTO blobs (digest, size, created_at, last_used) VALUES (?, ?, ?, ?)',
+                (digest, os.path.getsize(blob_path), now, now))
+            self.connection.execute(
+                'INSERT OR REPLACE INTO artifacts (fingerprint, filename, digest, name, version, tag, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (fingerprint, filename, digest, name, version, tag, now))
+            self.connection.commit()
+        return digest
+
+    def _touch(self, digests):
+        self.connection.executemany('UPDATE blobs SET last_used = ? WHERE digest = ?', [(time.time(), d) for d in digests])
+        self.connection.commit()
+
+    def lookup(self, fingerprint):
+        '''{filename: blob_path} of everything built from `fingerprint` ({} if nothing).'''
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT filename, digest FROM artifacts WHERE fingerprint = ?', (fingerprint,)).fetchall()
+            rows = [(filename, digest) for filename, digest in rows if os.path.exists(self.blob_path(digest))]
+            self._touch([digest for _, digest in rows])
+        return {filename: self.blob_path(digest) for filename, digest in rows}
+
+    def find(self, name, version, tag=None):
+        '''{filename: blob_path} of the artifacts of a release (optionally only one tag).'''
+        query = 'SELECT filename, digest FROM artifacts WHERE name = ? AND version = ?'
+        parameters = [name, version]
+        if tag is not None:
+            query += ' AND tag = ?'
+            parameters.append(tag)
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+            rows = [(filename, digest) for filename, digest in rows if os.path.exists(self.blob_path(digest))]
+            self._touch([digest for _, digest in rows])
+        return {filename: self.blob_path(digest) for filename, digest in rows}
+
+    def versions(self, name):
+        with self.lock:
+            rows = self.connection.execute('SELECT DISTINCT version FROM artifacts WHERE name = ?', (name,)).fetchall()
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def materialize(blob_path, destination_path):
+        '''Hardlinks (or copies, across devices) a blob to `destination_path`.'''
+        if os.path.exists(destination_path):
+            remove_file(destination_path)
+        try:
+            os.link(blob_path, destination_path)
+        except OSError:
+            shutil.copyfile(blob_path, destination_path)
+        return destination_path
+
+    def _remove_blob(self, digest):
+        try:
+            remove_file(self.blob_path(digest))
+        except FileNotFoundError:
+            pass
+        self.connection.execute('DELETE FROM artifacts WHERE digest = ?', (digest,))
+        self.connection.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+
+    def evict(self, max_bytes=None, max_age_days=None, max_artifacts=None):
+        '''Applies the retention policy, least recently used first. Returns the number of evicted blobs.'''
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age_days = self.max_age_days if max_age_days is None else max_age_days
+        max_artifacts = self.max_artifacts if max_artifacts is None else max_artifacts
+        evicted = 0
+        with self.lock:
+            blobs = self.connection.execute('SELECT digest, size, last_used FROM blobs ORDER BY last_used ASC').fetchall()
+            total_bytes = sum(size for _, size, _ in blobs)
+            remaining = len(blobs)
+            oldest_allowed = time.time() - max_age_days * 86400 if max_age_days is not None else None
+            for digest, size, last_used in blobs:
+                too_old = oldest_allowed is not None and last_used < oldest_allowed
+                too_big = max_bytes is not None and total_bytes > max_bytes
+                too_many = max_artifacts is not None and remaining > max_artifacts
+                if not (too_old or too_big or too_many):
+                    break  ## Everything after this one is more recently used
+                self._remove_blob(digest)
+                total_bytes -= size
+                remaining -= 1
+                evicted += 1
+            self.connection.commit()
+        if evicted:
+            pt.c(f'-- Artifact store: evicted {evicted} artifact(s), {total_bytes / 1024 ** 2:.1f} MB kept')
+        return evicted
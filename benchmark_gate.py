@@ -0,0 +1,206 @@
+'''Benchmark gate: the new wheel must not be slower than the previous release.
+
+    Benchmarks are declared in the project's pyproject.toml, as entry points
+    of callables that take no arguments:
+        [tool.pup_py]
+        benchmarks = ["mypackage.benchmarks:parse_large_file"]
+        benchmark_tolerance = 0.05      ## optional: allowed slowdown of the median
+
+    The new wheel and the previous release's wheel (from the local artifact
+    store) are installed side by side in two venvs, then each benchmark runs
+    in both, alternating between them for `rounds` rounds of
+    `samples_per_round` timings. (Each timing repeats the call enough times to
+    last at least `min_sample_time`.) A benchmark regressed when the new
+    timings are significantly larger (one-sided Mann-Whitney U test, p <
+    `alpha`) *and* the median slowed down by more than the tolerance.
+    Benchmarks the previous release doesn't have yet (e.g. the first release
+    that declares them) are skipped.
+'''
+
+import os, sys, json, math, statistics, tempfile, subprocess
+import toml
+
+from artifact_store import file_digest
+from wheelhouse_cache import WheelhouseCache, read_wheel_requirements
+
+
+RESULTS_MARKER = 'PUP_PY_BENCHMARK_RESULTS '
+
+## Runs inside the benchmark venvs: argv[1] is [entry points, samples, min_sample_time]
+BENCHMARK_RUNNER = r'''
+import sys, json, time, importlib
+
+def load(entry_point):
+    module_name, _, attribute = entry_point.partition(':')
+    target = importlib.import_module(module_name)
+    for part in attribute.split('.'):
+        target = getattr(target, part)
+    return target
+
+def sample(func, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+entry_points, samples, min_sample_time = json.loads(sys.argv[1])
+results, missing = {}, {}
+for entry_point in entry_points:
+    try:
+        func = load(entry_point)
+    except (ImportError, AttributeError) as e:
+        missing[entry_point] = repr(e)
+        continue
+    func()  ## Warm-up
+    number = 1
+    while sample(func, number) < min_sample_time and number < 10 ** 7:
+        number *= 2
+    results[entry_point] = [sample(func, number) / number for _ in range(samples)]
+print(''' + repr(RESULTS_MARKER) + r''' + json.dumps({'results': results, 'missing': missing}))
+'''
+
+
+def read_benchmark_config(pyproject_path):
+    '''The [tool.pup_py] benchmark settings ({} if the project declares no benchmarks).'''
+    try:
+        with open(pyproject_path, 'r', encoding='utf-8') as file:
+            tool_config = toml.load(file).get('tool', {}).get('pup_py', {})
+    except (OSError, toml.TomlDecodeError):
+        return {}
+    if not tool_config.get('benchmarks'):
+        return {}
+    return {
+        'benchmarks': list(tool_config['benchmarks']),
+        'tolerance': float(tool_config.get('benchmark_tolerance', 0.05)),
+    }
+
+def mann_whitney_u(new, old):
+    '''(U, one-sided p-value that `new` tends to be larger than `old`), normal
+    approximation with tie and continuity corrections.'''
+    values = sorted([(value, 0) for value in new] + [(value, 1) for value in old])
+    ranks = [0.0] * len(values)
+    tie_term = 0
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        tie_term += (j - i + 1) ** 3 - (j - i + 1)
+        i = j + 1
+
+    n1, n2 = len(new), len(old)
+    n = n1 + n2
+    u = sum(rank for rank, (_, group) in zip(ranks, values) if group == 0) - n1 * (n1 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return u, 0.5
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return u, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+class BenchmarkGate:
+    def __init__(self,
+            environments_directory,
+            cache_directory,
+            entry_points,
+            tolerance=0.05,
+            alpha=0.05,
+            rounds=3,
+            samples_per_round=5,
+            min_sample_time=0.01,
+            ):
+        self.environments_directory = environments_directory
+        self.cache_directory = cache_directory
+        self.entry_points = entry_points
+        self.tolerance = tolerance
+        self.alpha = alpha
+        self.rounds = rounds
+        self.samples_per_round = samples_per_round
+        self.min_sample_time = min_sample_time
+
+    def _environment(self, label, wheel_path):
+        '''A venv with `wheel_path` installed (kept between runs, reinstalled when the wheel changes).'''
+        venv_directory = os.path.join(self.environments_directory, label)
+        venv_python = os.path.join(venv_directory, 'Scripts', 'python.exe') if sys.platform == 'win32' else os.path.join(venv_directory, 'bin', 'python')
+        if not os.path.exists(venv_python):
+            subprocess.run([sys.executable, '-m', 'venv', venv_directory], check=True, capture_output=True)
+
+        marker_path = os.path.join(venv_directory, 'pup_py_installed_wheel.json')
+        digest = file_digest(wheel_path)
+        try:
+            with open(marker_path, 'r', encoding='utf-8') as file:
+                if json.load(file).get('sha256') == digest:
+                    return venv_python
+        except (OSError, ValueError):
+            pass
+        wheelhouse_args = WheelhouseCache(self.cache_directory, python_executable=venv_python).install_arguments(read_wheel_requirements(wheel_path))
+        subprocess.run([venv_python, '-m', 'pip', 'install', '--quiet', '--force-reinstall', wheel_path, *wheelhouse_args], check=True)
+        with open(marker_path, 'w', encoding='utf-8') as file:
+            json.dump({'wheel': os.path.basename(wheel_path), 'sha256': digest}, file)
+        return venv_python
+
+    def _sample(self, venv_python):
+        '''{'results': {entry point: timings}, 'missing': {entry point: why it couldn't be loaded}}'''
+        result = subprocess.run(
+            [venv_python, '-c', BENCHMARK_RUNNER, json.dumps([self.entry_points, self.samples_per_round, self.min_sample_time])],
+            capture_output=True, text=True, cwd=tempfile.gettempdir())  ## Not the project directory: the installed package must be imported
+        if result.returncode != 0:
+            raise RuntimeError(f'Benchmarks failed with {venv_python}:\n{result.stderr[-2000:]}')
+        lines = [line for line in result.stdout.splitlines() if line.startswith(RESULTS_MARKER)]
+        if not lines:
+            raise RuntimeError(f'The benchmark runner printed no results with {venv_python}:\n{result.stdout[-2000:]}')
+        return json.loads(lines[-1][len(RESULTS_MARKER):])
+
+    def run(self, new_wheel_path, previous_wheel_path):
+        '''One result per benchmark: medians, ratio, p-value and whether it regressed
+        (or why it was skipped).'''
+        pythons = {
+            'new': self._environment('new', new_wheel_path),
+            'previous': self._environment('previous', previous_wheel_path),
+        }
+        timings = {label: {entry_point: [] for entry_point in self.entry_points} for label in pythons}
+        missing = {label: {} for label in pythons}
+        ## Alternating rounds, so drift of the machine (thermal, load) hits both sides alike
+        for _ in range(self.rounds):
+            for label, venv_python in pythons.items():
+                sampled = self._sample(venv_python)
+                missing[label].update(sampled['missing'])
+                for entry_point, samples in sampled['results'].items():
+                    timings[label][entry_point].extend(samples)
+        if missing['new']:
+            raise RuntimeError('Declared benchmarks that the new wheel can\'t load:\n' + 
+                '\n'.join(f'   {entry_point}: {error}' for entry_point, error in missing['new'].items()))
+
+        results = []
+        for entry_point in self.entry_points:
+            new, previous = timings['new'][entry_point], timings['previous'][entry_point]
+            if entry_point in missing['previous']:
+                results.append({'entry_point': entry_point, 'new_median': statistics.median(new), 'previous_median': None,
+                    'ratio': None, 'p_value': None, 'regressed': False, 'skipped': 'not in the previous release'})
+                continue
+            ratio = statistics.median(new) / statistics.median(previous) if statistics.median(previous) else 1.0
+            _, p_value = mann_whitney_u(new, previous)
+            results.append({
+                'entry_point': entry_point,
+                'new_median': statistics.median(new),
+                'previous_median': statistics.median(previous),
+                'ratio': ratio,
+                'p_value': p_value,
+                'regressed': p_value < self.alpha and ratio > 1 + self.tolerance,
+            })
+        return results
+
+    @staticmethod
+    def print_table(results, previous_version):
+        header = f"{'Benchmark':<45} {'new':>12} {previous_version:>12} {'change':>8} {'p':>7}  Result"
+        print(header)
+        print('-' * len(header))
+        for result in results:
+            if result.get('skipped'):
+                print(f"{result['entry_point']:<45} {result['new_median'] * 1000:>10.3f}ms {'-':>12} {'-':>8} {'-':>7}  skipped ({result['skipped']})")
+                continue
+            status = 'SLOWER' if result['regressed'] else 'OK'
+            print(f"{result['entry_point']:<45} {result['new_median'] * 1000:>10.3f}ms {result['previous_median'] * 1000:>10.3f}ms "
+                f"{result['ratio'] - 1:>+8.1%} {result['p_value']:>7.3f}  {status}")
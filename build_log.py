@@ -0,0 +1,83 @@
+'''Streaming, bounded log pipeline for the subprocesses pup_py runs.
+
+    Instead of `subprocess.run(..., capture_output=True)` (which buffers the
+    whole output in memory and shows nothing until the process exits), every
+    line of the child's stdout/stderr is:
+    - written as soon as it arrives to a per-project rotating log file
+    - optionally echoed to the console
+    - kept in a small ring buffer (per stream) for error reporting
+
+    Each pipe is drained by its own thread, so a child can never block on a
+    full pipe, no matter how much it writes or how many builds run at once.
+'''
+
+import os, logging, threading, subprocess
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+
+class BuildLog:
+    def __init__(self,
+            log_directory,
+            project_name,
+            max_bytes=5 * 1024 * 1024,
+            backup_count=3,
+            ring_size=200,
+            echo=True,
+            ):
+        self.log_directory = log_directory
+        self.project_name = project_name
+        self.ring_size = ring_size
+        self.echo = echo
+        os.makedirs(log_directory, exist_ok=True)
+        self.log_path = os.path.join(log_directory, f'{project_name}.log')
+
+        ## One logger (and file handler) per log file, shared by every thread writing to it
+        self.logger = logging.getLogger(f'pup_py.build_log.{os.path.abspath(self.log_path)}')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            handler = RotatingFileHandler(self.log_path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self.logger.addHandler(handler)
+
+    def _drain(self, pipe, label, stream_name, ring, echo):
+        try:
+            for line in pipe:
+                line = line.rstrip('\r\n')
+                ring.append(line)
+                self.logger.info(f'[{label}] [{stream_name}] {line}')
+                if echo:
+                    print(f'[{label}] {line}', flush=True)
+        finally:
+            pipe.close()
+
+    def run(self, command, label=None, cwd=None, env=None, check=True, echo=None):
+        '''Drop-in for `subprocess.run(command, capture_output=True, text=True)`.
+        Returns a CompletedProcess whose stdout/stderr only hold the last
+        `ring_size` lines of each stream (the full output is in the log file).'''
+        label = label or os.path.basename(str(command[0]))
+        echo = self.echo if echo is None else echo
+        stdout_ring = deque(maxlen=self.ring_size)
+        stderr_ring = deque(maxlen=self.ring_size)
+
+        self.logger.info(f'[{label}] $ {subprocess.list2cmdline([str(c) for c in command])}')
+        process = subprocess.Popen(command, cwd=cwd, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+            text=True, errors='replace', bufsize=1)
+        readers = [
+            threading.Thread(target=self._drain, args=(process.stdout, label, 'stdout', stdout_ring, echo), daemon=True),
+            threading.Thread(target=self._drain, args=(process.stderr, label, 'stderr', stderr_ring, echo), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        returncode = process.wait()
+        for reader in readers:
+            reader.join()
+        self.logger.info(f'[{label}] exited with {returncode}')
+
+        stdout_tail = '\n'.join(stdout_ring)
+        stderr_tail = '\n'.join(stderr_ring)
+        if check and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command, output=stdout_tail, stderr=stderr_tail)
+        return subprocess.CompletedProcess(command, returncode, stdout=stdout_tail, stderr=stderr_tail)
@@ -0,0 +1,477 @@
+'''Distributed build workers for PUP (Pip Universal Projects)
+
+    A worker daemon runs on every build machine:
+        python build_workers.py worker --port 8765 --capacity 4
+
+    The coordinator ships build/test jobs (the project's source tree plus its
+    pyproject.toml) to the workers over TCP, and streams the logs and the
+    built artifacts back:
+        python build_workers.py coordinate --worker buildhost1:8765 --worker buildhost2:8765 projects/A projects/B
+
+    Scheduling is locality-aware: every worker keeps a per-project directory
+    (sources, build env, test venv) between jobs, so a project is sent back
+    to the worker that already holds it (projects are told apart by their
+    directory name plus a hash of its absolute path). The sources are only
+    re-sent when their fingerprint changed. Several workers on localhost
+    (different ports) are a valid stand-in for several machines.
+
+    Wire protocol (both directions): a 4 byte big-endian length, a JSON
+    header of that length and, if the header has a `payload_size`, that many
+    raw bytes. A worker checks the header's token (and the payload size,
+    --max-payload-mb) before it reads any payload.
+
+    Security: a worker builds (so runs) whatever it's sent. It listens on
+    127.0.0.1 unless told otherwise (--host), and every request must carry
+    the shared secret token: --token or $PUP_PY_WORKER_TOKEN, else the one
+    generated into <work directory>/token (which coordinators on the same
+    machine read). Only expose a worker on networks you trust, with a token
+    of your own.
+'''
+
+import os, io, re, sys, hmac, json, time, struct, shutil, socket, hashlib, secrets, tarfile, argparse, threading, subprocess, socketserver
+from concurrent.futures import ThreadPoolExecutor
+from print_tricks import pt
+
+from fix_and_optimize import DEFAULT_EXCLUDED_FOLDERS
+
+
+DEFAULT_PORT = 8765
+DEFAULT_WORK_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'pup_py', 'worker')
+TOKEN_ENV_VAR = 'PUP_PY_WORKER_TOKEN'
+DEFAULT_MAX_PAYLOAD_SIZE = 512 * 1024 ** 2
+MAX_HEADER_SIZE = 1024 ** 2
+_LENGTH = struct.Struct('>I')
+
+## Names a client sends that end up in paths / on command lines
+PROJECT_NAME = re.compile(r'^[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?$')  ## PEP 508 name
+MODULE_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*$')
+
+
+def load_token(work_directory=None, token=None, create=False):
+    '''The shared secret: `token`, else $PUP_PY_WORKER_TOKEN, else <work directory>/token
+    (generated, readable by the owner only, if `create`).'''
+    token = token or os.getenv(TOKEN_ENV_VAR)
+    if token:
+        return token
+    token_path = os.path.join(work_directory or DEFAULT_WORK_DIRECTORY, 'token')
+    if os.path.exists(token_path):
+        with open(token_path, 'r') as file:
+            return file.read().strip()
+    if not create:
+        raise ValueError(f'No worker token: pass --token, set ${TOKEN_ENV_VAR} or start a worker that writes {token_path}')
+    os.makedirs(os.path.dirname(token_path), exist_ok=True)
+    token = secrets.token_hex(32)
+    file_descriptor = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(file_descriptor, 'w') as file:
+        file.write(token)
+    return token
+
+
+def send_message(sock_file, header, payload=b''):
+    if payload:
+        header = dict(header, payload_size=len(payload))
+    encoded_header = json.dumps(header).encode('utf-8')
+    sock_file.write(_LENGTH.pack(len(encoded_header)) + encoded_header)
+    if payload:
+        sock_file.write(payload)
+    sock_file.flush()
+
+def _read_exactly(sock_file, size):
+    data = sock_file.read(size)
+    if data is None or len(data) != size:
+        raise ConnectionError('Connection closed in the middle of a message')
+    return data
+
+def receive_header(sock_file):
+    '''The next message's header (its payload, if any, is still to be read), or None once the other side hung up.'''
+    length_bytes = sock_file.read(_LENGTH.size)
+    if not length_bytes:
+        return None
+    if len(length_bytes) != _LENGTH.size:
+        raise ConnectionError('Connection closed in the middle of a message')
+    header_size = _LENGTH.unpack(length_bytes)[0]
+    if header_size > MAX_HEADER_SIZE:
+        raise ConnectionError(f'Message header of {header_size} bytes refused')
+    header = json.loads(_read_exactly(sock_file, header_size).decode('utf-8'))
+    if not isinstance(header, dict):
+        raise ConnectionError('Malformed message header')
+    return header
+
+def receive_payload(sock_file, header):
+    payload_size = header.get('payload_size', 0)
+    return _read_exactly(sock_file, payload_size) if payload_size else b''
+
+def receive_message(sock_file):
+    '''Returns (header, payload), or (None, b'') once the other side hung up.'''
+    header = receive_header(sock_file)
+    if header is None:
+        return None, b''
+    return header, receive_payload(sock_file, header)
+
+
+def project_id(project_directory):
+    '''The directory name plus a hash of its absolute path: same-named projects don't share a worker directory.'''
+    absolute_path = os.path.abspath(project_directory)
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', os.path.basename(os.path.normpath(absolute_path))).strip('._-') or 'project'
+    return f'{name}-{hashlib.sha256(absolute_path.encode("utf-8")).hexdigest()[:12]}'
+
+def _iter_source_files(project_directory, excluded_folders=None):
+    excludes = set(DEFAULT_EXCLUDED_FOLDERS) | set(f for f in (excluded_folders or []) if f)
+    for root, dirs, files in os.walk(project_directory):
+        dirs[:] = sorted(d for d in dirs if d not in excludes)
+        for file in sorted(files):
+            if file.endswith(('.pyc', '.pyo')):
+                continue
+            path = os.path.join(root, file)
+            if not os.path.isfile(path):
+                continue  ## Dangling symlink
+            yield path, os.path.relpath(path, project_directory).replace(os.sep, '/')
+
+def pack_source_tree(project_directory, pyproject_path=None, excluded_folders=None):
+    '''Returns (fingerprint, tar.gz bytes) of the project sources. A pyproject
+    living outside the tree (e.g. pup_py's build_dist one) is added at the root.
+    Symlinked files are packed as the files they point to (workers refuse links).'''
+    fingerprint = hashlib.sha256()
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz', dereference=True) as tar:
+        members = list(_iter_source_files(project_directory, excluded_folders))
+        if pyproject_path and os.path.dirname(os.path.abspath(pyproject_path)) != os.path.abspath(project_directory):
+            members = [m for m in members if m[1] != 'pyproject.toml'] + [(pyproject_path, 'pyproject.toml')]
+        for path, archive_name in members:
+            with open(path, 'rb') as file:
+                fingerprint.update(archive_name.encode('utf-8') + b'\0' + hashlib.sha256(file.read()).digest())
+            tar.add(path, arcname=archive_name, recursive=False)
+    return fingerprint.hexdigest(), buffer.getvalue()
+
+def _safe_extract(payload, destination):
+    with tarfile.open(fileobj=io.BytesIO(payload), mode='r:gz') as tar:
+        destination = os.path.realpath(destination)
+        for member in tar.getmembers():
+            target = os.path.realpath(os.path.join(destination, member.name))
+            if not (target == destination or target.startswith(destination + os.sep)) or member.issym() or member.islnk():
+                raise ValueError(f'Refusing to extract unsafe member {member.name!r}')
+        tar.extractall(destination)
+
+
+class _WorkerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        worker = self.server.worker
+        while True:
+            try:
+                header = receive_header(self.rfile)
+            except (ConnectionError, ValueError) as e:
+                send_message(self.wfile, {'type': 'error', 'message': str(e)})
+                return
+            if header is None:
+                return
+            ## Nothing the client sized is read (or allocated) before it's authenticated
+            if not hmac.compare_digest(str(header.get('token', '')).encode('utf-8'), worker.token.encode('utf-8')):
+                send_message(self.wfile, {'type': 'error', 'message': 'Invalid worker token'})
+                return
+            payload_size = header.get('payload_size', 0)
+            if not isinstance(payload_size, int) or not 0 <= payload_size <= worker.max_payload_size:
+                send_message(self.wfile, {'type': 'error', 'message': f'Payload of {payload_size!r} bytes refused (max {worker.max_payload_size})'})
+                return
+            payload = receive_payload(self.rfile, header)
+            if header['type'] == 'hello':
+                send_message(self.wfile, worker.status())
+            elif header['type'] == 'job':
+                worker.run_job(header, payload, self.wfile)
+            else:
+                send_message(self.wfile, {'type': 'error', 'message': f"Unknown message type {header['type']!r}"})
+
+
+class BuildWorker:
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, work_directory=None, capacity=None, token=None,
+            max_payload_size=DEFAULT_MAX_PAYLOAD_SIZE):
+        self.host = host
+        self.port = port
+        self.work_directory = work_directory or DEFAULT_WORK_DIRECTORY
+        self.token = load_token(self.work_directory, token, create=True)
+        self.capacity = capacity or os.cpu_count() or 1
+        self.max_payload_size = max_payload_size
+        self.job_slots = threading.BoundedSemaphore(self.capacity)
+        self.active_jobs = 0
+        self.state_lock = threading.Lock()
+        self.project_locks = {}
+        os.makedirs(self.work_directory, exist_ok=True)
+
+    def _project_directory(self, project_id):
+        return os.path.join(self.work_directory, 'projects', project_id)
+
+    def _cached_fingerprints(self):
+        fingerprints = {}
+        projects_directory = os.path.join(self.work_directory, 'projects')
+        if os.path.isdir(projects_directory):
+            for project_id in os.listdir(projects_directory):
+                fingerprint_path = os.path.join(projects_directory, project_id, 'fingerprint')
+                if os.path.exists(fingerprint_path):
+                    with open(fingerprint_path, 'r') as file:
+                        fingerprints[project_id] = file.read().strip()
+        return fingerprints
+
+    def status(self):
+        return {
+            'type': 'hello',
+            'capacity': self.capacity,
+            'active_jobs': self.active_jobs,
+            'cached_projects': self._cached_fingerprints(),
+        }
+
+    def _stream_command(self, command, cwd, wfile, step):
+        '''Runs a command, forwarding every output line to the coordinator as it's produced.'''
+        process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, errors='replace', bufsize=1)
+        for line in process.stdout:
+            send_message(wfile, {'type': 'log', 'step': step, 'line': line.rstrip('\n')})
+        return process.wait()
+
+    def run_job(self, header, payload, wfile):
+        project_id = header.get('project_id')
+        if not isinstance(project_id, str) or not PROJECT_NAME.match(project_id):
+            send_message(wfile, {'type': 'result', 'passed': False, 'failed_step': 'worker', 'message': f'Invalid project id {project_id!r}'})
+            return
+        if 'test' in header.get('steps', ['build', 'test']):
+            package_name = header.get('package_name')
+            if not isinstance(package_name, str) or not MODULE_NAME.match(package_name):
+                send_message(wfile, {'type': 'result', 'passed': False, 'failed_step': 'worker', 'message': f'Invalid package name {package_name!r}'})
+                return
+        project_directory = self._project_directory(project_id)
+        source_directory = os.path.join(project_directory, 'src')
+        output_directory = os.path.join(project_directory, 'dist')
+
+        with self.state_lock:
+            project_lock = self.project_locks.setdefault(project_id, threading.Lock())
+        with self.job_slots, project_lock:
+            with self.state_lock:
+                self.active_jobs += 1
+            try:
+                ## Sources: reuse the cached tree if the coordinator didn't send a new one
+                fingerprint_path = os.path.join(project_directory, 'fingerprint')
+                if payload:
+                    shutil.rmtree(source_directory, ignore_errors=True)
+                    os.makedirs(source_directory)
+                    _safe_extract(payload, source_directory)
+                    with open(fingerprint_path, 'w') as file:
+                        file.write(header['source_fingerprint'])
+                elif self._cached_fingerprints().get(project_id) != header['source_fingerprint']:
+                    send_message(wfile, {'type': 'result', 'passed': False, 'failed_step': 'sources',
+                        'message': 'Sources are not cached on this worker'})
+                    return
+
+                shutil.rmtree(output_directory, ignore_errors=True)
+                returncode = self._stream_command(
+                    [sys.executable, '-m', 'build', '--wheel', '--outdir', output_directory],
+                    source_directory, wfile, 'build')
+                if returncode != 0:
+                    send_message(wfile, {'type': 'result', 'passed': False, 'failed_step': 'build', 'returncode': returncode})
+                    return
+
+                artifacts = sorted(os.listdir(output_directory))
+                for artifact in artifacts:
+                    with open(os.path.join(output_directory, artifact), 'rb') as file:
+                        send_message(wfile, {'type': 'artifact', 'name': artifact}, file.read())
+
+                if 'test' in header.get('steps', ['build', 'test']):
+                    returncode = self._test_wheel(project_directory, output_directory, artifacts, header, wfile)
+                    if returncode != 0:
+                        send_message(wfile, {'type': 'result', 'passed': False, 'failed_step': 'test', 'returncode': returncode})
+                        return
+
+                send_message(wfile, {'type': 'result', 'passed': True, 'artifacts': artifacts})
+            except Exception as e:
+                send_message(wfile, {'type': 'result', 'passed': False, 'failed_step': 'worker', 'message': repr(e)})
+            finally:
+                with self.state_lock:
+                    self.active_jobs -= 1
+
+    def _test_wheel(self, project_directory, output_directory, artifacts, header, wfile):
+        ## The test venv is kept per project: that's the "cache" the scheduler is local to
+        venv_directory = os.path.join(project_directory, 'venv')
+        venv_python = os.path.join(venv_directory, 'Scripts' if os.name == 'nt' else 'bin', 'python.exe' if os.name == 'nt' else 'python')
+        if not os.path.exists(venv_python):
+            returncode = self._stream_command([sys.executable, '-m', 'venv', venv_directory], project_directory, wfile, 'test')
+            if returncode != 0:
+                return returncode
+        wheels = [os.path.join(output_directory, a) for a in artifacts if a.endswith('.whl')]
+        returncode = self._stream_command([venv_python, '-m', 'pip', 'install', '--force-reinstall', *wheels],
+            project_directory, wfile, 'test')
+        if returncode != 0:
+            return returncode
+        ## The name is an argument, never part of the code
+        return self._stream_command([venv_python, '-c', "import sys, importlib; importlib.import_module(sys.argv[1]); print('Imported', sys.argv[1])",
+            header['package_name']], project_directory, wfile, 'test')
+
+    def serve_forever(self):
+        server = socketserver.ThreadingTCPServer((self.host, self.port), _WorkerHandler)
+        server.daemon_threads = True
+        server.worker = self
+        self.port = server.server_address[1]
+        print(f'pup_py build worker listening on {self.host}:{self.port} (capacity {self.capacity}, cache {self.work_directory})')
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+class BuildCoordinator:
+    def __init__(self, workers, output_directory, token=None):
+        '''workers: list of (host, port).'''
+        self.workers = [tuple(worker) for worker in workers]
+        self.output_directory = output_directory
+        self.token = load_token(token=token)
+        os.makedirs(self.output_directory, exist_ok=True)
+
+    def _connect(self, worker):
+        sock = socket.create_connection(worker)
+        return sock, sock.makefile('rwb')
+
+    def _worker_status(self, worker):
+        try:
+            sock, sock_file = self._connect(worker)
+        except OSError as e:
+            print(f'Worker {worker[0]}:{worker[1]} is unreachable: {e}')
+            return None
+        with sock, sock_file:
+            send_message(sock_file, {'type': 'hello', 'token': self.token})
+            header, _ = receive_message(sock_file)
+            if header is None or header['type'] != 'hello':
+                print(f"Worker {worker[0]}:{worker[1]} refused the connection: {(header or {}).get('message')}")
+                return None
+            return header
+
+    def schedule(self, jobs, statuses):
+        '''Locality first (a worker that already holds the project), then the
+        least loaded worker relative to its capacity.'''
+        load = {worker: status['active_jobs'] for worker, status in statuses.items()}
+        assignments = []
+        for job in jobs:
+            local_workers = [w for w, s in statuses.items() if job['project_id'] in s['cached_projects']]
+            candidates = local_workers or list(statuses)
+            worker = min(candidates, key=lambda w: (load[w] + 1) / statuses[w]['capacity'])
+            load[worker] += 1
+            assignments.append((job, worker))
+        return assignments
+
+    def _run_job(self, job, worker, status):
+        project_name = job['project_name']
+        project_output = os.path.join(self.output_directory, job['project_id'])
+        os.makedirs(project_output, exist_ok=True)
+        prefix = f'[{worker[0]}:{worker[1]} {project_name}]'
+
+        header = {key: value for key, value in job.items() if key != 'payload'}
+        header['type'] = 'job'
+        header['token'] = self.token
+        ## Don't resend sources the worker already holds
+        payload = b'' if status['cached_projects'].get(job['project_id']) == job['source_fingerprint'] else job['payload']
+        if not payload:
+            print(f'{prefix} sources already cached on the worker')
+
+        start_time = time.perf_counter()
+        result = {'project_name': project_name, 'worker': f'{worker[0]}:{worker[1]}', 'passed': False, 'artifacts': []}
+        sock, sock_file = self._connect(worker)
+        with sock, sock_file, open(os.path.join(project_output, 'build.log'), 'w') as log_file:
+            send_message(sock_file, header, payload)
+            while True:
+                message, message_payload = receive_message(sock_file)
+                if message is None:
+                    result['failed_step'] = 'connection'
+                    break
+                if message['type'] == 'log':
+                    log_file.write(f"[{message['step']}] {message['line']}\n")
+                    print(f"{prefix} {message['line']}")
+                elif message['type'] == 'artifact':
+                    artifact_path = os.path.join(project_output, os.path.basename(message['name']))
+                    with open(artifact_path, 'wb') as file:
+                        file.write(message_payload)
+                    result['artifacts'].append(artifact_path)
+                elif message['type'] == 'result':
+                    result['passed'] = message['passed']
+                    result['failed_step'] = message.get('failed_step')
+                    result['message'] = message.get('message', '')
+                    break
+        result['seconds'] = time.perf_counter() - start_time
+        return result
+
+    def run(self, projects):
+        '''projects: list of dicts with project_directory and optionally
+        package_name, pyproject_path, steps. Returns one result per project.'''
+        statuses = {}
+        for worker in self.workers:
+            status = self._worker_status(worker)
+            if status is not None:
+                statuses[worker] = status
+        if not statuses:
+            raise ConnectionError('No build workers are reachable.')
+
+        jobs = []
+        for project in projects:
+            project_directory = project['project_directory']
+            fingerprint, payload = pack_source_tree(project_directory, project.get('pyproject_path'), project.get('excluded_folders'))
+            project_name = os.path.basename(os.path.normpath(project_directory))
+            jobs.append({
+                'project_name': project_name,
+                'project_id': project_id(project_directory),
+                'package_name': project.get('package_name') or project_name.replace('-', '_'),
+                'source_fingerprint': fingerprint,
+                'steps': project.get('steps', ['build', 'test']),
+                'payload': payload,
+            })
+
+        assignments = self.schedule(jobs, statuses)
+        for job, worker in assignments:
+            pt.c(f"-- {job['project_name']} -> {worker[0]}:{worker[1]}")
+
+        with ThreadPoolExecutor(max_workers=len(assignments) or 1) as executor:
+            futures = [executor.submit(self._run_job, job, worker, statuses[worker]) for job, worker in assignments]
+            results = []
+            for (job, worker), future in zip(assignments, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append({'project_name': job['project_name'], 'worker': f'{worker[0]}:{worker[1]}',
+                        'passed': False, 'failed_step': 'connection', 'message': repr(e), 'artifacts': [], 'seconds': 0.0})
+        return results
+
+    @staticmethod
+    def print_results(results):
+        for result in results:
+            status = 'PASS' if result['passed'] else f"FAIL ({result.get('failed_step')})"
+            print(f"{result['project_name']:<40} {result['worker']:<22} {status:<20} {result['seconds']:>8.2f}s")
+
+
+def _parse_worker_address(address):
+    host, _, port = address.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+def main():
+    parser = argparse.ArgumentParser(description='pup_py distributed build workers')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    worker_parser = subparsers.add_parser('worker', help='Run a build worker daemon')
+    worker_parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on (default: localhost only)')
+    worker_parser.add_argument('--token', default=None, help=f'Shared secret (default: ${TOKEN_ENV_VAR}, else a generated one)')
+    worker_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    worker_parser.add_argument('--capacity', type=int, default=None, help='Concurrent jobs (default: cpu count)')
+    worker_parser.add_argument('--work-directory', default=None)
+    worker_parser.add_argument('--max-payload-mb', type=int, default=DEFAULT_MAX_PAYLOAD_SIZE // 1024 ** 2, help='Largest source tree accepted')
+
+    coordinator_parser = subparsers.add_parser('coordinate', help='Build/test projects on the workers')
+    coordinator_parser.add_argument('--worker', action='append', required=True, help='host:port (repeatable)')
+    coordinator_parser.add_argument('--token', default=None, help=f'The workers\' shared secret (default: ${TOKEN_ENV_VAR}, else the local worker\'s)')
+    coordinator_parser.add_argument('--output-directory', default=os.path.join(os.getcwd(), 'build_dist', 'distributed'))
+    coordinator_parser.add_argument('project_directories', nargs='+')
+
+    args = parser.parse_args()
+    if args.command == 'worker':
+        BuildWorker(args.host, args.port, args.work_directory, args.capacity, args.token,
+            args.max_payload_mb * 1024 ** 2).serve_forever()
+    else:
+        coordinator = BuildCoordinator([_parse_worker_address(w) for w in args.worker], args.output_directory, args.token)
+        results = coordinator.run([{'project_directory': d} for d in args.project_directories])
+        coordinator.print_results(results)
+        sys.exit(0 if all(r['passed'] for r in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,47 @@
-import os, argparse, subprocess
+import os, sys, argparse, subprocess
 from print_tricks import pt
 pt.easy_imports('pup_py')
 
 
-from main import main  # Assuming the main functionality is in a function called `main_function`
+from conflict_policies import POLICIES
+import pup_server
+
+SERVER_COMMANDS = ('serve', 'submit', 'status')
 
 def main():
+    ## Server mode: `pup_py serve`, `pup_py submit ...`, `pup_py status` (see pup_server.py)
+    if sys.argv[1:2] and sys.argv[1] in SERVER_COMMANDS:
+        pup_server.main(sys.argv[1:])
+        return
+    from main import PipUniversalProjects  ## Not needed by the (fast starting) server clients
+    
     parser = argparse.ArgumentParser(description="Pip Universal Projects CLI")
+    parser.add_argument('project_directory', nargs='?', default=os.getcwd(), help='Project directory (or git url) to package. Defaults to the current directory')
     parser.add_argument('--run', action='store_true', help='Run the packaging and upload process')
+    parser.add_argument('--watch', action='store_true', help='After the first run, keep watching the project and rerun only the affected steps on every change')
+    parser.add_argument('--force-step', action='append', default=[], metavar='STEP', help="Rerun this step even if its inputs are unchanged (repeatable, or 'all')")
+    parser.add_argument('--conflict-policy', choices=POLICIES, default=None, help='How to resolve a taken name/version without asking (default: $PUP_PY_CONFLICT_POLICY, or prompt)')
+    parser.add_argument('--profile', action='store_true', help='Write cProfile, tracemalloc and flame graph (collapsed stacks) reports of every step to the distribution directory')
+    parser.add_argument('--remote-cache', default=None, metavar='URL', help='Remote build cache (see remote_build_cache.py). Defaults to $PUP_PY_REMOTE_CACHE_URL')
+    parser.add_argument('--dev', action='store_true', help='Dev loop: editable install into distribution_directory/dev_env, then only the tests (a wheel is built only when the packaging metadata changes)')
+    parser.add_argument('--full-tests', action='store_true', help="Run the project's whole test suite, not only the tests affected by the changes since the last successful run")
+    parser.add_argument('--import-time-policy', choices=['warn', 'fail', 'off'], default='warn', help="What an import time regression against the previous release does (see import_time_report.py)")
+    parser.add_argument('--zipapp', action='store_true', help='Also build a single file executable (.pyz) of the wheel and its dependencies into the exe distribution directory')
     args = parser.parse_args()
 
-    if args.run:
-        main()
-
+    if args.run or args.watch:
+        PipUniversalProjects(
+            project_directory=args.project_directory,
+            watch=args.watch,
+            force_steps=args.force_step,
+            conflict_policy=args.conflict_policy,
+            profile=args.profile,
+            remote_cache_url=args.remote_cache,
+            dev_mode=args.dev,
+            full_test_run=args.full_tests,
+            import_time_policy=args.import_time_policy,
+            zipapp=args.zipapp,
+        )
 
 # def is_running_in_vscode():
 #     # Check for typical VS Code environment variables
@@ -0,0 +1,153 @@
+'''ccache-style compiler output cache for C/C++ extension builds.
+
+    Used as the compiler of setuptools' build_ext (CC/CXX point to
+    `python compiler_cache.py <real compiler>`):
+    - a compile of one translation unit (`-c source -o object`) is keyed on
+      the compiler, its flags and the *preprocessed* source (so header
+      changes are seen), and the object file is reused on a hit, across
+      builds (the build directory is wiped each time) and projects (for
+      debug builds, -g, only within the same directory, as with ccache)
+    - the preprocessed source holds the paths of the headers: without -g it
+      is preprocessed without line markers (-P), and with -g (the default
+      CFLAGS of most interpreters) the random part of isolated build env
+      paths is normalized, so builds in a fresh env still hit
+    - everything else (linking, preprocessing, multiple sources) is passed
+      straight to the real compiler
+
+    Objects live in cache_directory/compiler_cache/<aa>/<key>.o. Only the
+    standard library is used: the wrapper runs inside the build backend.
+'''
+
+import os, re, sys, shlex, shutil, hashlib, sysconfig, subprocess
+
+
+CACHE_DIRECTORY_ENV_VAR = 'PUP_PY_COMPILER_CACHE_DIR'
+SOURCE_SUFFIXES = ('.c', '.cc', '.cpp', '.cxx', '.c++', '.m', '.mm')
+## Bump when the key computation changes
+COMPILER_CACHE_VERSION = 2
+## The temporary directories of isolated build envs (build's build-env-*, pip's pip-build-env-*), new on every build
+BUILD_ENV_DIRECTORY = re.compile(rb'(?:pip-)?build-env-[A-Za-z0-9_]+')
+
+
+def compiler_cache_environment(cache_directory, environment=None):
+    '''Environment making setuptools compile (and link) through this wrapper.'''
+    environment = dict(os.environ if environment is None else environment)
+    wrapper = f'{shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))}'
+    for variable in ('CC', 'CXX'):
+        real_compiler = environment.get(variable) or sysconfig.get_config_var(variable) or ('cc' if variable == 'CC' else 'c++')
+        if os.path.abspath(__file__) not in real_compiler:
+            environment[variable] = f'{wrapper} {real_compiler}'
+    environment[CACHE_DIRECTORY_ENV_VAR] = os.path.join(cache_directory, 'compiler_cache')
+    return environment
+
+def _compiler_identity(compiler):
+    '''Path + size + mtime of the compiler binary (a compiler upgrade invalidates the cache).'''
+    path = shutil.which(compiler) or compiler
+    try:
+        stat = os.stat(path)
+        return f'{os.path.realpath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}'
+    except OSError:
+        return path
+
+def _split_compile_command(arguments):
+    '''(flags without -c/-o/source, source, object) of a single-source compile, else None.'''
+    if '-c' not in arguments:
+        return None
+    flags, sources, output = [], [], None
+    i = 0
+    while i < len(arguments):
+        argument = arguments[i]
+        if argument == '-o' and i + 1 < len(arguments):
+            output = arguments[i + 1]
+            i += 2
+            continue
+        if argument.startswith('-o') and len(argument) > 2:
+            output = argument[2:]
+        elif argument == '-c':
+            pass
+        elif not argument.startswith('-') and argument.lower().endswith(SOURCE_SUFFIXES):
+            sources.append(argument)
+        else:
+            flags.append(argument)
+        i += 1
+    ## Dependency files (-MD...) are side outputs we don't cache
+    if len(sources) != 1 or output is None or any(flag.startswith('-M') for flag in flags):
+        return None
+    return flags, sources[0], output
+
+def _without_include_directories(flags):
+    kept, skip_next = [], False
+    for flag in flags:
+        if skip_next:
+            skip_next = False
+        elif flag in ('-I', '-isystem', '-iquote', '-idirafter'):
+            skip_next = True
+        elif not flag.startswith(('-I', '-isystem', '-iquote', '-idirafter')):
+            kept.append(flag)
+    return kept
+
+def cached_compile(compiler, arguments, cache_directory):
+    '''Runs one compiler invocation, through the cache when possible. Returns the exit code.'''
+    command = shlex.split(compiler) + arguments
+    split = _split_compile_command(arguments)
+    if split is None or not cache_directory:
+        return subprocess.call(command)
+    flags, source, output = split
+
+    debug = any(flag.startswith('-g') and flag != '-g0' for flag in flags)
+    ## Line markers (# 1 "/path/to/header.h") only end up in the object through debug info
+    preprocess_flags = ['-E'] if debug else ['-E', '-P']
+    preprocessed = subprocess.run(shlex.split(compiler) + flags + [*preprocess_flags, source], capture_output=True)
+    if preprocessed.returncode != 0:
+        return subprocess.call(command)  ## Let the real compile report the error
+    key = hashlib.sha256()
+    key.update(f'{COMPILER_CACHE_VERSION}\0{_compiler_identity(shlex.split(compiler)[0])}\0{compiler}\0'.encode('utf-8'))
+    ## Include directories only matter through the headers they provide, which are in the
+    ## preprocessed source (isolated build envs add a random, empty one on every build)
+    key.update('\0'.join(_without_include_directories(flags)).encode('utf-8'))
+    if debug:
+        key.update(os.getcwd().encode('utf-8'))  ## Debug info embeds the build directory
+    key.update(b'\0')
+    ## A hit keeps the env paths of the build that stored the object: that env is gone either way
+    key.update(BUILD_ENV_DIRECTORY.sub(b'build-env', preprocessed.stdout))
+    digest = key.hexdigest()
+    cached_object = os.path.join(cache_directory, digest[:2], f'{digest}.o')
+
+    if os.path.exists(cached_object):
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        shutil.copyfile(cached_object, output)
+        os.utime(cached_object)  ## Recently used (see trim_cache)
+        sys.stderr.write(f'compiler cache: hit {source}\n')
+        return 0
+
+    returncode = subprocess.call(command)
+    if returncode == 0 and os.path.exists(output):
+        os.makedirs(os.path.dirname(cached_object), exist_ok=True)
+        temp_path = f'{cached_object}.{os.getpid()}.tmp'
+        shutil.copyfile(output, temp_path)
+        os.replace(temp_path, cached_object)
+    return returncode
+
+def trim_cache(cache_directory, max_bytes=2 * 1024 ** 3):
+    '''Removes the least recently used objects past `max_bytes`. Returns how many were removed.'''
+    compiler_cache_directory = os.path.join(cache_directory, 'compiler_cache')
+    objects = []
+    for root, _, files in os.walk(compiler_cache_directory):
+        for file in files:
+            path = os.path.join(root, file)
+            stat = os.stat(path)
+            objects.append((stat.st_mtime, stat.st_size, path))
+    total_bytes = sum(size for _, size, _ in objects)
+    removed = 0
+    for _, size, path in sorted(objects):
+        if total_bytes <= max_bytes:
+            break
+        os.remove(path)
+        total_bytes -= size
+        removed += 1
+    return removed
+
+
+if __name__ == '__main__':
+    ## compiler_cache.py <real compiler> <compiler arguments...>
+    sys.exit(cached_compile(sys.argv[1], sys.argv[2:], os.environ.get(CACHE_DIRECTORY_ENV_VAR)))
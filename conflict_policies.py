@@ -0,0 +1,111 @@
+'''Declarative resolution of release conflicts, so batch runs never block.
+
+    Conflicts:
+    - name_taken:     the package name exists on the index and isn't ours
+    - version_taken:  the version was already released (or its file uploaded)
+    - version_lower:  the version is lower than the latest release
+
+    Policies:
+    - prompt:         ask (answers queued up front are used first, see PromptQueue)
+    - bump_patch:     the next free patch version after the latest release
+    - bump_minor:     the next free minor version after the latest release
+    - fail:           raise ConflictPolicyError
+    - skip:           raise SkipProject (the project is skipped, the batch goes on)
+    - rename_suffix:  (name_taken only) append a suffix to the package name
+
+    A policy can be one name for every conflict, or a {conflict: policy} dict.
+    A policy that doesn't apply to a conflict (e.g. bump_patch for
+    name_taken) falls back to prompt. The global default comes from the
+    PUP_PY_CONFLICT_POLICY environment variable.
+'''
+
+import os, sys, json, threading
+from print_tricks import pt
+
+from decorators import StepFailure
+
+
+CONFLICTS = ('name_taken', 'version_taken', 'version_lower')
+POLICIES = ('prompt', 'bump_patch', 'bump_minor', 'fail', 'skip', 'rename_suffix')
+APPLICABLE_POLICIES = {
+    'name_taken': ('prompt', 'fail', 'skip', 'rename_suffix'),
+    'version_taken': ('prompt', 'bump_patch', 'bump_minor', 'fail', 'skip'),
+    'version_lower': ('prompt', 'bump_patch', 'bump_minor', 'fail', 'skip'),
+}
+
+
+class ConflictPolicyError(StepFailure):
+    '''A conflict that the policy says must stop the release (or that nobody can answer).'''
+
+class SkipProject(Exception):
+    '''The policy says to skip this project.'''
+
+
+class ConflictPolicy:
+    def __init__(self, policy='prompt', rename_suffix=None):
+        policies = policy if isinstance(policy, dict) else {conflict: policy for conflict in CONFLICTS}
+        unknown = [p for p in policies.values() if p not in POLICIES] + [c for c in policies if c not in CONFLICTS]
+        if unknown:
+            raise ValueError(f'Unknown conflict policies/conflicts {unknown} (policies: {POLICIES}, conflicts: {CONFLICTS})')
+        self.policies = {conflict: policies.get(conflict, 'prompt') for conflict in CONFLICTS}
+        self.rename_suffix = rename_suffix
+
+    @classmethod
+    def create(cls, policy=None, automatically_increment_version=False, rename_suffix=None):
+        '''`automatically_increment_version` is the historical spelling of bump_patch.'''
+        if isinstance(policy, cls):
+            return policy
+        if policy is None:
+            policy = 'bump_patch' if automatically_increment_version else os.environ.get('PUP_PY_CONFLICT_POLICY', 'prompt')
+        return cls(policy, rename_suffix)
+
+    def for_conflict(self, conflict):
+        policy = self.policies[conflict]
+        return policy if policy in APPLICABLE_POLICIES[conflict] else 'prompt'
+
+
+class PromptQueue:
+    '''Answers to conflict prompts, per project and prompt key.
+
+    Answers can be given up front (`add`, `load`, or by running the checks
+    once in recording mode, see pypi_verifier.queue_answers_up_front), so
+    the release runs themselves never wait on a human. A prompt without a
+    queued answer is only asked if a human can answer it (one at a time),
+    otherwise it raises ConflictPolicyError.'''
+    def __init__(self, answers=None, interactive=None):
+        self.answers = {}
+        self.interactive = sys.stdin.isatty() if interactive is None else interactive
+        self.recording = False
+        self.lock = threading.Lock()
+        for (project, key), values in (answers or {}).items():
+            for value in (values if isinstance(values, list) else [values]):
+                self.add(project, key, value)
+
+    def add(self, project, key, answer):
+        with self.lock:
+            self.answers.setdefault((project, key), []).append(answer)
+
+    def answer(self, project, key, question, ask, default=None):
+        '''The next queued answer, else asks (via `ask(question, default)`) if possible.'''
+        with self.lock:
+            queued = self.answers.get((project, key))
+            if queued and not self.recording:
+                return queued.pop(0)
+            if not self.interactive:
+                raise ConflictPolicyError(f"No answer queued for '{key}' of {project} and nobody can be asked: {question.splitlines()[0]}")
+            answer = ask(question, default)
+            if self.recording:
+                self.answers.setdefault((project, key), []).append(answer)
+            return answer
+
+    def save(self, path):
+        with self.lock:
+            data = [{'project': project, 'key': key, 'answers': answers} for (project, key), answers in self.answers.items()]
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, indent=4)
+
+    @classmethod
+    def load(cls, path, interactive=None):
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        return cls({(entry['project'], entry['key']): entry['answers'] for entry in data}, interactive)
@@ -1,11 +1,76 @@
+import time
 from print_tricks import pt
 
+
+class StepFailure(Exception):
+    '''A step failed: the run stops there (instead of the whole process exiting).'''
+
+
+def step_inputs(files=(), options=(), remote=None, ttl=0, outputs=(), on_restore=None):
+    '''Declares what a step depends on and what it sets, so it can be skipped
+    (and its outputs restored from the step cache) when nothing changed.
+    See step_cache.py for the meaning of each argument.'''
+    def decorator(func):
+        func.step_inputs = {
+            'files': list(files),
+            'options': list(options),
+            'remote': remote,
+            'ttl': ttl,
+            'outputs': list(outputs),
+            'on_restore': on_restore,
+        }
+        return func
+    return decorator
+
 def step_decorator(func):
+    inputs = getattr(func, 'step_inputs', None)
     def wrapper(self, *args, **kwargs):
         self.steps_counter += 1
         step_name = func.__name__.replace('_', ' ').title()
         pt.c(f'\n------------------------{self.steps_counter} {step_name}------------------------')
+
+        ## Structured result of every step (nested steps included), in the order they started
+        result = {'step': func.__name__, 'status': 'passed', 'seconds': None, 'error': None}
+        step_results = getattr(self, 'step_results', None)
+        if step_results is not None:
+            step_results.append(result)
+        ## e.g. the server streaming progress to its clients (see pup_server.py)
+        step_listener = getattr(self, 'step_listener', None)
+        if step_listener is not None:
+            step_listener(result, 'started')
+        start_time = time.perf_counter()
+        try:
+            ## Opt-in profiling (see step_profiler.py)
+            step_profiler = getattr(self, 'step_profiler', None)
+            if step_profiler is not None:
+                return step_profiler.profile(f'{self.steps_counter:02d}_{func.__name__}', run_step, self, result, *args, **kwargs)
+            return run_step(self, result, *args, **kwargs)
+        except BaseException as e:
+            result['status'] = 'failed'
+            result['error'] = str(e) or repr(e)
+            raise
+        finally:
+            result['seconds'] = time.perf_counter() - start_time
+            if step_listener is not None:
+                step_listener(result, 'finished')
+
+    def run_step(self, step_result, *args, **kwargs):
+        step_name = func.__name__.replace('_', ' ').title()
+
+        ## Memoized steps: skipped while their inputs are unchanged (unless forced)
+        step_cache = getattr(self, 'step_cache', None) if inputs else None
+        force_steps = getattr(self, 'force_steps', ())
+        if step_cache is not None:
+            key = step_cache.key(self, func.__name__, inputs, args, kwargs)
+            is_forced = func.__name__ in force_steps or 'all' in force_steps
+            if not is_forced and step_cache.restore(self, func.__name__, inputs, key):
+                print(f'\n - Skipped, inputs unchanged ({step_name}) - ')
+                step_result['status'] = 'skipped'
+                return None
+
         result = func(self, *args, **kwargs)
+        if step_cache is not None:
+            step_cache.record(self, func.__name__, inputs, key)
         print(f'\n - Success ({step_name}) - ')
         return result
     return wrapper
@@ -14,4 +79,4 @@ def auto_decorate_methods(cls):
     for attr_name, attr_value in cls.__dict__.items():
         if callable(attr_value) and not attr_name.startswith("__") and not attr_name.startswith("_"):
             setattr(cls, attr_name, step_decorator(attr_value))
-    return cls
\ No newline at end of file
+    return cls
@@ -0,0 +1,105 @@
+'''Dev mode: an editable install (PEP 660) instead of build + reinstall.
+
+    The project is installed once with `pip install -e` into its own venv
+    (distribution_directory/dev_env), so every source edit is live there and
+    an iteration only has to run the tests (with the venv's python).
+
+    The editable install (and one real wheel build, to check the packaging)
+    is only redone when the packaging metadata changes:
+    - the metadata files (pyproject.toml, setup.py, setup.cfg, MANIFEST.in),
+      which hold the dependencies and the entry points
+    - the set of package data files (their contents are live like the sources)
+'''
+
+import os, sys, json, hashlib, subprocess
+from print_tricks import pt
+
+from fix_and_optimize import DEFAULT_EXCLUDED_FOLDERS
+from watch_mode import METADATA_FILES
+from wheelhouse_cache import WheelhouseCache
+from artifact_store import interpreter_tag
+
+
+STATE_FILE_NAME = 'pup_py_dev_state.json'
+
+
+class DevEnvironment:
+    def __init__(self, env_directory, project_directory, cache_directory, excluded_folders=None, excluded_directories=None):
+        self.env_directory = env_directory
+        self.project_directory = os.path.abspath(project_directory)
+        self.cache_directory = cache_directory
+        self.excluded_folders = set(DEFAULT_EXCLUDED_FOLDERS) | set(f for f in (excluded_folders or []) if f)
+        self.excluded_directories = {os.path.abspath(d) for d in (excluded_directories or []) if d} | {os.path.abspath(env_directory)}
+        self.state_path = os.path.join(env_directory, STATE_FILE_NAME)
+
+    @property
+    def python(self):
+        return _venv_python(self.env_directory)
+
+    def ensure(self):
+        '''Creates the venv if needed. Returns its python.'''
+        if not os.path.exists(self.python):
+            pt.c(f'-- Creating the dev environment in {self.env_directory}')
+            subprocess.run([sys.executable, '-m', 'venv', self.env_directory], check=True)
+        return self.python
+
+    def _package_data_files(self):
+        package_data_files = []
+        for root, dirs, files in os.walk(self.project_directory):
+            dirs[:] = sorted(d for d in dirs if d not in self.excluded_folders and not d.endswith('.egg-info')
+                and os.path.join(root, d) not in self.excluded_directories)
+            for file in sorted(files):
+                if file.endswith(('.py', '.pyc', '.pyo')) or file in METADATA_FILES:
+                    continue
+                package_data_files.append(os.path.relpath(os.path.join(root, file), self.project_directory))
+        return package_data_files
+
+    def metadata_fingerprint(self):
+        fingerprint = hashlib.sha256()
+        for name in METADATA_FILES:
+            path = os.path.join(self.project_directory, name)
+            if os.path.exists(path):
+                with open(path, 'rb') as file:
+                    fingerprint.update(f'{name}\0'.encode('utf-8') + file.read() + b'\0')
+        fingerprint.update('\0'.join(self._package_data_files()).encode('utf-8'))
+        return fingerprint.hexdigest()
+
+    def is_current(self, fingerprint):
+        '''Whether the editable install was made with this metadata fingerprint.'''
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as file:
+                return json.load(file).get('metadata_fingerprint') == fingerprint
+        except (OSError, ValueError):
+            return False
+
+    def install(self, requirements, fingerprint):
+        '''(Re)installs the dependencies (from the wheelhouse) and the project in editable mode.'''
+        if requirements:
+            wheelhouse_args = WheelhouseCache(self.cache_directory, python_executable=self.python).install_arguments(requirements)
+            subprocess.run([self.python, '-m', 'pip', 'install', *requirements, *wheelhouse_args], check=True)
+        ## The editable build itself needs the build backend from the index (pip caches it)
+        subprocess.run([self.python, '-m', 'pip', 'install', '--no-deps', '--editable', self.project_directory], check=True)
+        with open(self.state_path, 'w', encoding='utf-8') as file:
+            json.dump({'metadata_fingerprint': fingerprint}, file)
+
+
+def _venv_python(env_directory):
+    if sys.platform == 'win32':
+        return os.path.join(env_directory, 'Scripts', 'python.exe')
+    return os.path.join(env_directory, 'bin', 'python')
+
+def tools_environment(cache_directory, python_executable, package='pytest'):
+    '''The python of a venv layered on `python_executable` (whose site-packages,
+    user site included, stay visible) with `package` installed: tools the tests
+    need never get installed into the interpreter under test.'''
+    env_directory = os.path.join(cache_directory, 'tools', interpreter_tag(python_executable))
+    python = _venv_python(env_directory)
+    if not os.path.exists(python):
+        pt.c(f'-- Creating the tools environment in {env_directory}')
+        subprocess.run([python_executable, '-m', 'venv', '--system-site-packages', env_directory], check=True)
+    ## Checked in the venv: the package may only be visible from the interpreter below
+    installed = subprocess.run([python, '-m', 'pip', 'show', '--quiet', package], capture_output=True).returncode == 0
+    if not installed:
+        wheelhouse_args = WheelhouseCache(cache_directory, python_executable=python).install_arguments([package])
+        subprocess.run([python, '-m', 'pip', 'install', package, *wheelhouse_args], check=True)
+    return python
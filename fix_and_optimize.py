@@ -7,6 +7,47 @@ from print_tricks import pt
 
 import os, json
 
+DEFAULT_EXCLUDED_FOLDERS = [
+    "__pycache__", # python cache
+    ".directory", # directory
+    ".Trashes", # trash
+    ".Python", # python
+    ".pybuilder", # pybuilder
+    ".ipynb_checkpoints", # ipynb checkpoints
+    ".pytest_cache", # pytest cache
+    ".venv", # virtual environment
+    ".git", # git repository
+    ".vscode", # Visual Studio Code
+    ".idea",  # JetBrains PyCharm
+    ".eclipse",  # Eclipse
+    ".classpath",  # Eclipse
+    ".project",  # Eclipse
+    ".settings",  # Eclipse
+    ".DS_Store",  # macOS Desktop Services Store
+    "build_dist", # pup_py and easy exe creator (name?)
+    "build", # common build directory
+    "dist", # common dist directory
+    "env",  # Common virtualenv directory
+    "venv",  # Common virtualenv directory
+    "bin",  # Common for executables and scripts
+    "obj",  # Common build output directory
+    "out",  # Common build output directory
+    "lib",  # Common library code directory
+    "libs",  # Common library code directory
+    "node_modules",  # Node.js modules directory
+    ".npm",  # Node.js package manager cache
+    ".cache",  # Common cache directory
+    ".next",  # Next.js build output
+    "target",  # Maven build directory
+    ".metadata",  # Used by various tools to store metadata
+    ".gradle",  # Gradle cache and settings
+    ".tmp",  # Common temporary directory
+    "tmp",  # Common temporary directory
+    "temp",  # Common temporary directory
+    ".serverless",  # Serverless framework
+    ".terraform",  # Terraform module cache
+]
+
 def find_py_directories(project_dir, excludes):
     """
     Walks through the project directory to find directories containing .py files
@@ -42,45 +83,7 @@ def create_init_files(directories, distribution_dir):
         json.dump(created_init_in_dirs, f)
 
 def create_init_files_main(project_dir, distribution_dir, user_options):
-    _excludes = [
-        "__pycache__", # python cache
-        ".directory", # directory
-        ".Trashes", # trash
-        ".Python", # python
-        ".pybuilder", # pybuilder
-        ".ipynb_checkpoints", # ipynb checkpoints
-        ".venv", # virtual environment
-        ".git", # git repository
-        ".vscode", # Visual Studio Code
-        ".idea",  # JetBrains PyCharm
-        ".eclipse",  # Eclipse
-        ".classpath",  # Eclipse
-        ".project",  # Eclipse
-        ".settings",  # Eclipse
-        ".DS_Store",  # macOS Desktop Services Store
-        "build_dist", # pup_py and easy exe creator (name?)
-        "build", # common build directory
-        "dist", # common dist directory
-        "env",  # Common virtualenv directory
-        "venv",  # Common virtualenv directory
-        "bin",  # Common for executables and scripts
-        "obj",  # Common build output directory
-        "out",  # Common build output directory
-        "lib",  # Common library code directory
-        "libs",  # Common library code directory
-        "node_modules",  # Node.js modules directory
-        ".npm",  # Node.js package manager cache
-        ".cache",  # Common cache directory
-        ".next",  # Next.js build output
-        "target",  # Maven build directory
-        ".metadata",  # Used by various tools to store metadata
-        ".gradle",  # Gradle cache and settings
-        ".tmp",  # Common temporary directory
-        "tmp",  # Common temporary directory
-        "temp",  # Common temporary directory
-        ".serverless",  # Serverless framework
-        ".terraform",  # Terraform module cache
-    ]
+    _excludes = list(DEFAULT_EXCLUDED_FOLDERS)
     additional_excludes = user_options.get('excluded_folders', [])
     if additional_excludes:
         _excludes.extend(additional_excludes)
@@ -0,0 +1,101 @@
+'''Import time of the installed package, compared with the previous release.
+
+    `python -X importtime -c "import <package>"` runs in the test environment
+    (a warm-up run writes the .pyc files, then the fastest of `runs` counts),
+    and its output becomes a per-module table of self/cumulative times.
+
+    Profiles are kept per package, interpreter and version in
+    cache_directory/import_times/<package>/<interpreter tag>/<version>.json.
+    The package's cumulative time is compared with the profile of the
+    highest lower version: past `threshold` (a ratio, and at least
+    `min_delta_us` slower, so noise doesn't count) it's a regression.
+'''
+
+import os, re, json, tempfile, subprocess
+
+from artifact_store import interpreter_tag
+from release_index import parse_version
+
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)\s*$')
+
+
+def parse_importtime(output):
+    '''{module: {'self_us', 'cumulative_us'}} from `-X importtime` output (stderr).'''
+    profile = {}
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            profile[match.group(3)] = {'self_us': int(match.group(1)), 'cumulative_us': int(match.group(2))}
+    return profile
+
+def measure_import_time(python_executable, module_name, runs=5):
+    '''The fastest of `runs` imports in a fresh interpreter, module by module.'''
+    profile = {}
+    for run in range(runs + 1):
+        result = subprocess.run([python_executable, '-X', 'importtime', '-c', f'import {module_name}'],
+            capture_output=True, text=True, cwd=tempfile.gettempdir())
+        if result.returncode != 0:
+            raise ImportError(f'Could not import {module_name}: {result.stderr.strip().splitlines()[-1:]}')
+        if run == 0:
+            continue  ## Warm-up: compiles the .pyc files
+        for module, times in parse_importtime(result.stderr).items():
+            if module not in profile or times['cumulative_us'] < profile[module]['cumulative_us']:
+                profile[module] = times
+    return profile
+
+def package_total(profile, module_name):
+    return profile.get(module_name, {}).get('cumulative_us', 0)
+
+
+class ImportTimeStore:
+    def __init__(self, cache_directory, package_name, python_executable=None):
+        self.directory = os.path.join(cache_directory, 'import_times', package_name, interpreter_tag(python_executable))
+        os.makedirs(self.directory, exist_ok=True)
+
+    def save(self, version, profile):
+        temp_path = os.path.join(self.directory, f'{version}.json.{os.getpid()}.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(profile, file)
+        os.replace(temp_path, os.path.join(self.directory, f'{version}.json'))
+
+    def previous(self, version):
+        '''(version, profile) of the highest stored version below `version`, else (None, None).'''
+        current = parse_version(version)
+        candidates = []
+        for file in os.listdir(self.directory):
+            if file.endswith('.json'):
+                stored = parse_version(file[:-len('.json')])
+                if stored is not None and (current is None or stored < current):
+                    candidates.append((stored, file[:-len('.json')]))
+        if not candidates:
+            return None, None
+        previous_version = max(candidates)[1]
+        with open(os.path.join(self.directory, f'{previous_version}.json'), 'r', encoding='utf-8') as file:
+            return previous_version, json.load(file)
+
+
+def format_table(profile, module_name, previous=None, top=15):
+    '''The slowest modules of the package's import (by cumulative time), with the previous release's times.'''
+    rows = sorted(profile.items(), key=lambda item: -item[1]['cumulative_us'])[:top]
+    lines = [f'{"cumulative ms":>14} {"self ms":>9} {"previous ms":>12}  module']
+    for module, times in rows:
+        previous_times = (previous or {}).get(module)
+        previous_text = f'{previous_times["cumulative_us"] / 1000:>12.1f}' if previous_times else f'{"-":>12}'
+        lines.append(f'{times["cumulative_us"] / 1000:>14.1f} {times["self_us"] / 1000:>9.1f} {previous_text}  {module}')
+    return '\n'.join(lines)
+
+def compare(profile, previous, module_name, threshold=0.25, min_delta_us=5000):
+    '''(regressed, message) of the package's cumulative import time against the previous profile.'''
+    total, previous_total = package_total(profile, module_name), package_total(previous, module_name)
+    if not previous_total:
+        return False, f'import {module_name}: {total / 1000:.1f} ms (no previous profile to compare with)'
+    ratio = total / previous_total
+    message = f'import {module_name}: {total / 1000:.1f} ms, was {previous_total / 1000:.1f} ms ({ratio - 1:+.0%})'
+    regressed = ratio > 1 + threshold and total - previous_total >= min_delta_us
+    if regressed:
+        ## What got slower (or is new)
+        new_modules = sorted(set(profile) - set(previous), key=lambda m: -profile[m]['self_us'])[:5]
+        if new_modules:
+            message += f'\n   New imports: {", ".join(new_modules)}'
+    return regressed, message
@@ -0,0 +1,233 @@
+'''Multi-interpreter build/test matrix.
+
+    - Discovers the local interpreters (PATH, pyenv and user configured paths)
+    - Builds the wheel once for pure-python projects, or once per ABI for
+      projects with extension modules (concurrently, each from its own stage
+      of the sources: see source_staging.py)
+    - Installs and tests the wheel against every interpreter in parallel, each
+      in its own (reused between runs) virtual environment
+    - Prints one pass/fail + timing table
+'''
+
+import os, re, glob, json, time, shutil, threading, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from print_tricks import pt
+
+from fix_and_optimize import DEFAULT_EXCLUDED_FOLDERS
+from wheelhouse_cache import WheelhouseCache, read_wheel_requirements
+from source_staging import SourceStager, needs_vcs
+
+
+EXTENSION_SOURCE_SUFFIXES = ('.c', '.cc', '.cpp', '.cxx', '.pyx', '.rs')
+
+_QUERY_SCRIPT = (
+    'import sys, sysconfig, json; '
+    'print(json.dumps({'
+    '"executable": sys.executable, '
+    '"implementation": sys.implementation.name, '
+    '"version": "%d.%d.%d" % sys.version_info[:3], '
+    '"abi": sysconfig.get_config_var("SOABI") or "%s%d%d" % (sys.implementation.name, *sys.version_info[:2])'
+    '}))'
+)
+
+
+def query_interpreter(executable):
+    '''Returns the interpreter's info dict, or None if it can't be run.'''
+    try:
+        result = subprocess.run([executable, '-c', _QUERY_SCRIPT],
+            capture_output=True, text=True, timeout=20)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    try:
+        info = json.loads(result.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return None
+    info['executable'] = os.path.realpath(info['executable'])
+    info['label'] = f"{info['implementation']}-{info['version']}"
+    return info
+
+def _candidate_executables(configured_paths=None):
+    candidates = list(configured_paths or [])
+
+    ## PATH (pyenv shims are skipped: they only work for the active version)
+    name_patterns = ['python3.exe', 'python.exe'] if os.name == 'nt' else ['python3', 'python3.[0-9]', 'python3.[0-9][0-9]']
+    for directory in os.get_exec_path():
+        if os.sep + 'shims' in directory:
+            continue
+        for pattern in name_patterns:
+            candidates.extend(glob.glob(os.path.join(directory, pattern)))
+
+    ## pyenv
+    pyenv_root = os.environ.get('PYENV_ROOT', os.path.join(os.path.expanduser('~'), '.pyenv'))
+    bin_directory = 'Scripts' if os.name == 'nt' else 'bin'
+    python_name = 'python.exe' if os.name == 'nt' else 'python'
+    candidates.extend(glob.glob(os.path.join(pyenv_root, 'versions', '*', bin_directory, python_name)))
+    return candidates
+
+def discover_interpreters(configured_paths=None):
+    '''All working interpreters, one per real executable, sorted by version.'''
+    interpreters = {}
+    candidates = [c for c in _candidate_executables(configured_paths) if os.path.isfile(c)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for info in executor.map(query_interpreter, candidates):
+            if info is not None:
+                interpreters.setdefault(info['executable'], info)
+    return sorted(interpreters.values(),
+        key=lambda i: (i['implementation'], tuple(int(p) for p in i['version'].split('.'))))
+
+def project_has_extensions(project_directory, excluded_folders=None):
+    excludes = set(DEFAULT_EXCLUDED_FOLDERS) | set(excluded_folders or [])
+    setup_py = os.path.join(project_directory, 'setup.py')
+    if os.path.exists(setup_py):
+        with open(setup_py, 'r', errors='replace') as file:
+            if 'ext_modules' in file.read():
+                return True
+    for root, dirs, files in os.walk(project_directory):
+        dirs[:] = [d for d in dirs if d not in excludes]
+        if any(f.endswith(EXTENSION_SOURCE_SUFFIXES) for f in files):
+            return True
+    return False
+
+
+class InterpreterMatrix:
+    def __init__(self,
+            project_directory,
+            matrix_directory,
+            package_name,
+            cache_directory,
+            interpreter_paths=None,
+            excluded_folders=None,
+            excluded_directories=None,
+            pyproject_path=None,
+            ):
+        self.project_directory = project_directory
+        self.matrix_directory = matrix_directory
+        self.package_name = package_name
+        self.cache_directory = cache_directory
+        self.excluded_folders = excluded_folders
+        self.excluded_directories = list(excluded_directories or []) + [matrix_directory]
+        self.pyproject_path = pyproject_path
+        self.interpreters = discover_interpreters(interpreter_paths)
+        self.has_extensions = project_has_extensions(project_directory, excluded_folders)
+        self.build_directories = {}         ## abi -> its stage, set by _stage_builds
+        self.in_tree_build_lock = threading.Lock()
+        os.makedirs(self.matrix_directory, exist_ok=True)
+        pt([i['label'] for i in self.interpreters], self.has_extensions)
+
+    def _venv_python(self, interpreter):
+        venv_directory = os.path.join(self.matrix_directory, 'envs', interpreter['label'])
+        if os.name == 'nt':
+            return venv_directory, os.path.join(venv_directory, 'Scripts', 'python.exe')
+        return venv_directory, os.path.join(venv_directory, 'bin', 'python')
+
+    def _ensure_venv(self, interpreter):
+        '''Virtual environments are kept between runs, so only the first run pays for them.'''
+        venv_directory, venv_python = self._venv_python(interpreter)
+        if not os.path.exists(venv_python):
+            subprocess.run([interpreter['executable'], '-m', 'venv', venv_directory],
+                check=True, capture_output=True, text=True)
+        return venv_python
+
+    def _stage_builds(self, abis):
+        '''One stage per ABI: setuptools writes the same build/ and *.egg-info/
+        in the tree it runs in, so concurrent builds can't share one. Projects
+        that need the VCS build in the project directory, one at a time.'''
+        self.build_directories = {}
+        if needs_vcs(self.project_directory, self.pyproject_path):
+            return
+        stager = SourceStager(self.project_directory, os.path.join(self.matrix_directory, 'stage'),
+            self.excluded_folders, self.excluded_directories)
+        for abi in abis:
+            self.build_directories[abi] = stager.stage(re.sub(r'[^\w.-]', '_', abi), self.pyproject_path)
+
+    def _build_for_abi(self, interpreter, venv_python):
+        output_directory = os.path.join(self.matrix_directory, 'wheels', re.sub(r'[^\w.-]', '_', interpreter['abi']))
+        shutil.rmtree(output_directory, ignore_errors=True)
+        subprocess.run([venv_python, '-m', 'pip', 'install', '--quiet', 'build'],
+            check=True, capture_output=True, text=True)
+        build_command = [venv_python, '-m', 'build', '--wheel', '--outdir', output_directory]
+        if interpreter['abi'] in self.build_directories:
+            subprocess.run(build_command, check=True, capture_output=True, text=True, cwd=self.build_directories[interpreter['abi']])
+        else:
+            with self.in_tree_build_lock:
+                subprocess.run(build_command, check=True, capture_output=True, text=True, cwd=self.project_directory)
+        wheels = [f for f in os.listdir(output_directory) if f.endswith('.whl')]
+        return os.path.join(output_directory, wheels[0])
+
+    def _install_and_test(self, interpreter, venv_python, wheel_path):
+        wheelhouse_cache = WheelhouseCache(self.cache_directory, python_executable=venv_python)
+        wheelhouse_args = wheelhouse_cache.install_arguments(read_wheel_requirements(wheel_path))
+        subprocess.run([venv_python, '-m', 'pip', 'install', '--quiet', '--force-reinstall', wheel_path, *wheelhouse_args],
+            check=True, capture_output=True, text=True)
+        subprocess.run([venv_python, '-c', f'import {self.package_name}'],
+            check=True, capture_output=True, text=True, cwd=self.matrix_directory)
+
+    def run(self, wheel_path):
+        '''Returns one result dict per interpreter.'''
+        results = {i['executable']: {'interpreter': i['label'], 'abi': i['abi'], 'passed': False,
+            'failed_stage': None, 'error': [], 'timings': {}} for i in self.interpreters}
+
+        def timed(interpreter, stage, func, *args):
+            result = results[interpreter['executable']]
+            start_time = time.perf_counter()
+            try:
+                return func(*args)
+            except subprocess.CalledProcessError as e:
+                result['failed_stage'] = stage
+                result['error'] = (e.stderr or e.stdout or str(e)).strip().splitlines()[-1:]
+            except Exception as e:
+                result['failed_stage'] = stage
+                result['error'] = [repr(e)]
+            finally:
+                result['timings'][stage] = time.perf_counter() - start_time
+            return None
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.interpreters))) as executor:
+            ## 1. Environments
+            venv_pythons = dict(zip(
+                [i['executable'] for i in self.interpreters],
+                executor.map(lambda i: timed(i, 'venv', self._ensure_venv, i), self.interpreters)))
+
+            ## 2. Wheels: the given one for pure python, otherwise one per ABI
+            wheels = {}
+            if self.has_extensions:
+                builders = {}
+                for interpreter in self.interpreters:
+                    if venv_pythons[interpreter['executable']]:
+                        builders.setdefault(interpreter['abi'], interpreter)
+                self._stage_builds(builders)
+                futures = {abi: executor.submit(timed, i, 'build', self._build_for_abi, i, venv_pythons[i['executable']])
+                    for abi, i in builders.items()}
+                wheels = {abi: future.result() for abi, future in futures.items()}
+
+            ## 3. Install + test everywhere
+            def install_and_test(interpreter):
+                venv_python = venv_pythons[interpreter['executable']]
+                interpreter_wheel = wheels.get(interpreter['abi']) if self.has_extensions else wheel_path
+                result = results[interpreter['executable']]
+                if venv_python is None or result['failed_stage']:
+                    return
+                if interpreter_wheel is None:
+                    result['failed_stage'] = result['failed_stage'] or 'build'
+                    return
+                timed(interpreter, 'install+test', self._install_and_test, interpreter, venv_python, interpreter_wheel)
+                result['passed'] = result['failed_stage'] is None
+            list(executor.map(install_and_test, self.interpreters))
+
+        return [results[i['executable']] for i in self.interpreters]
+
+    @staticmethod
+    def print_table(results):
+        stages = ['venv', 'build', 'install+test']
+        header = f"{'Interpreter':<20} {'Result':<7} " + ' '.join(f'{s:>13}' for s in stages) + f" {'Total':>9}"
+        print(header)
+        print('-' * len(header))
+        for result in results:
+            timings = result['timings']
+            cells = ' '.join(f"{timings[s]:>12.2f}s" if s in timings else f"{'-':>13}" for s in stages)
+            status = 'PASS' if result['passed'] else 'FAIL'
+            print(f"{result['interpreter']:<20} {status:<7} {cells} {sum(timings.values()):>8.2f}s")
+            if not result['passed']:
+                print(f"    failed at {result['failed_stage']}: {' '.join(result['error'])}")
@@ -64,7 +64,8 @@
 
 '''
 
-import subprocess, os, sys, tempfile, shutil, re, requests
+import subprocess, os, sys, tempfile, shutil, re, threading, requests
+from concurrent.futures import ThreadPoolExecutor
 import git
 import validators
 
@@ -72,18 +73,44 @@ import validators
 from build.__main__ import build_package
 
 from twine.commands.upload import upload as twine_upload
+from twine.commands.check import check as twine_check
 from twine.settings import Settings
 
 from print_tricks import pt
-from decorators import auto_decorate_methods
+from decorators import auto_decorate_methods, step_inputs, StepFailure
 from setup_file_manager import SetupFileManager
 from fix_and_optimize import fix_and_optimize
 from pypi_verifier import PyPIVerifier
 from ui_gui_manager import UiGuiManager
+from watch_mode import watch_project
+from wheel_restamper import restamp_wheel
+from wheelhouse_cache import WheelhouseCache, read_wheel_requirements
+from interpreter_matrix import InterpreterMatrix, project_has_extensions
+from build_log import BuildLog
+from artifact_store import ArtifactStore, source_fingerprint, interpreter_tag, describe_artifact, remove_file
+from source_staging import SourceStager, needs_vcs
+from step_cache import StepCache
+from conflict_policies import SkipProject
+from step_profiler import StepProfiler
+from compiler_cache import compiler_cache_environment, trim_cache
+from remote_build_cache import RemoteBuildCache
+from pypi_simple_client import SimpleIndexClient
+from dev_mode import DevEnvironment, tools_environment
+from test_selector import TestSelector
+from import_time_report import ImportTimeStore, measure_import_time, format_table, compare
+from benchmark_gate import BenchmarkGate, read_benchmark_config
+from release_index import parse_version
+from zipapp_builder import create_zipapp
 
 ## TODO DELETE: Is this needed? TODO 
 sys.path.append(os.path.dirname(__file__))
 
+## Steps that change or use the interpreter pup_py runs in (its site-packages,
+## the working directory): projects running in the same process (Pipeline.run_many)
+## take turns for them
+INTERPRETER_STEPS = ('uninstall_package', 'install_package_locally', 'test_installed_package', 'run_project_tests', 'build_wheel_hatch_version')
+INTERPRETER_LOCK = threading.RLock()
+
 
 @auto_decorate_methods
 class PipUniversalProjects:
@@ -101,6 +128,26 @@ class PipUniversalProjects:
         test_pypi_token_env_var='TEST_PYPI_TOKEN',
         pypi_token_env_var='PYPI_TOKEN',
         use_gui=False,
+        watch=False,
+        cache_directory=None,
+        interpreter_matrix=False,
+        interpreter_paths=None,
+        artifact_retention=None,
+        force_steps=None,
+        conflict_policy=None,
+        prompt_queue=None,
+        profile=False,
+        remote_cache_url=None,
+        remote_cache_token_env_var='PUP_PY_REMOTE_CACHE_TOKEN',
+        dev_mode=False,
+        full_test_run=False,
+        full_test_run_every=20,
+        import_time_policy='warn',
+        import_time_threshold=0.25,
+        zipapp=False,
+        upload=False,
+        execute=True,
+        shared=None,
         ):
         
         if validators.url(project_directory):
@@ -130,16 +177,69 @@ class PipUniversalProjects:
         self.test_pypi_token_env_var = test_pypi_token_env_var
         self.pypi_token_env_var = pypi_token_env_var
         self.use_gui = use_gui
+        self.watch = watch
+        self.cache_directory = os.path.join(os.path.expanduser('~'), '.cache', 'pup_py') if cache_directory is None else cache_directory
+        self.interpreter_matrix = interpreter_matrix
+        self.interpreter_paths = interpreter_paths
+        self.force_steps = set(force_steps or [])  ## Step names (or 'all') to rerun even if their inputs are unchanged
+        ## A policy name or {conflict: policy} (see conflict_policies.py), and optional answers queued up front
+        self.conflict_policy = conflict_policy
+        ## Already created index_client, wheelhouse_cache, artifact_store, remote_cache and prompt_queue to use
+        ## instead of new ones (a Pipeline's warm objects, see pipeline.py)
+        shared = shared or {}
+        self.prompt_queue = shared.get('prompt_queue', prompt_queue)
+        self.skipped = False
+        self.profile = profile
+        self.dev_mode = dev_mode            ## Editable install + tests only (see dev_mode.py)
+        ## The project's own tests only run where the changes since the last success reach (see test_selector.py)
+        self.full_test_run = full_test_run
+        self.full_test_run_every = full_test_run_every
+        ## Import time regressions against the previous release: 'warn', 'fail' or 'off' (see import_time_report.py)
+        self.import_time_policy = import_time_policy
+        self.import_time_threshold = import_time_threshold
+        self.zipapp = zipapp                ## Also build a single file .pyz executable (see zipapp_builder.py)
         
         self.ui_gui_manager = UiGuiManager(use_gui)
+        self.wheelhouse_cache = shared['wheelhouse_cache'] if 'wheelhouse_cache' in shared else WheelhouseCache(self.cache_directory)
+        ## e.g. {'max_bytes': 2 * 1024 ** 3, 'max_age_days': 90, 'max_artifacts': None}
+        self.artifact_store = shared['artifact_store'] if 'artifact_store' in shared else ArtifactStore(self.cache_directory, **(artifact_retention or {}))
+        ## Shared build cache (see remote_build_cache.py), in front of which the artifact store is the local tier
+        if 'remote_cache' in shared:
+            self.remote_cache = shared['remote_cache']
+        else:
+            remote_cache_url = remote_cache_url or os.getenv('PUP_PY_REMOTE_CACHE_URL')
+            self.remote_cache = RemoteBuildCache(remote_cache_url, os.getenv(remote_cache_token_env_var)) if remote_cache_url else None
+        ## Its HTTP session is shared with the verifier
+        self.index_client = shared['index_client'] if 'index_client' in shared else SimpleIndexClient(use_test_pypi)
         self.wheel_path = None
+        self.sdist_path = None
+        self.build_log = None               ## Created with the distribution directory
+        self.step_cache = None              ## Created with the distribution directory
+        self.step_profiler = None           ## Created with the distribution directory (if profiling)
+        self.build_fingerprint = None       ## Declared here for clarity
+        self.has_extensions = False         ## Set by build_wheel
+        self.build_source_directories = {}  ## The stage of each backend, once build_wheel staged the sources
+        self.dev_environment = None         ## Created by install_editable
+        self.test_python = sys.executable   ## The python the installed package is tested with
+        self.benchmarks_passed = None       ## Set by benchmark_against_previous_release, gates the upload
+        self.zipapp_path = None             ## Set by build_zipapp
+        self.upload = upload                ## Upload to (Test) PyPI at the end of the workflow
+        self.step_listener = None           ## Called with (step result, 'started'/'finished'), see decorators.py
         self.steps_counter = 0
+        self.step_results = []              ## {'step', 'status', 'seconds', 'error'} of every step run (see decorators.py)
         
         self.version_number = None          ## Declared here for clarity
         self.pypi_version_number = None     ## Declared here for clarity
         
-        ## Execute
-        self._execute_full_workflow()
+        ## Execute (a Pipeline (see pipeline.py) creates the instance without executing, and runs it itself)
+        if execute:
+            try:
+                self._execute_full_workflow()
+            except StepFailure as e:
+                print(f'FAILED: {e}')
+                sys.exit(1)
+            if self.watch and not self.skipped:
+                watch_project(self)
 
     def _clone_repository(self, url):
         temp_dir = tempfile.mkdtemp()
@@ -201,8 +301,24 @@ class PipUniversalProjects:
         self.exe_build_directory = os.path.join(self.exe_structure_directory, 'build_exe')
         os.makedirs(self.exe_distribution_directory, exist_ok=True)
         os.makedirs(self.exe_build_directory, exist_ok=True)
+        
+        ## Streamed output of every build/test subprocess (see build_log.py)
+        self.build_log = BuildLog(os.path.join(self.distribution_directory, 'logs'), self.package_name)
+        
+        ## Recorded inputs/outputs of the memoized steps (see step_cache.py)
+        step_cache_directory = os.path.join(self.distribution_directory, 'step_cache')
+        self.step_cache = StepCache(step_cache_directory, excluded_directories=[
+            self.distribution_directory, self.pypi_structure_directory, self.pypi_build_directory,
+            self.pypi_distribution_directory, self.exe_structure_directory, self.build_log.log_directory, 
+            step_cache_directory])
+        
+        ## Per step cProfile/tracemalloc/flame graph reports of every following step
+        if self.profile:
+            self.step_profiler = StepProfiler(os.path.join(self.distribution_directory, 'profiles'))
 
-    def check_or_gen_requirements(self):
+    @step_inputs(
+        files=['{project_directory}', '{distribution_directory}/requirements.txt'])
+    def check_or_gen_requirements(self, regenerate=False):
         ## Check if requirements.txt exists in either project_dir or build_dist_dir
         req_path_in_project = os.path.join(self.project_directory, 'requirements.txt')
         req_path_in_distribution_directory = os.path.join(self.distribution_directory, 'requirements.txt')
@@ -214,7 +330,7 @@ class PipUniversalProjects:
                 pt.c('-- requirements.txt already exists, copying to distribution directory')
             return
         
-        if os.path.exists(req_path_in_distribution_directory):
+        if os.path.exists(req_path_in_distribution_directory) and not regenerate:
             pt.c('-- requirements.txt already exists.')
             return
 
@@ -237,14 +353,20 @@ class PipUniversalProjects:
             pt.c(f'-- Finished Creating requirements.txt in {self.distribution_directory}')
         except Exception as e:
             pt.e()
-            pt.ex(e)
+            raise StepFailure(f'Could not generate requirements.txt: {e}') from e
 
+    @step_inputs(
+        files=['{project_directory}', '{distribution_directory}/pyproject.toml', '{distribution_directory}/setup.py'],
+        options=['package_name'],
+        outputs=['pyproject_data', 'username', 'email', 'package_name', 'version_number', 'pyproject_file_path'],
+        on_restore='_create_setup_file_manager')
     def setup_file_data(self):
         
         self.setup_file_manager = SetupFileManager(
             self.project_directory, 
             self.distribution_directory,
             self.package_name,
+            cache_directory=self.cache_directory,
             )
         self.pyproject_data = self.setup_file_manager.get_setup_file_data()
         pt(self.pyproject_data)
@@ -258,7 +380,17 @@ class PipUniversalProjects:
         self.pyproject_file_path = self.pyproject_data['pyproject_file_path']
         # pt.ex()
 
-    def verify_package_availability_status(self):
+    def _create_setup_file_manager(self):
+        ## Restored setup_file_data: the manager edits the pyproject it found
+        self.setup_file_manager = SetupFileManager(
+            self.project_directory, 
+            self.distribution_directory,
+            self.package_name,
+            cache_directory=self.cache_directory,
+            )
+        self.setup_file_manager.new_toml_path = self.pyproject_file_path
+
+    def _create_verifier(self):
         self.verifier = PyPIVerifier(
             self.package_name, 
             self.username,
@@ -266,9 +398,30 @@ class PipUniversalProjects:
             self.version_number, 
             self.use_test_pypi, 
             self.use_gui, 
-            self.automatically_increment_version
+            self.automatically_increment_version,
+            self.cache_directory,
+            conflict_policy=self.conflict_policy,
+            prompt_queue=self.prompt_queue,
+            session=self.index_client.session,
         )
+        self.verifier.pypi_version_number = self.pypi_version_number
+
+    def _package_index_state(self):
+        ## One simple API request: changes whenever a release is added to the package
+        status_code, _, etag, last_serial = self.index_client.get_project(self.package_name)
+        return [status_code, last_serial or etag]
+
+    @step_inputs(
+        files=['{pyproject_file_path}'],
+        options=['package_name', 'username', 'email', 'version_number', 'use_test_pypi', 'automatically_increment_version', 'conflict_policy'],
+        remote='_package_index_state',
+        ttl=300,
+        outputs=['package_name', 'username', 'version_number', 'pypi_version_number'],
+        on_restore='_create_verifier')
+    def verify_package_availability_status(self):
+        self._create_verifier()
         self.package_name, self.username, self.version_number = self.verifier.handle_verification()
+        self.pypi_version_number = self.verifier.pypi_version_number
         pt(self.package_name, self.username, self.version_number)
         
         # Update the pyproject.toml file with the verified or modified values
@@ -279,6 +432,9 @@ class PipUniversalProjects:
         
         # pt(self.username)
 
+    @step_inputs(
+        files=['{project_directory}'],
+        options=['user_options'])
     def fix_and_optimize_package(self):
         fix_and_optimize(self.project_directory, self.distribution_directory, self.user_options)
 
@@ -292,6 +448,7 @@ class PipUniversalProjects:
         #         print(os.path.join(root, file))
         
         
+        INTERPRETER_LOCK.acquire()  ## The working directory is process wide
         original_cwd = os.getcwd()
         try:
             os.chdir(self.project_directory)
@@ -300,22 +457,17 @@ class PipUniversalProjects:
             print(f"Target directory for build: {repr(target_directory)}")
 
             try:
-                result = subprocess.run(
+                self.build_log.run(
                     ## NOTE: '--target' consistently didn't work. So just build without a 
                     ## target directory, then move the wheel file afterwards.
                     ## [sys.executable, '-m', 'hatchling', 'build', '--target', target_directory],
                     [sys.executable, '-m', 'hatchling', 'build'],
-                    check=True,
-                    capture_output=True,
-                    text=True,
+                    label='hatch',
                     cwd=self.project_directory,
                 )
-                print('1', result.stdout)
-                print('2', result.stderr)
             except subprocess.CalledProcessError as e:
                 print(f"Error during build with Hatch: {e}")
-                print('3', e.stdout)
-                print('4', e.stderr)
+                print(f"Last lines of output (full log: {self.build_log.log_path}):\n{e.stderr}")
 
             wheels = [f for f in os.listdir(target_directory) if f.endswith('.whl')]
             
@@ -326,6 +478,33 @@ class PipUniversalProjects:
                 raise FileNotFoundError("No wheel file created with Hatch.")
         finally:
             os.chdir(original_cwd)
+            INTERPRETER_LOCK.release()
+
+    def _run_build_backend(self, distribution_type):
+        '''Runs `python -m build --wheel` or `--sdist` on the project and returns 
+        the path of the artifact it produced.'''
+        extension = '.whl' if distribution_type == '--wheel' else '.tar.gz'
+        output_directory = os.path.abspath(self.pypi_distribution_directory)
+        try:
+            # Using the build module to build the package
+            result = self.build_log.run(
+                [sys.executable, '-m', 'build', distribution_type, '--outdir', output_directory],
+                label=distribution_type.strip('-'),
+                cwd=self.build_source_directories.get(distribution_type, self.project_directory),
+                env=self._extension_build_environment() if self.has_extensions and distribution_type == '--wheel' else None,
+            )
+        except subprocess.CalledProcessError as e:
+            print(f"Error during build ({distribution_type}), last lines of output (full log: {self.build_log.log_path}):\n", e.stderr)
+            raise
+        
+        ## `build` reports the exact file name it created: "Successfully built <file>"
+        built = re.findall(r'Successfully built (\S+)', result.stdout)
+        artifacts = [f for f in built if f.endswith(extension)]
+        if not artifacts:
+            artifacts = [f for f in os.listdir(output_directory) if f.endswith(extension) and self.version_number in f]
+        if not artifacts:
+            raise FileNotFoundError(f"No {extension} file created for version {self.version_number}.")
+        return os.path.join(output_directory, artifacts[0])
 
     def build_wheel(self):
         # Debug Log the contents of the project directory
@@ -335,58 +514,145 @@ class PipUniversalProjects:
         #         print(os.path.join(root, file))
         
         # pt.ex()
-        original_cwd = os.getcwd()
+        print("self.project_directory (repr):", repr(self.project_directory))
+        print("Does self.project_directory exist?", os.path.exists(self.project_directory))
         
-        try:
-            os.chdir(self.project_directory)
-            print("Current working directory:", os.getcwd())
-            print("self.project_directory (repr):", repr(self.project_directory))
-            print("Does self.project_directory exist?", os.path.exists(self.project_directory))
-            
-            # Clear existing build directory to avoid using stale data
-            build_dir = os.path.join(self.pypi_structure_directory, self.pypi_build_subfolder)
-            if os.path.exists(build_dir):
-                shutil.rmtree(build_dir)
-                print(f"Cleared old build directory at {build_dir}.")
-                
-            # pt(self.pypi_distribution_directory)
-            # pt.ex()
-            # Building the wheel
-            try:
-                # Using the build module to build the package
-                result = subprocess.run(
-                    [sys.executable, '-m', 'build', '--wheel', '--outdir', self.pypi_distribution_directory],
-                    check=True,
-                    capture_output=True,
-                    text=True
-                )
-                print("Build output:", result.stdout)
-            except subprocess.CalledProcessError as e:
-                print("Error during build:", e.stderr)
-                raise
+        # Clear existing build directory to avoid using stale data
+        build_dir = os.path.join(self.pypi_structure_directory, self.pypi_build_subfolder)
+        if os.path.exists(build_dir):
+            shutil.rmtree(build_dir)
+            print(f"Cleared old build directory at {build_dir}.")
             
-            # Check for the wheel file in the output directory
-            wheels = [f for f in os.listdir(self.pypi_distribution_directory) if f.endswith('.whl') and self.version_number in f]
-            if wheels:
-                self.wheel_path = os.path.join(self.pypi_distribution_directory, wheels[0])
-                print("Wheel built successfully:", self.wheel_path)
-            else:
-                raise FileNotFoundError(f"No wheel file created for version {self.version_number}.")
-        finally:
-            os.chdir(original_cwd)
-        pt(self.wheel_path)
+        ## Unchanged sources (+ pyproject, backend, interpreter): reuse the artifacts of the last build
+        self.build_fingerprint = self._source_fingerprint()
+        if self._restore_artifacts_from_store() or self._restore_artifacts_from_remote_cache():
+            return
+        self.has_extensions = project_has_extensions(self.project_directory, self.user_options.get('excluded_folders'))
+        self._stage_sources()
+        
+        ## Build the wheel and the sdist concurrently, each from its own stage:
+        ## setuptools writes the same build/ and *.egg-info/ in the tree it runs in.
+        ## Without stages (VCS versioned projects) they build one after the other.
+        if self.build_source_directories:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                wheel_future = executor.submit(self._run_build_backend, '--wheel')
+                sdist_future = executor.submit(self._run_build_backend, '--sdist')
+                self.wheel_path = wheel_future.result()
+                self.sdist_path = sdist_future.result()
+        else:
+            self.sdist_path = self._run_build_backend('--sdist')
+            self.wheel_path = self._run_build_backend('--wheel')
+        
+        self._store_artifacts()
+        if self.has_extensions:
+            trim_cache(self.cache_directory)
+        
+        print("Wheel built successfully:", self.wheel_path)
+        print("Sdist built successfully:", self.sdist_path)
+        pt(self.wheel_path, self.sdist_path)
         # pt.ex()
+
+    def _source_fingerprint(self):
+        return source_fingerprint(
+            self.project_directory, self.pyproject_file_path, backend='build', 
+            excluded_folders=self.user_options.get('excluded_folders'))
+
+    def _store_artifacts(self):
+        '''The wheel and sdist go into the store (and the remote cache) under the build fingerprint.'''
+        self.artifact_store.add(self.wheel_path, self.build_fingerprint)
+        self.artifact_store.add(self.sdist_path, self.build_fingerprint)
+        self.artifact_store.evict()
+        if self.remote_cache is not None:
+            self.remote_cache.publish('build', interpreter_tag(), self.build_fingerprint, [self.wheel_path, self.sdist_path])
+
+    def _stage_sources(self):
+        '''Each backend builds from its own linked copy of the sources in the
+        build directory (see source_staging.py), so the project directory stays clean.'''
+        self.build_source_directories = {}
+        if needs_vcs(self.project_directory, self.pyproject_file_path):
+            return
+        stager = SourceStager(
+            self.project_directory, os.path.join(self.pypi_build_directory, 'stage'),
+            excluded_folders=self.user_options.get('excluded_folders'),
+            excluded_directories=[self.distribution_directory, self.pypi_structure_directory, 
+                self.pypi_distribution_directory, self.exe_structure_directory])
+        for distribution_type in ('--wheel', '--sdist'):
+            self.build_source_directories[distribution_type] = stager.stage(distribution_type.strip('-'), self.pyproject_file_path)
+
+    def _extension_build_environment(self):
+        '''Parallel build_ext, and compiles through the shared compiler cache (see compiler_cache.py).'''
+        ## setuptools reads this extra config file on top of the project's setup.cfg
+        config_path = os.path.join(self.pypi_structure_directory, 'build_ext.cfg')
+        with open(config_path, 'w') as file:
+            file.write(f'[build_ext]\nparallel = {os.cpu_count() or 1}\n')
+        environment = compiler_cache_environment(self.cache_directory)
+        environment['DIST_EXTRA_CONFIG'] = os.path.abspath(config_path)
+        return environment
+
+    def _restore_artifacts_from_store(self):
+        cached_artifacts = self.artifact_store.lookup(self.build_fingerprint)
+        wheels = [f for f in cached_artifacts if f.endswith('.whl')]
+        sdists = [f for f in cached_artifacts if f.endswith('.tar.gz')]
+        if not (wheels and sdists):
+            return False
+        
+        output_directory = os.path.abspath(self.pypi_distribution_directory)
+        self.wheel_path = self.artifact_store.materialize(cached_artifacts[wheels[0]], os.path.join(output_directory, wheels[0]))
+        self.sdist_path = self.artifact_store.materialize(cached_artifacts[sdists[0]], os.path.join(output_directory, sdists[0]))
+        print("Sources unchanged since the last build, reusing:", self.wheel_path, self.sdist_path)
+        return True
+
+    def _restore_artifacts_from_remote_cache(self):
+        '''Read-through: artifacts built anywhere else go into the local store first.'''
+        if self.remote_cache is None:
+            return False
+        download_directory = tempfile.mkdtemp()
+        try:
+            for path in self.remote_cache.fetch('build', interpreter_tag(), self.build_fingerprint, download_directory):
+                self.artifact_store.add(path, self.build_fingerprint)
+        finally:
+            shutil.rmtree(download_directory, ignore_errors=True)
+        return self._restore_artifacts_from_store()
+
+    def check_distributions(self):
+        ## Validates the metadata/long description of both artifacts (same check PyPI does on upload)
+        failed = twine_check([self.wheel_path, self.sdist_path])
+        if failed:
+            raise StepFailure("Distribution check failed for the wheel and/or sdist.")
+
     def uninstall_package(self):
         subprocess.run([sys.executable, '-m', 'pip', 'uninstall', self.package_name, '-y'], check=True)
 
     def install_package_locally(self):
+        ## Dependencies come from the local wheelhouse, so repeat installs need no network
+        requirements = read_wheel_requirements(self.wheel_path)
+        wheelhouse_args = self.wheelhouse_cache.install_arguments(requirements)
         subprocess.run([
-                'pip', 'install', self.wheel_path, 
+                sys.executable, '-m', 'pip', 'install', self.wheel_path, 
                 '--user', 
                 '--force-reinstall', 
-                '--no-cache-dir'], 
+                *wheelhouse_args], 
             check=True)
 
+    def install_editable(self):
+        self.dev_environment = self.dev_environment or DevEnvironment(
+            os.path.join(self.distribution_directory, 'dev_env'),
+            self.project_directory,
+            self.cache_directory,
+            excluded_folders=self.user_options.get('excluded_folders'),
+            excluded_directories=[self.distribution_directory, self.pypi_structure_directory],
+        )
+        self.test_python = self.dev_environment.ensure()
+        fingerprint = self.dev_environment.metadata_fingerprint()
+        if self.dev_environment.is_current(fingerprint):
+            pt.c('-- Packaging metadata unchanged, the editable install is up to date')
+            return
+        
+        ## Metadata, entry points or package data changed: check a real wheel, then reinstall
+        self.build_wheel()
+        self.check_distributions()
+        self.dev_environment.install(read_wheel_requirements(self.wheel_path), fingerprint)
+
     def test_installed_package(self):
         ## temp debug
         # user_site = site.getusersitepackages()
@@ -397,21 +663,24 @@ class PipUniversalProjects:
         # pt(g)
         
         ## Test 1: Check if the package is installed using `pip show`
-        result_test_1 = subprocess.run([sys.executable, '-m', 'pip', 'show', self.package_name], capture_output=True, text=True)
+        result_test_1 = self.build_log.run([self.test_python, '-m', 'pip', 'show', self.package_name], label='test 1', check=False, echo=False)
         if result_test_1.returncode == 0 and self.package_name in result_test_1.stdout:
             print(f"Test 1 Success: The package '{self.package_name}' appears to be installed. Performing Further tests...")
         else:
-            print(f"Test 1 Failure: The package '{self.package_name}' is not installed or not found by pip.")
-            sys.exit(1)
+            raise StepFailure(f"Test 1 Failure: The package '{self.package_name}' is not installed or not found by pip.")
         
         ## Test 2: Attempt to import the package to verify it's accessible
+        ## In a fresh interpreter: this one may hold a stale copy of the package
+        ## in sys.modules (watch mode, pipelines), and shouldn't run its code anyway
         try:
-            __import__(self.package_name)
+            result_test_2 = self.build_log.run([self.test_python, '-c', f'import {self.package_name}'], label='test 2', 
+                check=False, echo=False, cwd=tempfile.gettempdir())
+            if result_test_2.returncode != 0:
+                raise ImportError(result_test_2.stderr.strip() or f'exit code {result_test_2.returncode}')
             print(f"Test 2 Success: The package '{self.package_name}' was successfully imported.")
         except ImportError as e:
-            print(f"Test 2 Failure: Could not import the package '{self.package_name}'. Error: {e}")
-            print(f"   Are you sure that your package location is actually located at '{self.distribution_directory}' ?")
-            sys.exit(1)
+            raise StepFailure(f"Test 2 Failure: Could not import the package '{self.package_name}'. Error: {e}\n"
+                f"   Are you sure that your package location is actually located at '{self.distribution_directory}' ?")
         
         ## Test 3: Execute elsewhere to ensure the package's avaiability
         with tempfile.NamedTemporaryFile(suffix=".py", delete=False) as temp:
@@ -421,18 +690,145 @@ class PipUniversalProjects:
             )
             temp_file_name = temp.name
         try:
-            result = subprocess.run([sys.executable, temp_file_name], capture_output=True, text=True)
-            print(result.stdout)
+            result = self.build_log.run([self.test_python, temp_file_name], label='test 3', check=False)
             if result.returncode != 0:
-                print(f"Test 3 Failure: Error running test script for '{self.package_name}': {result.stderr}")
-                sys.exit(1)
+                raise StepFailure(f"Test 3 Failure: Error running test script for '{self.package_name}': {result.stderr}")
         finally:
             os.remove(temp_file_name)
         
+        ## Test 4: Import time, compared with the previous release's
+        if self.import_time_policy != 'off':
+            self._check_import_time()
+        
         print(f'All Tests Passed. Package "{self.package_name}" has been successfully installed.')
         print(f"'{self.package_name}'  Details:\n{result_test_1.stdout}")
 
+    def _check_import_time(self):
+        profile = measure_import_time(self.test_python, self.package_name)
+        store = ImportTimeStore(self.cache_directory, self.package_name, self.test_python)
+        previous_version, previous_profile = store.previous(self.version_number)
+        print(format_table(profile, self.package_name, previous_profile))
+        regressed, message = compare(profile, previous_profile or {}, self.package_name, self.import_time_threshold)
+        if previous_version:
+            message += f' (previous release: {previous_version})'
+        if not regressed:
+            print(f"Test 4 Success: {message}")
+        elif self.import_time_policy == 'fail':
+            raise StepFailure(f"Test 4 Failure: Import time regression past {self.import_time_threshold:.0%}: {message}")
+        else:
+            print(f"Test 4 Warning: Import time regression past {self.import_time_threshold:.0%}: {message}")
+        store.save(self.version_number, profile)
+
+    def run_project_tests(self):
+        selector = TestSelector(
+            self.project_directory,
+            os.path.join(self.distribution_directory, 'test_selection.json'),
+            excluded_folders=self.user_options.get('excluded_folders'),
+            excluded_directories=[self.distribution_directory, self.pypi_structure_directory],
+            full_run_every=self.full_test_run_every,
+        )
+        selected_tests, reason = selector.select(force_full_run=self.full_test_run)
+        if not selector.test_files:
+            pt.c(f"-- '{self.package_name}' has no test suite (test_*.py / *_test.py files)")
+            return
+        pt.c(f'-- Running {len(selected_tests)} of {len(selector.test_files)} test file(s): {reason}')
+        if not selected_tests:
+            return
+        
+        result = self.build_log.run([self._pytest_python(), '-m', 'pytest', '-q', '-p', 'no:cacheprovider', *selected_tests], label='pytest', cwd=self.project_directory, check=False)
+        ## 5: no tests collected
+        if result.returncode not in (0, 5):
+            raise StepFailure(f"Project tests failed for '{self.package_name}' (full log: {self.build_log.log_path}):\n{result.stdout}")
+        selector.record_success()
+
+    def _pytest_python(self):
+        '''The python to run pytest with: the test python if it has pytest, or if it
+        is the dev venv (ours, pytest gets installed there). Otherwise it is the host
+        interpreter, which is never modified: a tools venv on top of it gets pytest.'''
+        if subprocess.run([self.test_python, '-c', 'import pytest'], capture_output=True).returncode == 0:
+            return self.test_python
+        if self.dev_environment is not None and self.test_python == self.dev_environment.python:
+            wheelhouse_args = WheelhouseCache(self.cache_directory, python_executable=self.test_python).install_arguments(['pytest'])
+            subprocess.run([self.test_python, '-m', 'pip', 'install', 'pytest', *wheelhouse_args], check=True)
+            return self.test_python
+        return tools_environment(self.cache_directory, self.test_python)
+
+    def test_interpreter_matrix(self):
+        matrix = InterpreterMatrix(
+            self.project_directory,
+            os.path.join(self.pypi_structure_directory, 'matrix'),
+            self.package_name,
+            self.cache_directory,
+            interpreter_paths=self.interpreter_paths,
+            excluded_folders=self.user_options.get('excluded_folders'),
+            excluded_directories=[self.distribution_directory, self.pypi_structure_directory,
+                self.pypi_distribution_directory, self.pypi_build_directory, self.exe_structure_directory],
+            pyproject_path=self.pyproject_file_path,
+        )
+        if not matrix.interpreters:
+            raise StepFailure(f"Interpreter matrix: no interpreter found (PATH, pyenv, interpreter_paths={self.interpreter_paths!r}).")
+        results = matrix.run(self.wheel_path)
+        matrix.print_table(results)
+        if not all(result['passed'] for result in results):
+            raise StepFailure(f"Interpreter matrix failed for '{self.package_name}'.")
+
+    def build_zipapp(self):
+        self.zipapp_path = create_zipapp(
+            self.wheel_path,
+            self.package_name,
+            os.path.join(self.exe_build_directory, 'zipapp'),
+            self.exe_distribution_directory,
+            self.cache_directory,
+        )
+
+    def _previous_release_wheel(self):
+        '''(version, wheel path) of the previous release in the artifact store, else (None, None).'''
+        name, _, tag = describe_artifact(os.path.basename(self.wheel_path))
+        current = parse_version(self.version_number)
+        versions = [v for v in self.artifact_store.versions(name)
+            if parse_version(v) is not None and (current is None or parse_version(v) < current)]
+        if not versions:
+            return None, None
+        ## The release on the index if we built it, else the highest version below this one
+        previous_version = self.pypi_version_number if self.pypi_version_number in versions else max(versions, key=parse_version)
+        wheels = self.artifact_store.find(name, previous_version, tag) or {
+            filename: path for filename, path in self.artifact_store.find(name, previous_version).items() if filename.endswith('.whl')}
+        if not wheels:
+            return None, None
+        filename, blob_path = sorted(wheels.items())[0]
+        wheels_directory = os.path.join(self.pypi_structure_directory, 'benchmarks', 'wheels')
+        os.makedirs(wheels_directory, exist_ok=True)
+        return previous_version, self.artifact_store.materialize(blob_path, os.path.join(wheels_directory, filename))
+
+    def benchmark_against_previous_release(self):
+        config = read_benchmark_config(self.pyproject_file_path)
+        if not config:
+            pt.c('-- No benchmarks declared ([tool.pup_py] benchmarks), skipping the benchmark gate')
+            return
+        previous_version, previous_wheel_path = self._previous_release_wheel()
+        if previous_wheel_path is None:
+            pt.c(f'-- No previous release of {self.package_name} in the artifact store, skipping the benchmark gate')
+            return
+        
+        gate = BenchmarkGate(
+            os.path.join(self.pypi_structure_directory, 'benchmarks'),
+            self.cache_directory,
+            config['benchmarks'],
+            tolerance=config['tolerance'],
+        )
+        try:
+            results = gate.run(self.wheel_path, previous_wheel_path)
+        except (RuntimeError, subprocess.CalledProcessError) as e:
+            raise StepFailure(f"Benchmarks of '{self.package_name}' could not run: {e}") from e
+        gate.print_table(results, previous_version)
+        self.benchmarks_passed = not any(result['regressed'] for result in results)
+        if not self.benchmarks_passed:
+            raise StepFailure(f"'{self.package_name}' {self.version_number} is slower than {previous_version} past the {config['tolerance']:.0%} tolerance, not uploading.")
+
     def upload_package_to_pypi(self):
+        if self.benchmarks_passed is False:
+            raise StepFailure(f"Upload blocked: the benchmarks of '{self.package_name}' regressed (see benchmark_against_previous_release).")
+        
         if self.use_test_pypi:
             repository_url = 'https://test.pypi.org/legacy/'
             token = os.getenv(self.test_pypi_token_env_var)
@@ -454,8 +850,7 @@ class PipUniversalProjects:
 
     For a visual guide on generating and setting PyPI tokens, watch this YouTube tutorial: https://youtu.be/WGsMydFFPMk?t=104 (Should start at 1:44 and last for 2 minutes to 3:45)
             """
-            print(error_message)
-            sys.exit(1)
+            raise StepFailure(error_message)
         
         pt.c(f'Uploading Package to {"Test PyPI" if self.use_test_pypi else "PyPI"} using token authentication')
 
@@ -467,7 +862,7 @@ class PipUniversalProjects:
             non_interactive=True,
             verbose=True,
         )
-        dists = [self.wheel_path]
+        dists = [self.wheel_path, self.sdist_path]
         pt(dists)
 
         try:
@@ -477,20 +872,24 @@ class PipUniversalProjects:
             pt(e)
             if "This filename has already been used, use a different version." in str(e):
                 pt()
-                if self.automatically_increment_version:
-                    pt()
-                    self.verifier.verify_version_available()
-                    self.version_number = self.verifier.auto_increment_version()
-                    pt(self.version_number)
-                    self.setup_file_manager.modify_version(self.version_number)
-                    self.build_wheel()  # Rebuild the wheel with the new version
-                    self.upload_package_to_pypi()  # Try uploading again
-                else:
+                self.verifier.verify_version_available()
+                message = f"The version {self.version_number} of '{self.package_name}' has already been used."
+                if self.verifier.resolve_conflict('version_taken', message, self.verifier.pypi_version_number) == 'prompt':
                     pt()
-                    self.verifier.prompt_for_input("The current version has already been used. Please enter a new version:")
-                    self.setup_file_manager.modify_version(self.version_number)
-                    self.build_wheel()  # Rebuild the wheel with the new version
-                    self.upload_package_to_pypi()  # Try uploading again
+                    self.verifier.version_number = self.verifier.ask('new_version', "The current version has already been used. Please enter a new version:")
+                self.version_number = self.verifier.version_number
+                pt(self.version_number)
+                self.setup_file_manager.modify_version(self.version_number)
+                old_wheel_path = self.wheel_path
+                self.wheel_path = restamp_wheel(self.wheel_path, self.version_number, remove_original=False)  # Re-stamp the wheel instead of rebuilding it
+                if os.path.abspath(old_wheel_path) != os.path.abspath(self.wheel_path):
+                    remove_file(old_wheel_path)  ## May be a link to a (read-only, older) store blob
+                self._stage_sources()  # Picks up the new version
+                self.sdist_path = self._run_build_backend('--sdist')  # The sdist is cheap to rebuild
+                ## The new version changed the sources/pyproject: the next run reuses these instead of rebuilding
+                self.build_fingerprint = self._source_fingerprint()
+                self._store_artifacts()
+                self.upload_package_to_pypi()  # Try uploading again
             else:
                 pt()
                 raise e
@@ -499,20 +898,72 @@ class PipUniversalProjects:
         pypi_type = 'Test PyPI' if self.use_test_pypi else 'PyPI'
         pt.c(f'Installing Package from {pypi_type}')
         index_url = 'https://test.pypi.org/simple/' if self.use_test_pypi else 'https://pypi.org/simple'
-        subprocess.run([sys.executable, '-m', 'pip', 'install', '--index-url', index_url, self.package_name], check=True)
+        requirement = f'{self.package_name}=={self.version_number}'
+        
+        ## Only the package itself is fetched from the index; its dependencies 
+        ## come from the local wheelhouse whenever it already covers them.
+        download_directory = tempfile.mkdtemp()
+        try:
+            subprocess.run([
+                    sys.executable, '-m', 'pip', 'download', requirement, 
+                    '--no-deps', 
+                    '--index-url', index_url, 
+                    '--dest', download_directory], 
+                check=True)
+            downloaded_wheels = [os.path.join(download_directory, f) for f in os.listdir(download_directory) if f.endswith('.whl')]
+            if not downloaded_wheels:
+                ## Only an sdist was available: we can't know its dependencies without building it
+                subprocess.run([sys.executable, '-m', 'pip', 'install', '--index-url', index_url, requirement], check=True)
+                return
+            
+            requirements = read_wheel_requirements(downloaded_wheels[0])
+            wheelhouse_args = self.wheelhouse_cache.install_arguments(requirements)
+            subprocess.run([
+                    sys.executable, '-m', 'pip', 'install', requirement, 
+                    *wheelhouse_args, 
+                    '--find-links', download_directory], 
+                check=True)
+        finally:
+            shutil.rmtree(download_directory, ignore_errors=True)
 
     def _execute_full_workflow(self):
+        try:
+            self._execute_workflow_steps()
+        except SkipProject as e:
+            ## The conflict policy skips this project (a batch just moves on to the next one)
+            self.skipped = True
+            print(f'SKIPPED: {self.package_name}: {e}')
+
+    def _execute_workflow_steps(self):
         self.user_options()
         self.create_directories()
         self.check_or_gen_requirements()
         self.setup_file_data()
+        if self.dev_mode:
+            ## Nothing is published: no name/version checks, no build + reinstall on every run
+            self.fix_and_optimize_package()
+            self.install_editable()
+            self.test_installed_package()
+            self.run_project_tests()
+            print(f'SUCCESS: {self.package_name} is installed in editable mode in {self.dev_environment.env_directory} and its tests passed.')
+            return
         # pt.ex()
         self.verify_package_availability_status()
         self.fix_and_optimize_package()
         self.build_wheel()
-        self.uninstall_package()
-        self.install_package_locally()
-        self.test_installed_package() ## Test Local Wheel Package
+        self.check_distributions()
+        with INTERPRETER_LOCK: ## Reinstall + tests of one project at a time, in this interpreter
+            self.uninstall_package()
+            self.install_package_locally()
+            self.test_installed_package() ## Test Local Wheel Package
+            self.run_project_tests() ## The project's own (affected) tests, against the installed package
+        if self.interpreter_matrix:
+            self.test_interpreter_matrix() ## Test against every local interpreter
+        self.benchmark_against_previous_release() ## Blocks the upload if the new wheel got slower
+        if self.zipapp:
+            self.build_zipapp() ## Single file executable in exe_distribution_directory
+        if self.upload:
+            self.upload_package_to_pypi()
         # pt.ex()
         # self.uninstall_package()
         # self.upload_package_to_pypi()
@@ -0,0 +1,507 @@
+'''Static (non-executing) package metadata extraction.
+
+    Reads the metadata of a project from:
+    - pyproject.toml: PEP 621 [project], [tool.poetry], hatch and setuptools
+      dynamic versions
+    - setup.cfg: [metadata] / [options] / [options.*] (including `attr:`
+      versions), every key as the setup() argument it sets
+    - setup.py: through AST static evaluation of the `setup(...)` call. The
+      file is never executed and `egg_info` is never invoked. Whatever can't
+      be evaluated statically is listed in `unresolved` instead.
+    - main.py: `# Version: ...` style header comments
+
+    Results are cached per file content hash (on disk, shared by every
+    project) and per (mtime, size) in memory, so repeated lookups cost a
+    stat() call. The other files a result was read from (`attr:` modules,
+    hatch version files, `pkg/__init__.py` versions) are recorded with it
+    and checked the same way, so editing them invalidates the result.
+'''
+
+import os, re, ast, json, hashlib, threading, configparser
+import toml
+from print_tricks import pt
+
+
+EMPTY_METADATA = {
+    'package_name': None,
+    'version': None,
+    'description': '',
+    'author': None,
+    'author_email': None,
+    'authors': [],
+    'dependencies': [],
+    'dev_dependencies': [],
+    'optional_dependencies': {},
+    'packages': None,
+    'python_requires': None,
+    'entry_points': {},
+    'source': None,
+    'dynamic': [],
+    'unresolved': [],
+    'version_source': None,     ## {'attr': 'pkg.__version__'} or {'file': 'VERSION'} when the version is read from there
+}
+
+## Bump when the extraction logic changes, so stale disk cache entries are ignored
+_EXTRACTOR_VERSION = 4
+
+_memory_cache = {}
+_memory_cache_lock = threading.Lock()
+
+
+class _Unresolved(Exception):
+    '''Raised when an expression can't be evaluated without running code.'''
+
+
+def _split_author(author):
+    '''"Name <email>" -> (name, email)'''
+    match = re.match(r'\s*(.*?)\s*<([^>]+)>\s*$', author or '')
+    if match:
+        return match.group(1) or None, match.group(2)
+    return (author or None), None
+
+def _apply_authors(metadata, authors):
+    metadata['authors'] = authors
+    for name, email in authors:
+        if name and not metadata['author']:
+            metadata['author'] = name
+        if email and not metadata['author_email']:
+            metadata['author_email'] = email
+
+def _find_module_file(project_directory, dotted_name, references):
+    parts = dotted_name.split('.')
+    for base in (project_directory, os.path.join(project_directory, 'src')):
+        for candidate in (os.path.join(base, *parts) + '.py', os.path.join(base, *parts, '__init__.py')):
+            ## Missing candidates are references too: creating one changes the result
+            references.add(os.path.abspath(candidate))
+            if os.path.exists(candidate):
+                return candidate
+    return None
+
+def _static_module_attribute(project_directory, attribute_path, references):
+    '''`pkg.__version__` -> the literal assigned to it in pkg/__init__.py (or None).'''
+    module_name, _, attribute = attribute_path.rpartition('.')
+    module_file = _find_module_file(project_directory, module_name, references)
+    if module_file is None:
+        return None
+    return _static_file_assignment(module_file, references, attribute)
+
+def _static_file_assignment(file_path, references, attribute='__version__'):
+    references.add(os.path.abspath(file_path))
+    try:
+        with open(file_path, 'rb') as file:
+            tree = ast.parse(file.read(), filename=file_path)
+    except (OSError, SyntaxError, ValueError):
+        return None
+    for node in tree.body:
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target] if isinstance(node, ast.AnnAssign) and node.value else []
+        for target in targets:
+            if isinstance(target, ast.Name) and target.id == attribute:
+                try:
+                    return ast.literal_eval(node.value)
+                except ValueError:
+                    return None
+    return None
+
+
+## ---------------- pyproject.toml ----------------
+
+def _extract_pyproject(file_path, metadata, references):
+    project_directory = os.path.dirname(file_path)
+    with open(file_path, 'r', encoding='utf-8') as file:
+        data = toml.load(file)
+    tool = data.get('tool', {})
+
+    if 'project' in data:
+        project = data['project']
+        metadata['source'] = 'pyproject (PEP 621)'
+        metadata['package_name'] = project.get('name')
+        metadata['version'] = project.get('version')
+        metadata['description'] = project.get('description', '')
+        metadata['dependencies'] = list(project.get('dependencies', []))
+        metadata['optional_dependencies'] = dict(project.get('optional-dependencies', {}))
+        metadata['python_requires'] = project.get('requires-python')
+        metadata['dynamic'] = list(project.get('dynamic', []))
+        entry_points = {group: dict(entries) for group, entries in project.get('entry-points', {}).items()}
+        if project.get('scripts'):
+            entry_points['console_scripts'] = dict(project['scripts'])
+        if project.get('gui-scripts'):
+            entry_points['gui_scripts'] = dict(project['gui-scripts'])
+        metadata['entry_points'] = entry_points
+        ## PEP 621 allows both {name, email} in one table, and pup_py's template splits them
+        _apply_authors(metadata, [(a.get('name'), a.get('email')) for a in project.get('authors', [])])
+    elif 'poetry' in tool:
+        poetry = tool['poetry']
+        metadata['source'] = 'pyproject (poetry)'
+        metadata['package_name'] = poetry.get('name')
+        metadata['version'] = poetry.get('version')
+        metadata['description'] = poetry.get('description', '')
+        dependencies = dict(poetry.get('dependencies', {}))
+        metadata['python_requires'] = dependencies.pop('python', None)
+        ## Poetry's ^ / bare versions aren't PEP 508 specifiers: those are kept as the bare name
+        metadata['dependencies'] = [f'{n}{v}' if isinstance(v, str) and v[:1] in '<>=!~' else n for n, v in dependencies.items()]
+        metadata['dev_dependencies'] = list(poetry.get('dev-dependencies', {}))
+        if poetry.get('scripts'):
+            metadata['entry_points'] = {'console_scripts': dict(poetry['scripts'])}
+        if 'packages' in poetry:
+            metadata['packages'] = poetry['packages']
+        _apply_authors(metadata, [_split_author(a) for a in poetry.get('authors', [])])
+
+    ## Dynamic versions that can still be read statically
+    if metadata['version'] is None and 'version' in metadata['dynamic']:
+        hatch_version_path = tool.get('hatch', {}).get('version', {}).get('path')
+        setuptools_version = tool.get('setuptools', {}).get('dynamic', {}).get('version', {})
+        if hatch_version_path:
+            metadata['version'] = _static_file_assignment(os.path.join(project_directory, hatch_version_path), references)
+        elif 'attr' in setuptools_version:
+            metadata['version'] = _static_module_attribute(project_directory, setuptools_version['attr'], references)
+            metadata['version_source'] = {'attr': setuptools_version['attr']}
+        if metadata['version'] is None:
+            metadata['unresolved'].append('version')
+
+    if 'setuptools' in tool and 'packages' in tool['setuptools']:
+        metadata['packages'] = tool['setuptools']['packages']
+    return metadata
+
+
+## ---------------- setup.cfg ----------------
+
+## setup.cfg keys spelled differently than the setup() argument they set
+_CFG_ALIASES = {'home_page': 'url', 'summary': 'description', 'classifier': 'classifiers', 'platform': 'platforms', 'license_file': 'license_files'}
+## How setuptools parses the values (anything else is a plain string)
+_CFG_LISTS = {'platforms', 'keywords', 'provides', 'requires', 'obsoletes', 'classifiers', 'license_files',
+    'scripts', 'eager_resources', 'dependency_links', 'namespace_packages', 'py_modules', 'packages'}
+_CFG_SEMICOLON_LISTS = {'install_requires', 'setup_requires', 'tests_require'}
+_CFG_BOOLS = {'zip_safe', 'include_package_data'}
+_CFG_DICTS = {'package_dir', 'project_urls', 'cmdclass'}
+## Directives only resolved (statically) for these keys, anywhere else they are unresolved
+_CFG_DIRECTIVE_KEYS = {'version', 'long_description'}
+
+def _cfg_list(value, separator=','):
+    '''setuptools' list values: one item per line, else `separator` separated.'''
+    items = (value or '').splitlines() if '\n' in (value or '') else (value or '').split(separator)
+    return [item.strip() for item in items if item.strip() and not item.strip().startswith('#')]
+
+def _cfg_value(key, value):
+    if key in _CFG_LISTS:
+        return _cfg_list(value)
+    if key in _CFG_SEMICOLON_LISTS:
+        return _cfg_list(value, ';')
+    if key in _CFG_BOOLS:
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    if key in _CFG_DICTS:
+        return {k.strip(): v.strip() for k, _, v in (line.partition('=') for line in _cfg_list(value))}
+    return value.strip()
+
+def _entry_points_table(entry_points):
+    '''setup()'s {group: ["name = target", ...]} (or {group: {name: target}}) -> {group: {name: target}}'''
+    table = {}
+    for group, entries in entry_points.items():
+        if isinstance(entries, str):
+            entries = [entries]
+        if isinstance(entries, list):
+            entries = dict(e.split('=', 1) for e in entries if '=' in e)
+        if isinstance(entries, dict):
+            table[group] = {k.strip(): v.strip() for k, v in entries.items()}
+    return table
+
+def _setup_cfg_arguments(parser, metadata):
+    '''Every [metadata] / [options] / [options.*] key of setup.cfg, as the setup() argument it sets.'''
+    arguments = {}
+    for section_name in ('metadata', 'options'):
+        if not parser.has_section(section_name):
+            continue
+        for key, value in parser[section_name].items():
+            key = key.lower().replace('-', '_')
+            key = _CFG_ALIASES.get(key, key)
+            if value.strip().startswith(('file:', 'attr:')) and key not in _CFG_DIRECTIVE_KEYS:
+                metadata['unresolved'].append(key)
+                continue
+            arguments[key] = _cfg_value(key, value)
+
+    for section_name in parser.sections():
+        if not section_name.startswith('options.') or section_name == 'options.packages.find':
+            continue
+        key = section_name[len('options.'):]
+        separator = ';' if key == 'extras_require' else ','
+        arguments[key] = {k: _cfg_list(v, separator) for k, v in parser[section_name].items()}
+
+    packages = arguments.get('packages')
+    find = {}
+    if parser.has_section('options.packages.find'):
+        for key, value in parser['options.packages.find'].items():
+            key = key.lower().replace('-', '_')
+            if key == 'where' and _cfg_list(value):
+                find['where'] = _cfg_list(value)[0]
+            elif key in ('include', 'exclude'):
+                find[key] = _cfg_list(value)
+            else:
+                arguments[f'packages.find.{key}'] = value.strip()
+    if packages in (['find:'], ['find_namespace:']):
+        ## Same shape as find_packages() in setup.py
+        arguments['packages'] = {'find': dict(find, namespaces=packages == ['find_namespace:'])}
+
+    long_description = arguments.get('long_description', '')
+    if long_description.startswith('file:'):
+        arguments['long_description'] = {'file': _cfg_list(long_description[len('file:'):])}
+    return arguments
+
+def _extract_setup_cfg(file_path, metadata, references):
+    project_directory = os.path.dirname(file_path)
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str    ## Package names (package_data) and project_urls labels keep their case
+    parser.read(file_path, encoding='utf-8')
+    if not parser.has_section('metadata') and not parser.has_section('options'):
+        return metadata
+    arguments = _setup_cfg_arguments(parser, metadata)
+    metadata['source'] = 'setup.cfg'
+    metadata['setup_arguments'] = arguments
+    metadata['package_name'] = arguments.get('name')
+    metadata['description'] = arguments.get('description', '')
+
+    version = arguments.get('version')
+    if version and version.startswith('attr:'):
+        metadata['version_source'] = {'attr': version[len('attr:'):].strip()}
+        version = _static_module_attribute(project_directory, metadata['version_source']['attr'], references)
+    elif version and version.startswith('file:'):
+        metadata['version_source'] = {'file': version[len('file:'):].strip()}
+        version_file = os.path.join(project_directory, metadata['version_source']['file'])
+        references.add(os.path.abspath(version_file))
+        try:
+            with open(version_file, 'r', encoding='utf-8') as file:
+                version = file.read().strip()
+        except OSError:
+            version = None
+    metadata['version'] = version
+    if metadata['version'] is None:
+        metadata['unresolved'].append('version')
+
+    _apply_authors(metadata, [(arguments.get('author'), arguments.get('author_email'))])
+    metadata['dependencies'] = list(arguments.get('install_requires', []))
+    metadata['dev_dependencies'] = list(arguments.get('setup_requires', []))
+    metadata['python_requires'] = arguments.get('python_requires')
+    metadata['packages'] = arguments.get('packages') or None
+    metadata['optional_dependencies'] = dict(arguments.get('extras_require', {}))
+    metadata['entry_points'] = _entry_points_table(arguments.get('entry_points', {}))
+    return metadata
+
+
+## ---------------- setup.py (AST, never executed) ----------------
+
+class _StaticEvaluator:
+    def __init__(self):
+        self.namespace = {}
+
+    def evaluate(self, node):
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            values = [self.evaluate(element) for element in node.elts]
+            return values if not isinstance(node, ast.Set) else set(values)
+        if isinstance(node, ast.Dict):
+            result = {}
+            for key, value in zip(node.keys, node.values):
+                if key is None:  ## {**other}
+                    result.update(self.evaluate(value))
+                else:
+                    result[self.evaluate(key)] = self.evaluate(value)
+            return result
+        if isinstance(node, ast.Name):
+            if node.id in self.namespace:
+                return self.namespace[node.id]
+            raise _Unresolved(node.id)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            return self.evaluate(node.left) + self.evaluate(node.right)
+        if isinstance(node, ast.JoinedStr):
+            return ''.join(str(self.evaluate(v.value if isinstance(v, ast.FormattedValue) else v)) for v in node.values)
+        if isinstance(node, ast.Call):
+            function_name = node.func.id if isinstance(node.func, ast.Name) else getattr(node.func, 'attr', None)
+            if function_name in ('find_packages', 'find_namespace_packages'):
+                ## Same shape as [tool.setuptools] packages = {find = {...}}
+                find = {k.arg: self.evaluate(k.value) for k in node.keywords if k.arg}
+                find['namespaces'] = function_name == 'find_namespace_packages'
+                return {'find': find}
+            if function_name == 'dict':
+                return {k.arg: self.evaluate(k.value) for k in node.keywords if k.arg}
+        raise _Unresolved(ast.dump(node)[:80])
+
+    def bind_module_level(self, tree):
+        '''Module level NAME = <literal> assignments (used later as setup() arguments).'''
+        for node in tree.body:
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                try:
+                    self.namespace[node.targets[0].id] = self.evaluate(node.value)
+                except _Unresolved:
+                    self.namespace.pop(node.targets[0].id, None)
+
+def _find_setup_call(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            function_name = node.func.id if isinstance(node.func, ast.Name) else getattr(node.func, 'attr', None)
+            if function_name == 'setup':
+                return node
+    return None
+
+def _extract_setup_py(file_path, metadata, references):
+    project_directory = os.path.dirname(file_path)
+    metadata['source'] = 'setup.py (static)'
+    try:
+        with open(file_path, 'rb') as file:
+            tree = ast.parse(file.read(), filename=file_path)
+    except (SyntaxError, ValueError) as e:
+        metadata['unresolved'].append(f'setup.py ({e.__class__.__name__}: {e})')
+        return metadata
+    setup_call = _find_setup_call(tree)
+    if setup_call is None:
+        metadata['unresolved'].append('setup() call')
+        return metadata
+
+    evaluator = _StaticEvaluator()
+    evaluator.bind_module_level(tree)
+    arguments = {}
+    for keyword in setup_call.keywords:
+        try:
+            if keyword.arg is None:  ## setup(**kwargs)
+                arguments.update(evaluator.evaluate(keyword.value))
+            else:
+                arguments[keyword.arg] = evaluator.evaluate(keyword.value)
+        except (_Unresolved, TypeError):
+            metadata['unresolved'].append(keyword.arg or '**kwargs')
+    metadata['setup_arguments'] = arguments
+
+    metadata['package_name'] = arguments.get('name')
+    metadata['version'] = arguments.get('version')
+    if metadata['version'] is None and 'version' not in metadata['unresolved']:
+        ## Common pattern: the version lives in the package's __init__.py
+        package_name = metadata['package_name'] or os.path.basename(project_directory)
+        version_attribute = f"{package_name.replace('-', '_')}.__version__"
+        metadata['version'] = _static_module_attribute(project_directory, version_attribute, references)
+        if metadata['version'] is not None:
+            metadata['version_source'] = {'attr': version_attribute}
+    metadata['description'] = arguments.get('description', '')
+    _apply_authors(metadata, [(arguments.get('author'), arguments.get('author_email'))])
+    metadata['dependencies'] = list(arguments.get('install_requires', []))
+    metadata['optional_dependencies'] = dict(arguments.get('extras_require', {}))
+    metadata['dev_dependencies'] = list(arguments.get('setup_requires', []))
+    metadata['python_requires'] = arguments.get('python_requires')
+    metadata['packages'] = arguments.get('packages')
+    entry_points = arguments.get('entry_points', {})
+    if isinstance(entry_points, dict):
+        metadata['entry_points'] = _entry_points_table(entry_points)
+    if 'ext_modules' in [k.arg for k in setup_call.keywords]:
+        metadata['unresolved'].append('ext_modules')
+    return metadata
+
+
+## ---------------- main.py header comments ----------------
+
+def _extract_main_file(file_path, metadata, references):
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+        content = file.read()
+
+    def header(key):
+        match = re.search(rf'^\s*#\s*{key}:\s*(.+?)\s*$', content, re.MULTILINE | re.IGNORECASE)
+        return match.group(1) if match else None
+
+    metadata['source'] = 'main.py (comments)'
+    metadata['package_name'] = header('Package Name')
+    metadata['version'] = header('Version')
+    metadata['description'] = header('Description') or ''
+    authors = header('Authors')
+    _apply_authors(metadata, [_split_author(a.strip()) for a in authors.split(',')] if authors else [])
+    dependencies = header('Dependencies')
+    metadata['dependencies'] = [d.strip() for d in dependencies.split(',')] if dependencies else []
+    return metadata
+
+
+_EXTRACTORS = {
+    'pyproject.toml': _extract_pyproject,
+    'setup.cfg': _extract_setup_cfg,
+    'setup.py': _extract_setup_py,
+}
+
+def _file_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+def _file_digest(path):
+    try:
+        with open(path, 'rb') as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except OSError:
+        return None
+
+def extract_metadata(file_path, cache_directory=None):
+    '''Metadata of a single pyproject.toml / setup.cfg / setup.py / main.py
+    (as a fresh dict: callers are free to modify it).'''
+    file_path = os.path.abspath(file_path)
+    memory_key = _file_stat(file_path)
+    with _memory_cache_lock:
+        cached = _memory_cache.get(file_path)
+    if cached and cached[0] == memory_key and all(_file_stat(path) == stat for path, stat in cached[2].items()):
+        return json.loads(cached[1])
+
+    digest = _file_digest(file_path)
+    file_name = os.path.basename(file_path)
+    cache_directory = os.path.join(cache_directory or os.path.join(os.path.expanduser('~'), '.cache', 'pup_py'), 'metadata')
+    ## Dynamic versions/attrs depend on the file's location too, so it's part of the key
+    cache_key = hashlib.sha256(f'{_EXTRACTOR_VERSION}\0{file_path}\0{digest}'.encode('utf-8')).hexdigest()
+    cache_path = os.path.join(cache_directory, f'{cache_key}.json')
+
+    ## {'metadata': serialized metadata, 'references': {path: sha256 (None: missing)}}
+    entry = None
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as file:
+            entry = json.load(file)
+        if any(_file_digest(path) != path_digest for path, path_digest in entry['references'].items()):
+            entry = None
+    if entry is None:
+        metadata = json.loads(json.dumps(EMPTY_METADATA))
+        references = set()
+        extractor = _EXTRACTORS.get(file_name, _extract_main_file)
+        metadata = extractor(file_path, metadata, references)
+        references.discard(file_path)
+        entry = {
+            'metadata': json.dumps(metadata, default=sorted),
+            'references': {path: _file_digest(path) for path in sorted(references)},
+        }
+        os.makedirs(cache_directory, exist_ok=True)
+        temp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(entry, file)
+        os.replace(temp_path, cache_path)
+
+    with _memory_cache_lock:
+        _memory_cache[file_path] = (memory_key, entry['metadata'], {path: _file_stat(path) for path in entry['references']})
+    return json.loads(entry['metadata'])
+
+def extract_project_metadata(project_directory, cache_directory=None):
+    '''Merged metadata of a project: pyproject.toml wins over setup.cfg,
+    which wins over setup.py (field by field, for fields they don't set).'''
+    merged = json.loads(json.dumps(EMPTY_METADATA))
+    sources = []
+    for file_name in ('setup.py', 'setup.cfg', 'pyproject.toml'):
+        path = os.path.join(project_directory, file_name)
+        if not os.path.exists(path):
+            continue
+        metadata = extract_metadata(path, cache_directory)
+        if metadata['source'] is None:
+            continue
+        sources.append(metadata['source'])
+        for key, value in metadata.items():
+            if key in ('source', 'unresolved'):
+                continue
+            if value not in (None, '', [], {}):
+                merged[key] = value
+        merged['unresolved'] = sorted(set(merged['unresolved']) | set(metadata['unresolved']))
+    ## A field resolved by a higher priority file isn't unresolved anymore
+    merged['unresolved'] = [key for key in merged['unresolved'] if merged.get(key) in (None, '', [], {})]
+    merged['source'] = ', '.join(sources) or None
+    return merged
+
+
+if __name__ == '__main__':
+    import sys
+    pt(extract_project_metadata(sys.argv[1] if len(sys.argv) > 1 else os.getcwd()))
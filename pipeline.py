@@ -0,0 +1,145 @@
+'''Long-lived API for PUP (Pip Universal Projects): configure once, run many times.
+
+    pipeline = Pipeline(use_test_pypi=True, conflict_policy='bump_patch')
+    result = pipeline.run('projects/A')
+    results = pipeline.run_many(['projects/A', ('projects/B', {'zipapp': True})], max_workers=2, ask_up_front=True)
+    Pipeline.print_results(results)
+
+    - Keyword arguments are the PipUniversalProjects options of every run,
+      run() takes per project overrides
+    - What is expensive to create stays warm between runs (per cache
+      directory, index and remote cache): the index HTTP session, the
+      wheelhouse, the artifact store and its database, the remote cache
+      session and the prompt queue
+    - run_many() runs projects in threads of one process: their reinstall +
+      test steps, which use this interpreter's site-packages, take turns
+      (see INTERPRETER_STEPS in main.py). Dev mode projects test in their
+      own venvs
+    - run_many(ask_up_front=True) first asks every conflict prompt the
+      projects' policies need (see pypi_verifier.queue_answers_up_front), so
+      the runs themselves never wait on a human
+    - A failing step raises StepFailure, which only ends that project's run:
+      run() returns a result dict instead of exiting
+        {'project', 'status' ('passed', 'failed' or 'skipped'), 'error',
+         'seconds', 'package_name', 'version', 'wheel_path', 'sdist_path',
+         'steps': [{'step', 'status', 'seconds', 'error'}, ...]}
+'''
+
+import time, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from main import PipUniversalProjects, INTERPRETER_STEPS, INTERPRETER_LOCK
+from decorators import StepFailure
+from conflict_policies import ConflictPolicy, PromptQueue, SkipProject
+from pypi_verifier import queue_answers_up_front
+
+
+## Attributes of a PipUniversalProjects that every run with the same shared key reuses
+SHARED_ATTRIBUTES = ('index_client', 'wheelhouse_cache', 'artifact_store', 'remote_cache', 'prompt_queue')
+
+
+class Pipeline:
+    def __init__(self, **options):
+        self.options = options
+        self.warm = {}
+        self.lock = threading.Lock()
+
+    def _shared_key(self, options):
+        return repr(tuple(options.get(name) for name in (
+            'cache_directory', 'use_test_pypi', 'remote_cache_url', 'remote_cache_token_env_var', 'artifact_retention')))
+
+    def create(self, project_directory, **overrides):
+        '''A configured (not yet executed) PipUniversalProjects, wired to the warm shared objects.'''
+        options = {**self.options, **overrides, 'execute': False, 'watch': False}
+        key = self._shared_key(options)
+        with self.lock:
+            shared = self.warm.get(key)
+        if shared is not None:
+            return PipUniversalProjects(project_directory, shared=shared, **options)
+
+        ## The first run of this key creates the shared objects
+        pup = PipUniversalProjects(project_directory, **options)
+        with self.lock:
+            if key not in self.warm:
+                if pup.prompt_queue is None:
+                    ## One queue for every run, so answers queued (or recorded) once are used by all
+                    pup.prompt_queue = PromptQueue(interactive=True if pup.use_gui else None)
+                self.warm[key] = {name: getattr(pup, name) for name in SHARED_ATTRIBUTES}
+            for name, value in self.warm[key].items():
+                setattr(pup, name, value)
+        return pup
+
+    def run(self, project_directory, steps=None, step_listener=None, **overrides):
+        '''Runs the workflow (or only the named `steps`, in order) on one
+        project and returns its result (never exits).'''
+        result = {'project': project_directory, 'status': None, 'error': None, 'seconds': None,
+            'package_name': None, 'version': None, 'wheel_path': None, 'sdist_path': None, 'steps': []}
+        start_time = time.perf_counter()
+        pup = None
+        try:
+            pup = self.create(project_directory, **overrides)
+            pup.step_listener = step_listener
+            result['steps'] = pup.step_results
+            if steps is None:
+                pup._execute_full_workflow()
+            else:
+                for step in steps:
+                    if step in INTERPRETER_STEPS:
+                        with INTERPRETER_LOCK:
+                            getattr(pup, step)()
+                    else:
+                        getattr(pup, step)()
+            result['status'] = 'skipped' if pup.skipped else 'passed'
+        except SkipProject as e:
+            ## Only from `steps`: the full workflow handles it itself
+            result['status'] = 'skipped'
+            result['error'] = str(e)
+        except (Exception, SystemExit) as e:
+            ## SystemExit: code we don't own (or older steps) may still exit
+            result['status'] = 'failed'
+            result['error'] = str(e) or repr(e)
+            if not isinstance(e, StepFailure):
+                print(f'FAILED: {project_directory}: {e!r}')
+        finally:
+            result['seconds'] = time.perf_counter() - start_time
+            if pup is not None:
+                result['package_name'] = pup.package_name
+                result['version'] = pup.version_number
+                result['wheel_path'] = pup.wheel_path
+                result['sdist_path'] = pup.sdist_path
+        return result
+
+    def ask_up_front(self, projects):
+        '''Queues the answers to every conflict prompt of `projects` ((directory,
+        overrides) pairs) now, in this thread, into their runs' prompt queues.'''
+        for project_directory, overrides in projects:
+            try:
+                pup = self.create(project_directory, **overrides)
+                conflict_policy = ConflictPolicy.create(pup.conflict_policy, pup.automatically_increment_version)
+                queue_answers_up_front([pup.project_directory], pup.prompt_queue, conflict_policy,
+                    pup.use_test_pypi, pup.cache_directory)
+            except Exception as e:
+                ## Its run fails (or asks) again, and reports it with the other results
+                print(f'Could not queue the answers of {project_directory} up front: {e}')
+
+    def run_many(self, projects, max_workers=1, ask_up_front=False):
+        '''Results of every project (a directory, or a (directory, overrides) pair), in order.
+        A failure only fails its own project.'''
+        projects = [(project, {}) if isinstance(project, str) else project for project in projects]
+        if ask_up_front:
+            self.ask_up_front(projects)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda project: self.run(project[0], **project[1]), projects))
+
+    @staticmethod
+    def print_results(results):
+        header = f"{'Project':<40} {'Result':<8} {'Version':<12} {'Time':>9}  Steps (slowest first)"
+        print(header)
+        print('-' * len(header))
+        for result in results:
+            slowest = sorted((s for s in result['steps'] if s['seconds'] is not None), key=lambda s: -s['seconds'])[:3]
+            steps = ', '.join(f"{s['step']} {s['seconds']:.2f}s" for s in slowest)
+            print(f"{str(result['package_name'] or result['project']):<40} {result['status'].upper():<8} "
+                f"{str(result['version'] or '-'):<12} {result['seconds']:>8.2f}s  {steps}")
+            if result['error']:
+                print(f"    {result['error'].splitlines()[0]}")
@@ -0,0 +1,318 @@
+'''Server mode for PUP (Pip Universal Projects): a daemon with a job queue.
+
+    pup_py serve [--socket PATH | --port PORT] [--workers 2]
+    pup_py submit build path/to/project [--priority 0] [--option zipapp=true]
+
+    The daemon keeps one Pipeline (see pipeline.py) and its worker threads
+    warm, so jobs skip the cold start: imports, HTTP sessions, the artifact
+    store, the step caches...
+
+    It listens on a Unix socket (default ~/.cache/pup_py/pup_server.sock),
+    or on localhost TCP (--port, or when Unix sockets aren't available).
+    Protocol, on either: the client sends one JSON line, the server answers
+    with JSON lines (NDJSON) until the connection closes:
+        -> {"action": "build" | "verify" | "release", "project": ..., "priority": 0, "options": {...}}
+        <- {"event": "queued", "job": ..., "position": ...}
+        <- {"event": "started", "job": ...}
+        <- {"event": "step", "job": ..., "step": ..., "status": "started" | "passed" | "skipped" | "failed", "seconds": ...}
+        <- {"event": "result", "job": ..., "cached": false, "result": {...Pipeline result...}}
+        -> {"action": "status"}
+        <- {"event": "status", "queued": [...], "running": [...], "cached_results": ...}
+
+    - Priorities: lower runs first, ties in submission order
+    - Deduplication: a job is keyed on its action, project, options and the
+      project's source fingerprint. A request for a job that is already
+      queued or running follows that job's events. A request for a job that
+      already passed (within `result_ttl`, sources unchanged) gets its
+      result right away
+    - Jobs of the same project never run at the same time
+'''
+
+import os, sys, json, time, heapq, socket, hashlib, argparse, itertools, threading, socketserver
+import queue as queue_module
+from collections import defaultdict
+from print_tricks import pt
+
+from artifact_store import source_fingerprint
+
+
+DEFAULT_PORT = 8767
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'pup_py', 'pup_server.sock')
+
+## Pipeline.run arguments of every action
+ACTIONS = {
+    'verify': {'steps': ['user_options', 'create_directories', 'setup_file_data', 'verify_package_availability_status']},
+    'build': {},
+    'release': {'upload': True},
+}
+
+
+def validate_request(request):
+    '''Raises ValueError unless `request` is a well formed job request.'''
+    if not isinstance(request, dict):
+        raise ValueError('A request is a JSON object')
+    if request.get('action') not in ACTIONS:
+        raise ValueError(f"Unknown action {request.get('action')!r} (actions: {', '.join(ACTIONS)})")
+    if not isinstance(request.get('project'), str) or not request['project']:
+        raise ValueError('"project" must be a project directory or url')
+    priority = request.get('priority', 0)
+    if isinstance(priority, bool) or not isinstance(priority, int):
+        raise ValueError(f'"priority" must be an integer, not {priority!r}')
+    options = request.get('options', {})
+    if not isinstance(options, dict) or not all(isinstance(name, str) and name.isidentifier() for name in options):
+        raise ValueError(f'"options" must be an object of option names to values, not {options!r}')
+
+
+class _Job:
+    def __init__(self, job_id, key, request, cacheable):
+        self.job_id = job_id
+        self.key = key
+        self.request = request
+        self.cacheable = cacheable
+        self.events = []
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        event = dict(event, job=self.job_id)
+        with self.lock:
+            self.events.append(event)
+            for subscriber in self.subscribers:
+                subscriber.put(event)
+
+    def subscribe(self):
+        '''A queue of every event of the job, past ones included.'''
+        subscriber = queue_module.Queue()
+        with self.lock:
+            for event in self.events:
+                subscriber.put(event)
+            self.subscribers.append(subscriber)
+        return subscriber
+
+
+class JobScheduler:
+    def __init__(self, pipeline, workers=2, result_ttl=600):
+        self.pipeline = pipeline
+        self.result_ttl = result_ttl
+        self.heap = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.active_jobs = {}       ## key -> queued or running _Job
+        self.running = set()        ## keys
+        self.results = {}           ## key -> (finished at, result) of the jobs that passed
+        self.project_locks = defaultdict(threading.Lock)
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f'pup_server-worker-{i}', daemon=True).start()
+
+    def job_key(self, request):
+        '''(key, cacheable): sources that can't be fingerprinted (e.g. a git url) are never answered from cache.'''
+        project = request['project']
+        fingerprint = None
+        if os.path.isdir(project):
+            project = os.path.abspath(project)
+            fingerprint = source_fingerprint(project, backend=f"server-{request['action']}")
+        payload = json.dumps([request['action'], project, request.get('options', {}), fingerprint], sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:24], fingerprint is not None
+
+    def submit(self, request):
+        '''(job, cached result or None). The job may be one that was already queued or running.'''
+        ## Everything that can fail does so before the job is registered
+        validate_request(request)
+        key, cacheable = self.job_key(request)
+        with self.condition:
+            cached = self.results.get(key)
+            if cached and time.time() - cached[0] <= self.result_ttl:
+                return _Job(key, key, request, cacheable), cached[1]
+            job = self.active_jobs.get(key)
+            if job is not None:
+                return job, None
+            job = self.active_jobs[key] = _Job(key, key, request, cacheable)
+            heapq.heappush(self.heap, (request.get('priority', 0), next(self.sequence), job))
+            job.publish({'event': 'queued', 'position': len(self.heap)})
+            self.condition.notify()
+        return job, None
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while not self.heap:
+                    self.condition.wait()
+                _, _, job = heapq.heappop(self.heap)
+                self.running.add(job.key)
+            try:
+                self._run(job)
+            finally:
+                with self.condition:
+                    self.running.discard(job.key)
+                    self.active_jobs.pop(job.key, None)
+
+    def _run(self, job):
+        request = job.request
+        def step_listener(step_result, phase):
+            job.publish({'event': 'step', 'step': step_result['step'],
+                'status': 'started' if phase == 'started' else step_result['status'], 'seconds': step_result['seconds']})
+
+        ## Subscribers wait for the result event: it's published whatever happens
+        result = {'project': request['project'], 'status': 'failed', 'error': 'The job ended without a result', 'steps': []}
+        try:
+            with self.project_locks[os.path.abspath(request['project'])]:
+                job.publish({'event': 'started'})
+                arguments = dict(ACTIONS[request['action']], **request.get('options', {}))
+                result = self.pipeline.run(request['project'], step_listener=step_listener, **arguments)
+        except Exception as e:  ## e.g. unknown options
+            result = {'project': request['project'], 'status': 'failed', 'error': repr(e), 'steps': []}
+        finally:
+            if job.cacheable and result['status'] == 'passed':
+                with self.condition:
+                    self.results[job.key] = (time.time(), result)
+            job.publish({'event': 'result', 'cached': False, 'result': result})
+
+    def status(self):
+        with self.condition:
+            queued = [{'job': job.job_id, 'priority': priority, 'action': job.request['action'], 'project': job.request['project']}
+                for priority, _, job in sorted(self.heap)]
+            running = [{'job': job.job_id, 'action': job.request['action'], 'project': job.request['project']}
+                for job in self.active_jobs.values() if job.key in self.running]
+            return {'event': 'status', 'queued': queued, 'running': running, 'cached_results': len(self.results)}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    ## server.scheduler is set by create_server()
+    def _send(self, event):
+        self.wfile.write(json.dumps(event, default=str).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            if isinstance(request, dict) and request.get('action') == 'status':
+                self._send(self.server.scheduler.status())
+                return
+            job, cached_result = self.server.scheduler.submit(request)
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            self._send({'event': 'error', 'error': str(e)})
+            return
+        if cached_result is not None:
+            self._send({'event': 'result', 'job': job.job_id, 'cached': True, 'result': cached_result})
+            return
+        events = job.subscribe()
+        try:
+            while True:
+                event = events.get()
+                self._send(event)
+                if event['event'] == 'result':
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            pass  ## The client left, the job goes on
+        finally:
+            with job.lock:
+                job.subscribers.remove(events)
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def create_server(scheduler, socket_path=DEFAULT_SOCKET_PATH, port=None):
+    '''A Unix socket server, or a localhost TCP one if `port` is given (0: any free port)
+    or Unix sockets aren't available.'''
+    if port is None and hasattr(socket, 'AF_UNIX'):
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  ## Left over by a daemon that didn't exit cleanly
+        server = _ThreadingUnixServer(socket_path, _RequestHandler)
+    else:
+        server = _ThreadingTCPServer(('127.0.0.1', DEFAULT_PORT if port is None else port), _RequestHandler)
+    server.scheduler = scheduler
+    return server
+
+
+def submit(request, socket_path=DEFAULT_SOCKET_PATH, port=None, on_event=None):
+    '''Client: sends a request, calls on_event(event) for every event, returns the last one.'''
+    if port is None and hasattr(socket, 'AF_UNIX'):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socket_path)
+    else:
+        connection = socket.create_connection(('127.0.0.1', DEFAULT_PORT if port is None else port))
+    event = None
+    with connection, connection.makefile('rwb') as stream:
+        stream.write(json.dumps(request).encode('utf-8') + b'\n')
+        stream.flush()
+        for line in stream:
+            event = json.loads(line)
+            if on_event is not None:
+                on_event(event)
+    return event
+
+
+def _print_event(event):
+    if event['event'] == 'step':
+        seconds = f" {event['seconds']:.2f}s" if event['seconds'] is not None else ''
+        print(f"   {event['step']:<40} {event['status']}{seconds}")
+    elif event['event'] == 'result':
+        result = event['result']
+        print(f"{'Cached result' if event['cached'] else 'Result'}: {result['status'].upper()} "
+            f"{result.get('package_name') or result['project']} {result.get('version') or ''} ({result.get('seconds') or 0:.2f}s)")
+        if result.get('error'):
+            print(f"   {result['error']}")
+    else:
+        print(json.dumps(event, indent=None if event['event'] != 'status' else 4))
+
+def _parse_option(text):
+    key, _, value = text.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value  ## A plain string
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pup_py', description='pup_py server mode')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name in ('serve', 'submit', 'status'):
+        subparser = subparsers.add_parser(name)
+        subparser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help='Unix socket path')
+        subparser.add_argument('--port', type=int, default=None, help='Use localhost TCP on this port instead of the Unix socket')
+        if name == 'serve':
+            subparser.add_argument('--workers', type=int, default=2, help='Jobs run at the same time')
+            subparser.add_argument('--result-ttl', type=float, default=600, help='Seconds a passed job answers identical requests')
+            subparser.add_argument('--cache-directory', default=None)
+            subparser.add_argument('--use-test-pypi', action='store_true')
+            subparser.add_argument('--conflict-policy', default=None, help='Nobody answers prompts in a daemon: e.g. bump_patch or fail')
+        elif name == 'submit':
+            subparser.add_argument('action', choices=list(ACTIONS))
+            subparser.add_argument('project', help='Project directory (or git url)')
+            subparser.add_argument('--priority', type=int, default=0, help='Lower runs first')
+            subparser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE', help='PipUniversalProjects option (JSON value), repeatable')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        from pipeline import Pipeline  ## Only the daemon needs the whole workflow: clients start fast
+        pipeline = Pipeline(cache_directory=args.cache_directory, use_test_pypi=args.use_test_pypi, conflict_policy=args.conflict_policy)
+        server = create_server(JobScheduler(pipeline, args.workers, args.result_ttl), args.socket, args.port)
+        address = server.server_address if isinstance(server.server_address, str) else f'127.0.0.1:{server.server_address[1]}'
+        pt.c(f'-- pup_py server listening on {address} with {args.workers} worker(s). Press Ctrl+C to stop.')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print('\nStopped serving.')
+        finally:
+            server.server_close()
+            if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+                os.remove(server.server_address)
+        return
+
+    if args.command == 'status':
+        submit({'action': 'status'}, args.socket, args.port, _print_event)
+        return
+    project = os.path.abspath(args.project) if os.path.exists(args.project) else args.project
+    request = {'action': args.action, 'project': project, 'priority': args.priority, 'options': dict(_parse_option(o) for o in args.option)}
+    last_event = submit(request, args.socket, args.port, _print_event)
+    sys.exit(0 if last_event and last_event['event'] == 'result' and last_event['result']['status'] != 'failed' else 1)
+
+
+if __name__ == '__main__':
+    main()
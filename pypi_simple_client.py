@@ -0,0 +1,115 @@
+'''Lightweight (Test) PyPI metadata client for the availability checks.
+
+    - Versions/filenames come from the PEP 691 JSON simple API
+      (`/simple/<name>/`), which only lists files and hashes (plus the
+      PEP 700 `versions` list), instead of the full `/pypi/<name>/json`
+      document with every release's metadata.
+    - Owner checks read the per-release document
+      (`/pypi/<name>/<version>/json`), which only holds that one release's
+      info and files. If that isn't available, the project document is
+      streamed only until its leading `info` object has been parsed.
+    - Conditional requests (ETag) make an unchanged project cost a 304.
+'''
+
+import re, json
+import requests
+from print_tricks import pt
+
+
+SIMPLE_JSON_CONTENT_TYPE = 'application/vnd.pypi.simple.v1+json'
+
+
+def normalize_project_name(name):
+    '''PEP 503 normalization, which is what the simple API URLs use.'''
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+def parse_simple_html(text):
+    '''PEP 503 (HTML) fallback, for mirrors/proxies that ignore the JSON Accept header.'''
+    files = []
+    for href, filename in re.findall(r'<a\s[^>]*?href="([^"]*)"[^>]*>([^<]+)</a>', text):
+        _, _, fragment = href.partition('#')
+        hash_name, _, hash_value = fragment.partition('=')
+        files.append({'filename': filename.strip(), 'hashes': {hash_name: hash_value} if hash_value else {}})
+    return {'files': files}
+
+def version_from_filename(filename):
+    '''Best effort version of a wheel or sdist file name (None if unknown).'''
+    if filename.endswith('.whl'):
+        parts = filename[:-len('.whl')].split('-')
+        return parts[1] if len(parts) in (5, 6) else None
+    for extension in ('.tar.gz', '.zip', '.tar.bz2', '.tgz'):
+        if filename.endswith(extension):
+            name_and_version = filename[:-len(extension)]
+            return name_and_version.rpartition('-')[2] or None
+    return None
+
+
+class SimpleIndexClient:
+    def __init__(self, use_test_pypi=False, session=None):
+        host = 'https://test.pypi.org' if use_test_pypi else 'https://pypi.org'
+        self.simple_url = f'{host}/simple'
+        self.json_api_url = f'{host}/pypi'
+        self.session = session or requests.Session()
+
+    def get_project(self, package_name, etag=None):
+        '''Returns (status_code, project_data, etag, last_serial). project_data
+        is None for 304 (unchanged) and 404 (no such project).'''
+        headers = {'Accept': SIMPLE_JSON_CONTENT_TYPE}
+        if etag:
+            headers['If-None-Match'] = etag
+        response = self.session.get(f'{self.simple_url}/{normalize_project_name(package_name)}/', headers=headers)
+        serial = response.headers.get('X-PyPI-Last-Serial')
+        last_serial = int(serial) if serial and serial.isdigit() else None
+        if response.status_code in (304, 404):
+            return response.status_code, None, etag if response.status_code == 304 else None, last_serial
+        response.raise_for_status()
+        if 'json' in response.headers.get('Content-Type', ''):
+            data = response.json()
+        else:
+            data = parse_simple_html(response.text)
+        if 'versions' not in data:
+            ## Simple API < 1.1 has no `versions` list: derive it from the file names
+            data['versions'] = sorted({v for v in (version_from_filename(f['filename']) for f in data.get('files', [])) if v})
+        return response.status_code, data, response.headers.get('ETag'), last_serial
+
+    def project_exists(self, package_name):
+        status_code, _, _, _ = self.get_project(package_name)
+        return status_code != 404
+
+    def filename_exists(self, package_name, filename):
+        status_code, data, _, _ = self.get_project(package_name)
+        if data is None:
+            return False
+        return any(f['filename'] == filename for f in data.get('files', []))
+
+    def _stream_info(self, url, chunk_size=16 * 1024):
+        '''Reads a /pypi/ JSON document only until its `info` object is complete.'''
+        decoder = json.JSONDecoder()
+        buffer = ''
+        with self.session.get(url, stream=True) as response:
+            if response.status_code == 404:
+                return {}
+            response.raise_for_status()
+            response.encoding = response.encoding or 'utf-8'
+            for chunk in response.iter_content(chunk_size=chunk_size, decode_unicode=True):
+                buffer += chunk
+                start = buffer.find('"info"')
+                if start == -1:
+                    continue
+                start = buffer.find('{', start)
+                if start == -1:
+                    continue
+                try:
+                    info, _ = decoder.raw_decode(buffer, start)
+                    return info
+                except ValueError:
+                    continue  ## The info object isn't complete yet
+        return json.loads(buffer).get('info', {}) if buffer else {}
+
+    def get_release_info(self, package_name, version):
+        '''The `info` of a single release (author, maintainer, ...) or {} if not found.'''
+        info = self._stream_info(f'{self.json_api_url}/{package_name}/{version}/json') if version else {}
+        if not info:
+            info = self._stream_info(f'{self.json_api_url}/{package_name}/json')
+        pt(info.get('author'), info.get('author_email'), info.get('maintainer'))
+        return info
@@ -1,5 +1,10 @@
+import os, re, email.utils
 import requests
 from print_tricks import pt
+from release_index import ReleaseIndex, parse_version
+from pypi_simple_client import SimpleIndexClient
+from conflict_policies import ConflictPolicy, PromptQueue, ConflictPolicyError, SkipProject
+from metadata_extractor import extract_project_metadata
 
 class PyPIVerifier:
     def __init__(self, 
@@ -9,7 +14,11 @@ class PyPIVerifier:
             version, 
             use_test_pypi=False, 
             use_gui=False,
-            automatically_increment_version=False
+            automatically_increment_version=False,
+            cache_directory=None,
+            conflict_policy=None,
+            prompt_queue=None,
+            session=None,
             ):
         self.package_name = package_name
         self.version_number = version
@@ -17,17 +26,30 @@ class PyPIVerifier:
         self.email = email
         # pt(self.username)
         self.automatically_increment_version = automatically_increment_version
-        base_url = "https://test.pypi.org/pypi" if use_test_pypi else "https://pypi.org/pypi"
         self.use_gui = use_gui
-        self.api_url = f"{base_url}/{package_name}/json"
         self.pypi_owners = []  # New attribute to store the list of maintainers
+        self.cache_directory = os.path.join(os.path.expanduser('~'), '.cache', 'pup_py') if cache_directory is None else cache_directory
+        self.session = requests.Session() if session is None else session
+        self.client = SimpleIndexClient(use_test_pypi, self.session)
+        self.release_index = None
         
         self.pypi_version_number = None
+        self.conflict_policy = ConflictPolicy.create(conflict_policy, automatically_increment_version, rename_suffix=username)
+        self.prompt_queue = PromptQueue(interactive=True if use_gui else None) if prompt_queue is None else prompt_queue
+        self.project_key = package_name  ## Queued answers are per project (the package name may change)
+        self.rename_count = 0
 
-    def prompt_for_input(self, prompt_message, input_type='text'):
+    def get_release_index(self):
+        '''The persistent release index of the current package (the package name can change during verification).'''
+        if self.release_index is None or self.release_index.package_name != self.package_name:
+            self.release_index = ReleaseIndex(self.cache_directory, self.package_name, self.client)
+        return self.release_index
+
+    def prompt_for_input(self, prompt_message, input_type='text', default=None):
         """
         Generic method to prompt user for input. Adapts to GUI or CLI based on configuration.
         Adds a blinking cursor when waiting for input in CLI.
+        An empty answer returns `default`.
         """
         if self.use_gui:
             ## GUI placeholder
@@ -35,8 +57,8 @@ class PyPIVerifier:
             from tkinter import simpledialog
             root = tk.Tk()
             root.withdraw()  # Hide the main window
-            user_input = simpledialog.askstring("Input", prompt_message)
-            return user_input
+            user_input = simpledialog.askstring("Input", prompt_message, initialvalue=default)
+            return user_input or default
         else:
             ## CLI input with blinking cursor
             import sys
@@ -45,43 +67,66 @@ class PyPIVerifier:
             # Enable blinking cursor
             sys.stdout.write('\033[?25h')  # CSI ? 25 h - Show cursor
             sys.stdout.flush()
-            user_input = input(prompt_message)
+            if default is not None:
+                prompt_message = f'{prompt_message} [{default}] '
+            user_input = input(prompt_message) or default
             # Disable blinking cursor after input
             sys.stdout.write('\033[?25l')  # CSI ? 25 l - Hide cursor
             sys.stdout.flush()
 
             return user_input
 
+    def ask(self, key, prompt_message, input_type='text', default=None):
+        '''A prompt answered from the prompt queue when possible (see conflict_policies.py).'''
+        return self.prompt_queue.answer(self.project_key, key, prompt_message,
+            lambda question, default: self.prompt_for_input(question, input_type, default=default), default)
+
+    def resolve_conflict(self, conflict, message, latest_version=None):
+        '''Applies the non-interactive policies. Returns the policy name for 'prompt' (left to the caller).'''
+        policy = self.conflict_policy.for_conflict(conflict)
+        pt(conflict, policy)
+        if policy == 'fail':
+            raise ConflictPolicyError(message)
+        if policy == 'skip':
+            raise SkipProject(message)
+        if policy in ('bump_patch', 'bump_minor'):
+            self.version_number = self.auto_increment_version(latest_version, policy.split('_')[1])
+        elif policy == 'rename_suffix':
+            suffix = re.sub(r'[^A-Za-z0-9]+', '-', self.conflict_policy.rename_suffix or 'dev').strip('-').lower()
+            self.rename_count += 1
+            self.package_name = f'{self.project_key}-{suffix}' + (str(self.rename_count) if self.rename_count > 1 else '')
+        return policy
+
     def handle_verification(self, attempt=0):
         max_attempts = 15  # Maximum number of attempts before stopping recursion
         if attempt >= max_attempts:
             print("Maximum attempts reached. Exiting verification process.")
-            return None  # Or handle this case as needed
+            raise ConflictPolicyError(f"Could not resolve the conflicts of '{self.package_name}' in {max_attempts} attempts.")
 
         is_new_package, is_our_package, is_version_available, latest_version, message = self.check_package_status()
         print(message)
         
         if not is_our_package:
-            choice = self.prompt_for_input("Package name might be taken or username might be incorrect. Choose an option:\n1. Change package name\n2. Change username\nEnter choice (1 or 2):", input_type='choice')
+            if self.resolve_conflict('name_taken', message) != 'prompt':
+                return self.handle_verification(attempt + 1)
+            choice = self.ask('name_taken', "Package name might be taken or username might be incorrect. Choose an option:\n1. Change package name\n2. Change username\nEnter choice (1 or 2):", input_type='choice')
             if choice == '1':
-                new_package_name = self.prompt_for_input("Enter a new package name:")
+                new_package_name = self.ask('new_package_name', "Enter a new package name:")
                 if new_package_name:
                     self.package_name = new_package_name
                     return self.handle_verification(attempt + 1)
             elif choice == '2':
-                new_username = self.prompt_for_input("Enter a new username:")
+                new_username = self.ask('new_username', "Enter a new username:")
                 if new_username:
                     self.username = new_username
-                    new_email = self.prompt_for_input(f"Enter a new email (current: {self.email}):", default=self.email)
+                    new_email = self.ask('new_email', f"Enter a new email (current: {self.email}):", default=self.email)
                     if new_email:
                         self.email = new_email
                     return self.handle_verification(attempt + 1)
                 
         if not is_version_available:
-            if self.automatically_increment_version:
-                self.version_number = self.auto_increment_version(latest_version)
-            else:
-                self.version_number = self.prompt_for_input("Enter a new version number:")
+            if self.resolve_conflict('version_taken', message, latest_version) == 'prompt':
+                self.version_number = self.ask('new_version', "Enter a new version number:")
             
             return self.handle_verification(attempt + 1)
         
@@ -96,7 +141,7 @@ class PyPIVerifier:
         else:
             pt()
             is_our_package = self.verify_package_owner()
-            is_version_available, self.pypi_version_number = self.verify_version_available() if is_our_package else False
+            is_version_available, self.pypi_version_number = self.verify_version_available() if is_our_package else (False, None)
 
         if debug:
             pt(is_new_package,
@@ -122,43 +167,35 @@ class PyPIVerifier:
         return is_new_package, is_our_package, is_version_available, self.pypi_version_number, message
 
     def verify_new_package(self):
-        response = requests.get(self.api_url)
-        
-        if response.status_code == 200:
-            return False  # Package name is already taken
-        elif response.status_code == 404:
-            return True  # Package name is available
-        else:
-            response.raise_for_status()
+        ## Answered from the simple API (and cached in the release index)
+        return not self.get_release_index().sync()
 
     def verify_package_owner(self):
-        response = requests.get(self.api_url)
-        if response.status_code == 200:
-            data = response.json()
-            # pt(data)
-            # pt.ex()
-            # Safely access the 'maintainers' key using get() to avoid KeyError
-            author = data['info'].get('author', [])
-            # self.pypi_owners = [author['username'] for author in authors]
-            # pt(self.username, author, self.username in  author)
-            
-            return self.username in author
-        return False
+        release_index = self.get_release_index()
+        if not release_index.sync():
+            return False
+        ## Only the latest release's own (small) document is needed for the author
+        info = self.client.get_release_info(self.package_name, release_index.latest())
+        owners = [info.get(key) for key in ('author', 'author_email', 'maintainer', 'maintainer_email') if info.get(key)]
+        self.pypi_owners = owners
+        # pt(self.username, owners)
+        
+        names, emails = parse_owners(info)
+        if self.username and self.username.strip().casefold() in names:
+            return True
+        return bool(self.email) and self.email.strip().casefold() in emails
 
     def verify_version_available(self):
-        response = requests.get(self.api_url)
+        release_index = self.get_release_index()
         
-        if response.status_code == 200:
-            data = response.json()
-            versions = data['releases'].keys()  # Get all versions
-            pt(versions)
-            latest_version = sorted(versions, key=lambda v: tuple(map(int, v.split('.'))), reverse=True)[0]
+        if release_index.sync():
+            latest_version = release_index.latest()
             pt(latest_version)
             self.pypi_version_number = latest_version
             
             self.check_if_version_lower_than_latest(latest_version)
 
-            is_version_available = self.version_number not in versions
+            is_version_available = not release_index.contains(self.version_number)
             
             return is_version_available, self.pypi_version_number
         return False, None
@@ -167,20 +204,21 @@ class PyPIVerifier:
         if latest_version is None:
             return  # No latest version found, possibly due to an error or new package
 
-        current_version_tuple = tuple(map(int, self.version_number.split('.')))
-        latest_version_tuple = tuple(map(int, latest_version.split('.')))
+        current_version = parse_version(self.version_number)
+        if current_version is None:
+            raise ValueError(f"Version '{self.version_number}' is not a valid PEP 440 version.")
 
-        if current_version_tuple < latest_version_tuple:
-            print(f"Your version ({self.version_number}) is lower than the latest version on PyPI ({latest_version}).")
+        if current_version < parse_version(latest_version):
+            message = f"Your version ({self.version_number}) is lower than the latest version on PyPI ({latest_version})."
+            print(message)
             
-            if self.automatically_increment_version:
+            if self.resolve_conflict('version_lower', message, latest_version) != 'prompt':
                 # if pt.after(4):
                 #     pt.ex()
-                self.version_number = self.auto_increment_version(latest_version)
                 return True  # Indicate that the version was incremented
 
             else:
-                choice = self.prompt_for_input("Do you want to proceed with the lower version? Type 'yes' to proceed or enter a new version number:", input_type='text')
+                choice = self.ask('version_lower', "Do you want to proceed with the lower version? Type 'yes' to proceed or enter a new version number:", input_type='text')
                 if choice.lower() != 'yes':
                     self.version_number = choice  # Update the version number with user input
                     return True  # Indicate that the version was updated
@@ -191,17 +229,49 @@ class PyPIVerifier:
             return True  # No need for further action
 
 
-    def auto_increment_version(self, latest_version):
-        # self.verify_version_available() ## updates the self.pypi_version_number
-        ## Split the version number
-        parts = latest_version.split('.')
-        ## Convert the last part to an integer and increment it
-        parts[-1] = str(int(parts[-1]) + 1)
-        # Join the parts back into a singular version number
-        self.version_number = '.'.join(parts)
+    def auto_increment_version(self, latest_version, part='patch'):
+        ## The first version after the latest one (1.2.3 -> 1.2.4 for 'patch') that was never used on the index
+        self.version_number = self.get_release_index().next_free_version(latest_version, part)
         pt(self.version_number)
         return self.version_number
 
+def parse_owners(info):
+    '''(names, emails), casefolded, of a release's author/maintainer fields.
+    Both may hold several comma separated people, and PEP 621 metadata puts
+    "Name <email>" in author_email (leaving author empty).'''
+    names, emails = set(), set()
+    for key in ('author', 'maintainer'):
+        names.update(name.strip().casefold() for name in (info.get(key) or '').split(',') if name.strip())
+    for key in ('author_email', 'maintainer_email'):
+        for name, address in email.utils.getaddresses([info.get(key) or '']):
+            if name.strip():
+                names.add(name.strip().casefold())
+            if address.strip():
+                emails.add(address.strip().casefold())
+    return names, emails
+
+def queue_answers_up_front(project_directories, prompt_queue, conflict_policy=None, use_test_pypi=False, cache_directory=None):
+    '''Runs every project's availability checks once, asking every prompt
+    its policy needs now (in this thread), so a batch of releases can then
+    run unattended (and in parallel) with `prompt_queue`.'''
+    prompt_queue.recording = True
+    try:
+        for project_directory in project_directories:
+            metadata = extract_project_metadata(project_directory, cache_directory)
+            if not metadata['package_name'] or not metadata['version']:
+                continue
+            pt.c(f"-- Checking {metadata['package_name']} for conflicts")
+            verifier = PyPIVerifier(metadata['package_name'], metadata['author'], metadata['author_email'],
+                metadata['version'], use_test_pypi, cache_directory=cache_directory,
+                conflict_policy=conflict_policy, prompt_queue=prompt_queue)
+            try:
+                verifier.handle_verification()
+            except SkipProject:
+                pass
+    finally:
+        prompt_queue.recording = False
+    return prompt_queue
+
 if __name__ == "__main__":
     verifier = PyPIVerifier(
         package_name="A_with_nothing", 
@@ -0,0 +1,149 @@
+'''Persistent, PEP 440-aware index of a package's releases on (Test) PyPI.
+
+    - Stored in SQLite (one database per index host, shared by all packages)
+    - Loaded once into a sorted list of parsed versions, so "latest",
+      "contains" and "next free version" are bisect lookups
+    - Synced incrementally from the PEP 691 simple API: conditional requests
+      (ETag) mean an unchanged package costs a 304 and no body, and only new
+      versions are inserted.
+      Versions are never removed: PyPI never allows a deleted version's
+      filenames to be reused, so they must stay "taken".
+'''
+
+import os, time, sqlite3, bisect, threading
+from urllib.parse import urlparse
+from packaging.version import Version, InvalidVersion
+from print_tricks import pt
+
+from pypi_simple_client import SimpleIndexClient
+
+
+def parse_version(version):
+    try:
+        return Version(str(version))
+    except InvalidVersion:
+        return None
+
+def bump_version(version, part='patch'):
+    '''1.2.3 -> 1.2.4 (patch), 1.3.0 (minor), 2.0.0 (major). Pre/dev releases
+    are bumped to their final release (1.0rc1 -> 1.0.0), post releases are
+    bumped like their release (1.0.post1 -> 1.0.1).'''
+    parsed = Version(str(version))
+    major, minor, patch = (list(parsed.release) + [0, 0])[:3]
+    if parsed.is_prerelease and part == 'patch':
+        return f'{major}.{minor}.{patch}'
+    if part == 'major':
+        return f'{major + 1}.0.0'
+    if part == 'minor':
+        return f'{major}.{minor + 1}.0'
+    if part == 'patch':
+        return f'{major}.{minor}.{patch + 1}'
+    raise ValueError(f'Unknown version part {part!r} (expected major, minor or patch)')
+
+
+class ReleaseIndex:
+    def __init__(self, cache_directory, package_name, client=None, max_age=0):
+        self.package_name = package_name
+        self.client = client or SimpleIndexClient()
+        self.max_age = max_age  ## Seconds during which we don't even ask the index again
+        self.lock = threading.Lock()
+
+        index_directory = os.path.join(cache_directory, 'release_index')
+        os.makedirs(index_directory, exist_ok=True)
+        host = urlparse(self.client.simple_url).netloc or 'local'
+        self.database_path = os.path.join(index_directory, f'{host}.sqlite')
+        self.connection = sqlite3.connect(self.database_path, check_same_thread=False)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS releases (
+                package TEXT NOT NULL,
+                version TEXT NOT NULL,
+                PRIMARY KEY (package, version)
+            );
+            CREATE TABLE IF NOT EXISTS sync_state (
+                package TEXT PRIMARY KEY,
+                exists_on_index INTEGER NOT NULL,
+                etag TEXT,
+                last_serial INTEGER,
+                synced_at REAL NOT NULL
+            );
+        ''')
+        self.connection.commit()
+        self._load()
+
+    def _load(self):
+        rows = self.connection.execute('SELECT version FROM releases WHERE package = ?', (self.package_name,)).fetchall()
+        self.raw_versions = {row[0] for row in rows}
+        self.versions = sorted(v for v in map(parse_version, self.raw_versions) if v is not None)
+        state = self.connection.execute(
+            'SELECT exists_on_index, etag, last_serial, synced_at FROM sync_state WHERE package = ?',
+            (self.package_name,)).fetchone()
+        self.exists_on_index, self.etag, self.last_serial, self.synced_at = state if state else (None, None, None, 0.0)
+
+    def _save_state(self):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO sync_state (package, exists_on_index, etag, last_serial, synced_at) VALUES (?, ?, ?, ?, ?)',
+            (self.package_name, int(bool(self.exists_on_index)), self.etag, self.last_serial, self.synced_at))
+        self.connection.commit()
+
+    def add_versions(self, versions):
+        '''Inserts only the versions we don't know yet. Returns how many were new.'''
+        new_versions = [str(v) for v in versions if str(v) not in self.raw_versions]
+        if not new_versions:
+            return 0
+        self.connection.executemany('INSERT OR IGNORE INTO releases (package, version) VALUES (?, ?)',
+            [(self.package_name, v) for v in new_versions])
+        self.connection.commit()
+        for version in new_versions:
+            self.raw_versions.add(version)
+            parsed = parse_version(version)
+            if parsed is not None:
+                bisect.insort(self.versions, parsed)
+        return len(new_versions)
+
+    def sync(self, force=False):
+        '''Brings the index up to date. Returns whether the package exists on the index.'''
+        with self.lock:
+            if not force and self.exists_on_index is not None and time.time() - self.synced_at < self.max_age:
+                return bool(self.exists_on_index)
+
+            status_code, project_data, etag, last_serial = self.client.get_project(
+                self.package_name, etag=None if force else self.etag)
+            if status_code == 304:
+                pt.c(f'-- Release index for {self.package_name} is up to date')
+            elif status_code == 404:
+                self.exists_on_index = False
+                self.etag = None
+            else:
+                self.exists_on_index = True
+                self.etag = etag
+                self.last_serial = last_serial or self.last_serial
+                new_count = self.add_versions(project_data['versions'])
+                pt.c(f'-- Release index for {self.package_name}: {new_count} new release(s), {len(self.raw_versions)} total')
+            self.synced_at = time.time()
+            self._save_state()
+            return bool(self.exists_on_index)
+
+    def contains(self, version):
+        parsed = parse_version(version)
+        if parsed is None:
+            return str(version) in self.raw_versions
+        i = bisect.bisect_left(self.versions, parsed)
+        return i < len(self.versions) and self.versions[i] == parsed
+
+    def latest(self, include_prereleases=True):
+        if include_prereleases:
+            return str(self.versions[-1]) if self.versions else None
+        for version in reversed(self.versions):
+            if not (version.is_prerelease or version.is_devrelease):
+                return str(version)
+        return None
+
+    def next_free_version(self, version=None, part='patch'):
+        '''The first bump of max(version, latest) that isn't taken on the index.'''
+        candidates = [v for v in (parse_version(version), parse_version(self.latest())) if v is not None]
+        if not candidates:
+            return '0.1.0'
+        candidate = bump_version(max(candidates), part)
+        while self.contains(candidate):
+            candidate = bump_version(candidate, part)
+        return candidate
@@ -0,0 +1,197 @@
+'''Remote tier of the build cache: a simple HTTP key-value protocol.
+
+    Keys are <backend>/<interpreter tag>/<source fingerprint>, and each key
+    holds the artifacts of one build:
+        GET/HEAD/PUT  /v1/<backend>/<tag>/<fingerprint>/<filename>
+        GET/HEAD/PUT  /v1/<backend>/<tag>/<fingerprint>/manifest.json
+    The manifest ({filename: {sha256, size}}) is uploaded last, so a key
+    without a manifest is an incomplete upload and is ignored.
+
+    - Read-through: on a local miss, the artifacts are downloaded (and
+      checked against the manifest) into the local artifact store
+    - Write-back: freshly built artifacts are uploaded after the build
+    - The remote cache is best effort: any error only means a rebuild
+
+    Reference server (files on disk, optional bearer token):
+        python remote_build_cache.py serve --port 8766 --directory /srv/pup_py_cache --token-env-var PUP_PY_REMOTE_CACHE_TOKEN
+'''
+
+import os, re, json, shutil, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from print_tricks import pt
+
+from artifact_store import file_digest
+
+
+DEFAULT_PORT = 8766
+MANIFEST_NAME = 'manifest.json'
+_KEY_PART = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._+-]*$')
+
+
+def _validate_parts(parts):
+    if not all(_KEY_PART.match(part) for part in parts):
+        raise ValueError(f'Invalid remote cache key part in {parts}')
+    return parts
+
+
+class RemoteBuildCache:
+    def __init__(self, url, token=None, timeout=30, session=None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def _url(self, backend, tag, fingerprint, filename):
+        return '/'.join([self.url, 'v1', *_validate_parts([backend, tag, fingerprint, filename])])
+
+    def contains(self, backend, tag, fingerprint):
+        try:
+            response = self.session.head(self._url(backend, tag, fingerprint, MANIFEST_NAME), timeout=self.timeout)
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def fetch(self, backend, tag, fingerprint, destination_directory):
+        '''Downloads the artifacts of a key. Returns their paths ([] on a miss or any error).'''
+        try:
+            response = self.session.get(self._url(backend, tag, fingerprint, MANIFEST_NAME), timeout=self.timeout)
+            if response.status_code == 404:
+                return []
+            response.raise_for_status()
+            manifest = response.json()
+
+            os.makedirs(destination_directory, exist_ok=True)
+            paths = []
+            for filename, entry in manifest.items():
+                path = os.path.join(destination_directory, os.path.basename(filename))
+                with self.session.get(self._url(backend, tag, fingerprint, filename), stream=True, timeout=self.timeout) as file_response:
+                    file_response.raise_for_status()
+                    with open(path, 'wb') as file:
+                        for chunk in file_response.iter_content(chunk_size=1024 * 1024):
+                            file.write(chunk)
+                if file_digest(path) != entry['sha256']:
+                    raise ValueError(f'Checksum mismatch for {filename}')
+                paths.append(path)
+            pt.c(f'-- Remote build cache: downloaded {len(paths)} artifact(s) for {fingerprint[:12]}')
+            return paths
+        except (requests.RequestException, ValueError, KeyError, OSError) as e:
+            pt.c(f'-- Remote build cache: fetch failed ({e}), building locally')
+            return []
+
+    def publish(self, backend, tag, fingerprint, paths):
+        '''Uploads the artifacts of a key, manifest last. Returns whether it succeeded.'''
+        try:
+            manifest = {}
+            for path in paths:
+                filename = os.path.basename(path)
+                with open(path, 'rb') as file:
+                    response = self.session.put(self._url(backend, tag, fingerprint, filename), data=file, timeout=self.timeout)
+                response.raise_for_status()
+                manifest[filename] = {'sha256': file_digest(path), 'size': os.path.getsize(path)}
+            response = self.session.put(self._url(backend, tag, fingerprint, MANIFEST_NAME),
+                data=json.dumps(manifest).encode('utf-8'), headers={'Content-Type': 'application/json'}, timeout=self.timeout)
+            response.raise_for_status()
+            pt.c(f'-- Remote build cache: uploaded {len(paths)} artifact(s) for {fingerprint[:12]}')
+            return True
+        except (requests.RequestException, ValueError, OSError) as e:
+            pt.c(f'-- Remote build cache: upload failed ({e})')
+            return False
+
+
+class _CacheRequestHandler(BaseHTTPRequestHandler):
+    ## server.cache_directory and server.token are set by create_server()
+    def _path(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if len(parts) != 5 or parts[0] != 'v1':
+            raise ValueError(self.path)
+        return os.path.join(self.server.cache_directory, *_validate_parts(parts[1:]))
+
+    def _authorized(self):
+        if self.server.token and self.headers.get('Authorization') != f'Bearer {self.server.token}':
+            self.send_error(401)
+            return False
+        return True
+
+    def _resolve(self):
+        if not self._authorized():
+            return None
+        try:
+            return self._path()
+        except ValueError:
+            self.send_error(400)
+            return None
+
+    def do_HEAD(self, send_body=False):
+        path = self._resolve()
+        if path is None:
+            return
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.send_header('Content-Type', 'application/json' if path.endswith('.json') else 'application/octet-stream')
+        self.end_headers()
+        if send_body:
+            with open(path, 'rb') as file:
+                shutil.copyfileobj(file, self.wfile, 1024 * 1024)
+
+    def do_GET(self):
+        self.do_HEAD(send_body=True)
+
+    def do_PUT(self):
+        path = self._resolve()
+        if path is None:
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as file:
+            remaining = length
+            while remaining:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                file.write(chunk)
+                remaining -= len(chunk)
+        if remaining:
+            os.remove(temp_path)
+            self.send_error(400, 'Incomplete body')
+            return
+        os.replace(temp_path, path)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pt.c(f'-- Remote build cache server: {self.address_string()} {format % args}')
+
+
+def create_server(cache_directory, host='127.0.0.1', port=DEFAULT_PORT, token=None):
+    '''The reference server (port 0 picks a free port: see server.server_address).'''
+    os.makedirs(cache_directory, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), _CacheRequestHandler)
+    server.cache_directory = cache_directory
+    server.token = token
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='pup_py remote build cache')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help='Run the reference HTTP cache server')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument('--directory', default=os.path.join(os.path.expanduser('~'), '.cache', 'pup_py', 'remote_build_cache'))
+    serve_parser.add_argument('--token-env-var', default=None, help='Environment variable holding the bearer token clients must send')
+    args = parser.parse_args()
+
+    token = os.getenv(args.token_env_var) if args.token_env_var else None
+    server = create_server(args.directory, args.host, args.port, token)
+    pt.c(f'-- Remote build cache serving {args.directory} on http://{args.host}:{server.server_address[1]}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 from print_tricks import pt
 import os, re, shutil, glob
-import toml
+
+from metadata_extractor import extract_metadata, extract_project_metadata
+from decorators import StepFailure
 
 class SetupFileManager:
     def __init__(self, 
@@ -11,6 +13,7 @@ class SetupFileManager:
             author='developer-1v',
             author_email='developer-1v@gmail.com',
             packages='["."]',
+            cache_directory=None,
         ):
         self.project_directory = project_directory
         self.distribution_directory = distribution_directory
@@ -20,6 +23,7 @@ class SetupFileManager:
         self.author = author
         self.author_email = author_email
         self.packages = packages
+        self.cache_directory = cache_directory
         pt(self.project_directory, self.distribution_directory, self.package_name, self.distribution_folder_name, self.version, self.author, self.author_email, self.packages)
         # pt.ex()
         
@@ -28,6 +32,7 @@ class SetupFileManager:
         paths = {
             'pyproject.toml': [os.path.join(self.project_directory, '**', 'pyproject.toml'), os.path.join(self.distribution_directory, '**', 'pyproject.toml')],
             'setup.py': [os.path.join(self.project_directory, '**', 'setup.py'), os.path.join(self.distribution_directory, '**', 'setup.py')],
+            'setup.cfg': [os.path.join(self.project_directory, '**', 'setup.cfg'), os.path.join(self.distribution_directory, '**', 'setup.cfg')],
             'main.py': [os.path.join(self.project_directory, '**', 'main.py')]
         }
         
@@ -43,13 +48,16 @@ class SetupFileManager:
                         if file_type == 'pyproject.toml':
                             pt(path)
                             data = self.parse_pyproject_file(path)
-                        elif file_type == 'setup.py':
+                        elif file_type in ('setup.py', 'setup.cfg'):
                             data = self.parse_setup_file(path)
                         elif file_type == 'main.py':
-                            data = self.parse_main_file(path)
-                            self.create_pyproject_from_template(data)
-                        print(f"{file_type} found and parsed in {'project directory' if 'project_directory' in path else 'build distribution directory'}.")
-                        pt.ex()
+                            ## The header comments fill the template (the pyproject is created from it)
+                            main_data = self.parse_main_file(path)
+                            self.package_name = main_data['package_name'] or self.package_name
+                            self.version = main_data['version'] or self.version
+                            data = self.create_pyproject_from_template()
+                        in_distribution_directory = os.path.abspath(path).startswith(os.path.abspath(self.distribution_directory) + os.sep)
+                        print(f"{file_type} found and parsed in {'build distribution directory' if in_distribution_directory else 'project directory'}.")
                         return data
                     
         # If no relevant files are found, create a new pyproject.toml from a template without specific data
@@ -102,14 +110,12 @@ class SetupFileManager:
                                 package_dirs.extend(found_dirs)
                                 print(f"Package directories found matching {search_path}: {found_dirs}")
                             else:
-                                print(f"No package directories matching {search_path}. Stopping build process.")
-                                exit(1)
+                                raise StepFailure(f"No package directories matching {search_path}. Stopping build process.")
                                 
                     # Check each found directory
                     for package_dir in package_dirs:
                         if not os.path.exists(package_dir):
-                            print(f"No package directory found at {package_dir}. Stopping build process.")
-                            exit(1)
+                            raise StepFailure(f"No package directory found at {package_dir}. Stopping build process.")
 
     def _check_for_valid_setup_data(self, common_data):
         pt(common_data['packages_line'], common_data['packages'])
@@ -126,61 +132,18 @@ class SetupFileManager:
 
     def parse_pyproject_file(self, file_path):
         try:
-            with open(file_path, 'r') as file:
-                lines = file.readlines()
-
-            pyproject_data = toml.loads(''.join(lines))
-
-            # Common data extraction
-            common_data = {}
-            # Check for tool configurations
-            if 'tool' in pyproject_data:
-                ## TODO: Untested
-                if 'poetry' in pyproject_data['tool']:
-                    tool_data = pyproject_data['tool']['poetry']
-                ## TODO: Untested
-                elif 'hatch' in pyproject_data['tool']:
-                    tool_data = pyproject_data['tool']['hatch']
-                elif 'setuptools' in pyproject_data['tool']:
-                    tool_data = pyproject_data['project']
-                else:
-                    tool_data = {}
-            # Check for project configuration if no specific tool configuration is found
-            if not tool_data and 'project' in pyproject_data:
-                tool_data = pyproject_data['project']
-            elif not tool_data:
+            ## With the setup.cfg / setup.py next to it (e.g. a pyproject holding only [build-system])
+            metadata = extract_project_metadata(os.path.dirname(file_path), self.cache_directory)
+            if metadata['source'] is None:
                 raise ValueError("The pyproject.toml file does not contain a recognized configuration section for Python packaging.")
 
-
-            # Extract common fields
-            common_data['package_name'] = tool_data.get('name')
-            common_data['version'] = tool_data.get('version')
-            common_data['description'] = tool_data.get('description', '')
-            common_data['dependencies'] = tool_data.get('dependencies', {})
-            common_data['dev_dependencies'] = tool_data.get('dev-dependencies', {}) if 'dev-dependencies' in tool_data else tool_data.get('setup_requires', [])
-            common_data['packages'] = tool_data.get('packages', [])
-
-            # Extract the entire line containing 'packages' from the file
-            packages_line = next((line.strip() for line in lines if 'packages' in line), None)
-            common_data['packages_line'] = toml.loads(packages_line)
-        
-            
+            common_data = {key: metadata[key] for key in (
+                'package_name', 'version', 'description', 'dependencies', 'dev_dependencies', 'author', 'author_email')}
+            common_data['packages'] = metadata['packages'] or []
+            ## The setuptools/poetry packages configuration, as its own table
+            common_data['packages_line'] = {'packages': metadata['packages']} if metadata['packages'] is not None else None
             common_data['pyproject_file_path'] = file_path
 
-            # Extract authors to get author and author_email
-            authors = tool_data.get('authors', [])
-            if authors:
-                common_data['author'] = None
-                common_data['author_email'] = None
-                for author in authors:
-                    if 'name' in author:
-                        common_data['author'] = author['name']
-                    if 'email' in author:
-                        common_data['author_email'] = author['email']
-            else:
-                common_data['author'] = None
-                common_data['author_email'] = None
-
             self._check_for_valid_setup_data(common_data)
             
             return common_data
@@ -190,26 +153,18 @@ class SetupFileManager:
             raise
 
     def parse_setup_file(self, file_path):
-        
-        with open(file_path, 'r') as file:
-            content = file.read()
-        
-        # Adjusting the regular expressions to handle optional spaces around equals signs
-        package_name = self.extract_value(content, r'name\s*=\s*')
-        version = self.extract_value(content, r'version\s*=\s*')
-        author = self.extract_value(content, r'authors\s*=\s*\[\s*\{.*?name\s*:\s*"')
-        # author_email = self.extract_value(content, r'authors\s*=\s*\[\s*\{.*?author_email\s*:\s*"')
-        author_email = self.extract_value(content, r'authors\s*=\s*\[\s*\{[^}]*?author_email\s*:\s*"([^"]+)"')
-        packages = self.extract_value(content, r'packages\s*=\s*\[')
-
-        if package_name == '' or version == '':
-            return {'package_name': None, 'version': None}
+        ## setup.py and setup.cfg together (setup.cfg wins), statically evaluated: setup.py is never executed
+        metadata = extract_project_metadata(os.path.dirname(file_path), self.cache_directory)
+        if metadata['unresolved']:
+            print(f"Could not statically resolve {', '.join(metadata['unresolved'])} in {os.path.dirname(file_path)}")
+        if not metadata['package_name'] or not metadata['version']:
+            raise StepFailure(f"Could not statically resolve the package name and version of {os.path.dirname(file_path)}")
         return {
-            'package_name': package_name, 
-            'version': version,
-            'author': author,
-            'author_email': author_email,
-            'packages': packages,
+            'package_name': metadata['package_name'], 
+            'version': metadata['version'],
+            'author': metadata['author'],
+            'author_email': metadata['author_email'],
+            'packages': metadata['packages'],
             'pyproject_file_path': self.new_toml_path
         }
 
@@ -224,26 +179,17 @@ class SetupFileManager:
         dict: A dictionary containing extracted metadata such as package name and version.
         """
         try:
-            with open(file_path, 'r') as file:
-                content = file.read()
-                
-            # Extract package name and version from conventional comments or docstrings
-            package_name = self.extract_value(content, r'#\s*Package Name:\s*')
-            version = self.extract_value(content, r'#\s*Version:\s*')
-            description = self.extract_value(content, r'#\s*Description:\s*')
-            authors = self.extract_value(content, r'#\s*Authors:\s*')
-            dependencies = self.extract_value(content, r'#\s*Dependencies:\s*')
-
-            # Convert extracted authors from string to list
-            authors_list = [author.strip() for author in authors.split(',')] if authors else []
-
-            # Convert extracted dependencies from string to dictionary
-            dependencies_dict = {dep.split('==')[0].strip(): dep.split('==')[1].strip() for dep in dependencies.split(',')} if dependencies else {}
+            metadata = extract_metadata(file_path, self.cache_directory)
+
+            authors_list = [name or email for name, email in metadata['authors']]
+
+            # Convert extracted dependencies to a dictionary of pinned versions
+            dependencies_dict = {dep.split('==')[0].strip(): dep.split('==')[1].strip() if '==' in dep else '' for dep in metadata['dependencies']}
 
             return {
-                'package_name': package_name,
-                'version': version,
-                'description': description,
+                'package_name': metadata['package_name'],
+                'version': metadata['version'],
+                'description': metadata['description'],
                 'authors': authors_list,
                 'dependencies': dependencies_dict,
                 'dev_dependencies': {}
@@ -253,16 +199,6 @@ class SetupFileManager:
             print(f"Failed to parse main.py: {e}")
             raise
 
-    def extract_value(self, content, key):
-        start = content.find(key) + len(key)
-        if start != -1:
-            end = content.find('}', start)
-            if end == -1:
-                end = len(content)
-            value = content[start:end].strip().strip("'\"").strip()
-            return value
-        return None
-
     def update_toml_file_with_all_modifications(self):
         self.modify_package_name(self.package_name)
         self.modify_version(self.version)
@@ -0,0 +1,168 @@
+'''Staging of the project's sources into the build tree.
+
+    The build backends run in pypi_build_directory/stage/<name> instead of
+    the project directory: setuptools' build/ and .egg-info droppings land
+    there, and the sources stay clean. Every concurrent build (wheel, sdist,
+    one per ABI) gets its own stage, as setuptools writes the same build/ and
+    .egg-info/ paths in whatever tree it runs in.
+
+    - Only the project's files are staged: the git index (tracked files, plus
+      untracked ones that aren't ignored) when the project is a git work tree,
+      else every file outside the excluded folders
+    - Files are never physically copied when they don't have to be: a reflink
+      (copy-on-write clone, btrfs/XFS) if the filesystem supports it, else a
+      hardlink, else copy_file_range (in kernel copy), else a plain copy
+    - Hardlinked files are shared with the sources: the backends only write
+      new files, which is why this is safe, but nothing may edit the stage in
+      place
+    - Backends that derive the version or the file list from the VCS
+      (setuptools-scm, hatch-vcs, ...) need the .git directory, so those
+      projects keep building in the project directory (see needs_vcs)
+'''
+
+import os, sys, shutil, subprocess
+from print_tricks import pt
+
+from fix_and_optimize import DEFAULT_EXCLUDED_FOLDERS
+from watch_mode import METADATA_FILES
+
+
+FICLONE = 0x40049409  ## linux/fs.h: _IOW(0x94, 9, int)
+
+VCS_VERSION_PLUGINS = ('setuptools_scm', 'setuptools-scm', 'hatch-vcs', 'hatch_vcs', 'versioningit', 'dunamai', 'pbr')
+
+
+def needs_vcs(project_directory, pyproject_path=None):
+    '''True if the build reads the VCS metadata (version/file list plugins).'''
+    paths = [os.path.join(project_directory, name) for name in METADATA_FILES]
+    if pyproject_path:
+        paths.append(pyproject_path)
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as file:
+                text = file.read()
+        except OSError:
+            continue
+        if any(plugin in text for plugin in VCS_VERSION_PLUGINS):
+            return True
+    return False
+
+
+def _reflink(source, destination):
+    import fcntl
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+        fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+
+def _copy_file_range(source, destination):
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+        remaining = os.fstat(source_file.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(source_file.fileno(), destination_file.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+class SourceStager:
+    def __init__(self, project_directory, stages_directory, excluded_folders=None, excluded_directories=None):
+        self.project_directory = os.path.abspath(project_directory)
+        self.stages_directory = os.path.abspath(stages_directory)
+        self.excluded_folders = set(DEFAULT_EXCLUDED_FOLDERS) | set(f for f in (excluded_folders or []) if f)
+        ## An excluded directory holding the whole project (standard build directories: the distribution directory) excludes nothing
+        self.excluded_directories = {os.path.abspath(d) for d in (excluded_directories or []) if d
+            and not (self.project_directory + os.sep).startswith(os.path.abspath(d) + os.sep)} | {self.stages_directory}
+        self.files = None                   ## Listed once, by the first stage()
+        ## Methods that failed once (other filesystem, unsupported) aren't tried again
+        self.methods = [method for method, supported in (
+            ('reflink', sys.platform.startswith('linux')),
+            ('hardlink', True),
+            ('copy_file_range', hasattr(os, 'copy_file_range')),
+            ) if supported]
+        self.counts = {}
+
+    def _is_excluded(self, relative_path):
+        parts = relative_path.split('/')
+        if any(part == '__pycache__' or part.endswith('.egg-info') for part in parts[:-1]):
+            return True
+        if parts[-1].endswith(('.pyc', '.pyo')):
+            return True
+        path = os.path.join(self.project_directory, *parts)
+        return any(path == d or path.startswith(d + os.sep) for d in self.excluded_directories)
+
+    def _git_files(self):
+        '''The files of the git index (+ untracked, not ignored), or None if not a git work tree.'''
+        if not os.path.exists(os.path.join(self.project_directory, '.git')):
+            return None
+        try:
+            result = subprocess.run(['git', 'ls-files', '-z', '--cached', '--others', '--exclude-standard'],
+                cwd=self.project_directory, capture_output=True, check=True)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        files = [name for name in result.stdout.decode('utf-8', errors='surrogateescape').split('\0') if name]
+        ## Deleted but still tracked
+        return [name for name in files if os.path.isfile(os.path.join(self.project_directory, name))]
+
+    def _walked_files(self):
+        files = []
+        for root, dirs, names in os.walk(self.project_directory):
+            dirs[:] = sorted(d for d in dirs if d not in self.excluded_folders and not d.endswith('.egg-info'))
+            for name in sorted(names):
+                files.append(os.path.relpath(os.path.join(root, name), self.project_directory).replace(os.sep, '/'))
+        return files
+
+    def project_files(self):
+        '''Relative ("/" separated) paths of the files to stage.'''
+        files = self._git_files()
+        if files is None:
+            files = self._walked_files()
+        return [name for name in files if not self._is_excluded(name)]
+
+    def _materialize(self, source, destination):
+        for method in list(self.methods):
+            try:
+                if method == 'reflink':
+                    _reflink(source, destination)
+                elif method == 'hardlink':
+                    os.link(source, destination)
+                    return method
+                else:
+                    _copy_file_range(source, destination)
+                shutil.copystat(source, destination)  ## The sdist keeps the mtimes
+                return method
+            except OSError:
+                if os.path.lexists(destination):
+                    os.remove(destination)
+                self.methods.remove(method)
+        shutil.copy2(source, destination)
+        return 'copy'
+
+    def stage(self, name, pyproject_path=None):
+        '''Recreates the stage `name` from the project's files and returns its directory.
+
+        A `pyproject_path` outside the project (generated into the
+        distribution directory) is staged at its root.'''
+        stage_directory = os.path.join(self.stages_directory, name)
+        if os.path.exists(stage_directory):
+            shutil.rmtree(stage_directory)
+        os.makedirs(stage_directory)
+        self.counts = {}
+        if self.files is None:
+            self.files = self.project_files()
+        files = self.files
+        created_directories = {stage_directory}
+        for relative_path in files:
+            destination = os.path.join(stage_directory, *relative_path.split('/'))
+            directory = os.path.dirname(destination)
+            if directory not in created_directories:
+                os.makedirs(directory, exist_ok=True)
+                created_directories.add(directory)
+            method = self._materialize(os.path.join(self.project_directory, *relative_path.split('/')), destination)
+            self.counts[method] = self.counts.get(method, 0) + 1
+
+        stage_pyproject = os.path.join(stage_directory, 'pyproject.toml')
+        if pyproject_path and os.path.isfile(pyproject_path) and not os.path.exists(stage_pyproject):
+            shutil.copy2(pyproject_path, stage_pyproject)
+
+        summary = ', '.join(f'{count} {method}' for method, count in sorted(self.counts.items()))
+        pt.c(f'-- Staged {len(files)} files into {stage_directory} ({summary or "empty"})')
+        return stage_directory
@@ -0,0 +1,332 @@
+'''Bulk setup.py / setup.cfg -> PEP 621 pyproject.toml transitioner.
+
+    Converts every legacy project found under a root directory, in parallel
+    (one process per project), using the static metadata extractor: setup.py
+    is never executed. Anything that can't be expressed declaratively (or
+    can't be evaluated statically) is listed per project in a JSON report,
+    and such projects are left untouched (the proposed pyproject is in the
+    report).
+
+    - An existing pyproject.toml with a [project] (or poetry) table is never
+      overwritten. One holding only e.g. [build-system] is completed.
+    - Versions read from a module attribute (`pkg.__version__`, `attr:`)
+      or a file stay dynamic ([tool.setuptools.dynamic]), so bumping them
+      keeps bumping the package version
+    - setup.cfg keys are translated like the setup() arguments they set: a
+      key that has no declarative equivalent is a problem too, and nothing
+      is retired while a project has any
+    - Converted projects get their setup.py renamed to *.retired (and
+      setup.cfg's metadata/options sections moved out), so builds take the
+      declarative path instead of still running setup.py. `--keep-setup-py`
+      leaves them in place (reported as a problem).
+'''
+
+import os, sys, json, shutil, argparse, configparser
+from concurrent.futures import ProcessPoolExecutor
+
+## The transitioner is run from its own directory, so make pup_py's modules importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import toml
+from print_tricks import pt
+
+from metadata_extractor import extract_metadata, extract_project_metadata
+from fix_and_optimize import DEFAULT_EXCLUDED_FOLDERS
+
+
+BUILD_SYSTEM = {'requires': ['setuptools>=61.0'], 'build-backend': 'setuptools.build_meta'}
+
+## setup() arguments that have a declarative equivalent (handled below)
+DECLARATIVE_ARGUMENTS = {
+    'name', 'version', 'description', 'long_description', 'long_description_content_type',
+    'author', 'author_email', 'maintainer', 'maintainer_email', 'url', 'project_urls',
+    'license', 'keywords', 'classifiers', 'python_requires', 'install_requires',
+    'extras_require', 'entry_points', 'packages', 'package_dir', 'py_modules',
+    'package_data', 'include_package_data', 'zip_safe', 'setup_requires', 'platforms',
+    'download_url', 'license_files', 'exclude_package_data',
+}
+
+README_NAMES = ('README.md', 'README.rst', 'README.txt', 'README')
+
+
+def find_legacy_projects(root_directory, excluded_folders=None):
+    '''Directories holding a setup.py or setup.cfg (nested projects inside one aren't searched).'''
+    excludes = set(DEFAULT_EXCLUDED_FOLDERS) | set(f for f in (excluded_folders or []) if f)
+    projects = []
+    for root, dirs, files in os.walk(root_directory):
+        dirs[:] = sorted(d for d in dirs if d not in excludes and not d.endswith('.egg-info'))
+        if 'setup.py' in files or 'setup.cfg' in files:
+            projects.append(root)
+            dirs[:] = []
+    return projects
+
+def _find_readme(project_directory):
+    for name in README_NAMES:
+        if os.path.exists(os.path.join(project_directory, name)):
+            return name
+    return None
+
+def _people(names, emails):
+    names = [n.strip() for n in (names or '').split(',') if n.strip()]
+    emails = [e.strip() for e in (emails or '').split(',') if e.strip()]
+    people = []
+    for i in range(max(len(names), len(emails))):
+        person = {}
+        if i < len(names):
+            person['name'] = names[i]
+        if i < len(emails):
+            person['email'] = emails[i]
+        people.append(person)
+    return people
+
+def _describe(argument, origins):
+    if origins.get(argument) == 'setup.cfg':
+        return f'setup.cfg key {argument!r}'
+    return f'setup() argument {argument!r}'
+
+def build_pyproject(project_directory, metadata, setup_arguments, origins=None):
+    '''(pyproject dict, list of problems) for a project's statically extracted metadata.
+
+    `setup_arguments` are the setup() arguments of setup.py and setup.cfg,
+    `origins` tells which file each came from (for the problems).'''
+    origins = origins or {}
+    problems = []
+    project = {'name': metadata['package_name']}
+    dynamic = []
+
+    version_source = metadata.get('version_source')
+    if metadata['version'] and version_source:
+        ## Still read from where it lives (not frozen into the pyproject)
+        dynamic.append('version')
+    elif metadata['version']:
+        project['version'] = str(metadata['version'])
+    else:
+        dynamic.append('version')
+        problems.append('version could not be resolved statically')
+    if metadata['description']:
+        project['description'] = metadata['description']
+
+    long_description = setup_arguments.get('long_description')
+    readme = _find_readme(project_directory)
+    if isinstance(long_description, dict):
+        ## setup.cfg's `long_description = file: ...`
+        if len(long_description['file']) == 1:
+            project['readme'] = long_description['file'][0]
+        else:
+            problems.append(f"{_describe('long_description', origins)} concatenates several files, the readme is a single one")
+    elif readme:
+        project['readme'] = readme
+    elif isinstance(long_description, str):
+        project['readme'] = {'text': setup_arguments['long_description'],
+            'content-type': setup_arguments.get('long_description_content_type', 'text/plain')}
+
+    if metadata['python_requires']:
+        project['requires-python'] = metadata['python_requires']
+    if setup_arguments.get('license'):
+        project['license'] = {'text': setup_arguments['license']}
+    authors = _people(metadata['author'], metadata['author_email'])
+    if authors:
+        project['authors'] = authors
+    maintainers = _people(setup_arguments.get('maintainer'), setup_arguments.get('maintainer_email'))
+    if maintainers:
+        project['maintainers'] = maintainers
+    keywords = setup_arguments.get('keywords')
+    if keywords:
+        project['keywords'] = keywords.replace(',', ' ').split() if isinstance(keywords, str) else list(keywords)
+    if setup_arguments.get('classifiers'):
+        project['classifiers'] = list(setup_arguments['classifiers'])
+    if metadata['dependencies']:
+        project['dependencies'] = list(metadata['dependencies'])
+    if metadata['optional_dependencies']:
+        project['optional-dependencies'] = {extra: list(requirements if not isinstance(requirements, str) else [requirements])
+            for extra, requirements in metadata['optional_dependencies'].items()}
+
+    urls = dict(setup_arguments.get('project_urls') or {})
+    if setup_arguments.get('url'):
+        urls.setdefault('Homepage', setup_arguments['url'])
+    if setup_arguments.get('download_url'):
+        urls.setdefault('Download', setup_arguments['download_url'])
+    if urls:
+        project['urls'] = urls
+
+    entry_points = dict(metadata['entry_points'])
+    if 'console_scripts' in entry_points:
+        project['scripts'] = entry_points.pop('console_scripts')
+    if 'gui_scripts' in entry_points:
+        project['gui-scripts'] = entry_points.pop('gui_scripts')
+    if entry_points:
+        project['entry-points'] = entry_points
+    if dynamic:
+        project['dynamic'] = dynamic
+
+    setuptools = {}
+    packages = metadata['packages']
+    if isinstance(packages, dict) and 'find' in packages:
+        find = {k: v for k, v in packages['find'].items() if k in ('where', 'include', 'exclude', 'namespaces')}
+        if isinstance(find.get('where'), str):
+            find['where'] = [find['where']]
+        ## find_packages() / `find:` don't look for namespace packages, [tool.setuptools.packages.find] does by default
+        find.setdefault('namespaces', False)
+        setuptools['packages'] = {'find': find}
+    elif packages:
+        setuptools['packages'] = list(packages)
+    if setup_arguments.get('package_dir'):
+        setuptools['package-dir'] = setup_arguments['package_dir']
+    if setup_arguments.get('py_modules'):
+        setuptools['py-modules'] = list(setup_arguments['py_modules'])
+    for argument, key in (('package_data', 'package-data'), ('exclude_package_data', 'exclude-package-data')):
+        if setup_arguments.get(argument):
+            setuptools[key] = {k: list(v) for k, v in setup_arguments[argument].items()}
+    for argument, key in (('platforms', 'platforms'), ('license_files', 'license-files')):
+        if setup_arguments.get(argument):
+            value = setup_arguments[argument]
+            setuptools[key] = [value] if isinstance(value, str) else list(value)
+    for argument, key in (('include_package_data', 'include-package-data'), ('zip_safe', 'zip-safe')):
+        if argument in setup_arguments:
+            setuptools[key] = bool(setup_arguments[argument])
+    if metadata['version'] and version_source:
+        setuptools['dynamic'] = {'version': dict(version_source)}
+
+    requires = list(BUILD_SYSTEM['requires'])
+    for requirement in setup_arguments.get('setup_requires', []):
+        if requirement.split('>')[0].split('=')[0].strip() not in ('setuptools', 'wheel'):
+            requires.append(requirement)
+
+    for argument in sorted(set(setup_arguments) - DECLARATIVE_ARGUMENTS):
+        problems.append(f'{_describe(argument, origins)} has no declarative equivalent')
+    for argument in metadata['unresolved']:
+        if argument == 'long_description' and 'readme' in project:
+            continue
+        if argument != 'version':
+            problems.append(f'{_describe(argument, origins)} could not be evaluated statically')
+
+    pyproject = {'build-system': dict(BUILD_SYSTEM, requires=requires), 'project': project}
+    if setuptools:
+        pyproject['tool'] = {'setuptools': setuptools}
+    return pyproject, problems
+
+def retire_legacy_files(project_directory):
+    '''setup.py -> setup.py.retired. setup.cfg loses its metadata/options
+    sections (the original is kept as setup.cfg.retired), and is retired
+    entirely when nothing else (tool settings) is left in it.'''
+    setup_py_path = os.path.join(project_directory, 'setup.py')
+    if os.path.exists(setup_py_path):
+        os.replace(setup_py_path, f'{setup_py_path}.retired')
+    setup_cfg_path = os.path.join(project_directory, 'setup.cfg')
+    if not os.path.exists(setup_cfg_path):
+        return
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(setup_cfg_path, encoding='utf-8')
+    remaining = [section for section in parser.sections() if section not in ('metadata', 'options') and not section.startswith('options.')]
+    shutil.copy2(setup_cfg_path, f'{setup_cfg_path}.retired')
+    if not remaining:
+        os.remove(setup_cfg_path)
+        return
+    for section in parser.sections():
+        if section not in remaining:
+            parser.remove_section(section)
+    with open(setup_cfg_path, 'w', encoding='utf-8') as file:
+        parser.write(file)
+
+def convert_project(project_directory, retire_setup_py=True, dry_run=False, cache_directory=None):
+    '''Converts one project. Returns its report entry.'''
+    report = {'project_directory': project_directory, 'status': None, 'problems': [], 'pyproject_path': None}
+    try:
+        pyproject_path = os.path.join(project_directory, 'pyproject.toml')
+        existing = {}
+        if os.path.exists(pyproject_path):
+            with open(pyproject_path, 'r', encoding='utf-8') as file:
+                existing = toml.load(file)
+            if 'project' in existing or 'poetry' in existing.get('tool', {}):
+                report['status'] = 'skipped'
+                report['problems'].append('pyproject.toml already declares the project metadata')
+                return report
+
+        metadata = extract_project_metadata(project_directory, cache_directory)
+        setup_py_path = os.path.join(project_directory, 'setup.py')
+        ## setup.cfg wins over setup.py, as in extract_project_metadata
+        setup_arguments, origins = {}, {}
+        for file_name in ('setup.py', 'setup.cfg'):
+            path = os.path.join(project_directory, file_name)
+            if os.path.exists(path):
+                file_metadata = extract_metadata(path, cache_directory)
+                arguments = file_metadata.get('setup_arguments', {})
+                setup_arguments.update(arguments)
+                origins.update(dict.fromkeys(list(arguments) + file_metadata['unresolved'], file_name))
+        if not metadata['package_name']:
+            report['status'] = 'failed'
+            report['problems'].append('no statically resolvable project name')
+            return report
+
+        pyproject, report['problems'] = build_pyproject(project_directory, metadata, setup_arguments, origins)
+        ## Keep whatever the existing file configures (tool settings, a custom build backend...)
+        for key, value in existing.items():
+            if isinstance(value, dict) and isinstance(pyproject.get(key), dict):
+                pyproject[key] = {**pyproject[key], **value}
+            else:
+                pyproject[key] = value
+
+        report['status'] = 'partial' if report['problems'] else 'converted'
+        ## A partial pyproject next to the setup.py would conflict with what setup() still sets
+        if dry_run or report['problems']:
+            report['pyproject'] = pyproject
+            return report
+        report['pyproject_path'] = pyproject_path
+
+        temp_path = f'{pyproject_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            toml.dump(pyproject, file)
+        os.replace(temp_path, pyproject_path)
+
+        if retire_setup_py and not report['problems']:
+            retire_legacy_files(project_directory)
+            report['retired_setup_py'] = True
+        elif os.path.exists(setup_py_path):
+            report['problems'].append('setup.py kept (--keep-setup-py): builds still run it')
+    except Exception as e:
+        report['status'] = 'failed'
+        report['problems'].append(f'{type(e).__name__}: {e}')
+    return report
+
+def convert_tree(root_directory,
+        retire_setup_py=True,
+        dry_run=False,
+        report_path=None,
+        max_workers=None,
+        excluded_folders=None,
+        cache_directory=None,
+        ):
+    '''Converts every legacy project under `root_directory` in parallel and
+    writes the JSON report (to `report_path`, if given).'''
+    projects = find_legacy_projects(root_directory, excluded_folders)
+    pt.c(f'-- Converting {len(projects)} project(s) under {root_directory}')
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(convert_project, projects,
+            [retire_setup_py] * len(projects), [dry_run] * len(projects), [cache_directory] * len(projects)))
+
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    report = {'root_directory': root_directory, 'summary': summary, 'projects': results}
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=4)
+    for result in results:
+        if result['problems']:
+            print(f"{result['status']:>9}  {result['project_directory']}")
+            for problem in result['problems']:
+                print(f'           - {problem}')
+    pt.c(f'-- Transition summary: {summary}')
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert setup.py/setup.cfg projects to PEP 621 pyproject.toml.')
+    parser.add_argument('root_directory', nargs='?', default=os.getcwd())
+    parser.add_argument('--keep-setup-py', action='store_true', help='Leave setup.py/setup.cfg of converted projects in place (builds still run setup.py)')
+    parser.add_argument('--dry-run', action='store_true', help="Only report, don't write anything")
+    parser.add_argument('--report', default=None, help='Path of the JSON report')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    convert_tree(args.root_directory, retire_setup_py=not args.keep_setup_py, dry_run=args.dry_run,
+        report_path=args.report, max_workers=args.workers)
@@ -0,0 +1,145 @@
+'''Per-project memoization of pipeline steps.
+
+    A step declares its inputs with `@step_inputs(...)` (decorators.py):
+    - files: path templates formatted with the instance's attributes, e.g.
+      '{project_directory}' (a whole tree) or '{distribution_directory}/requirements.txt'
+    - options: attribute names whose values change the step's result
+    - remote: name of a (private) method returning a token of the remote
+      state, e.g. a PyPI serial, trusted for `ttl` seconds once checked
+    - outputs: attribute names the step sets, restored when it's skipped
+    - on_restore: name of a (private) method rebuilding what can't be
+      recorded (helper objects) after the outputs are restored
+
+    distribution_directory/step_cache/<step>/<key>.json holds one record per
+    combination of options. A record is valid while every file fingerprint
+    and the remote state are unchanged. Files are fingerprinted after the
+    step ran (so a step may modify its own inputs), by content, with the
+    (size, mtime) of the previous record as a shortcut.
+'''
+
+import os, json, time, hashlib
+from print_tricks import pt
+
+from artifact_store import file_digest
+from fix_and_optimize import DEFAULT_EXCLUDED_FOLDERS
+
+## Bump when the record format changes
+STEP_CACHE_VERSION = 1
+
+
+class StepCache:
+    def __init__(self, cache_directory, excluded_directories=None):
+        self.cache_directory = cache_directory
+        self.excluded_directories = {os.path.abspath(d) for d in (excluded_directories or []) if d}
+        os.makedirs(cache_directory, exist_ok=True)
+
+    def _record_path(self, step_name, key):
+        return os.path.join(self.cache_directory, step_name, f'{key}.json')
+
+    def _load(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, path, record):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(record, file)
+        os.replace(temp_path, path)
+
+    def key(self, instance, step_name, inputs, args, kwargs):
+        '''Computed before the step runs: steps may change their own options (e.g. the package name).'''
+        options = {name: getattr(instance, name, None) for name in inputs['options']}
+        payload = json.dumps([STEP_CACHE_VERSION, step_name, options, args, kwargs], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+    def resolve_paths(self, instance, inputs):
+        return [os.path.abspath(template.format(**vars(instance))) for template in inputs['files']]
+
+    def _signature(self, path, previous):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns:
+            return previous
+        return [stat.st_size, stat.st_mtime_ns, file_digest(path)]
+
+    def file_signatures(self, paths, previous=None, excluded_folders=None):
+        '''{path: [size, mtime_ns, sha256] (None if missing)} of the files, and of every file of the directories.'''
+        previous = previous or {}
+        excludes = set(DEFAULT_EXCLUDED_FOLDERS) | set(f for f in (excluded_folders or []) if f)
+        signatures = {}
+        for path in paths:
+            if not os.path.isdir(path):
+                signatures[path] = self._signature(path, previous.get(path))
+                continue
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if d not in excludes and not d.endswith('.egg-info')
+                    and os.path.join(root, d) not in self.excluded_directories)
+                for file in sorted(files):
+                    if file.endswith(('.pyc', '.pyo')):
+                        continue
+                    file_path = os.path.join(root, file)
+                    signatures[file_path] = self._signature(file_path, previous.get(file_path))
+        return signatures
+
+    def _remote_state(self, instance, inputs):
+        try:
+            return json.loads(json.dumps(getattr(instance, inputs['remote'])(), default=str))
+        except Exception as e:
+            pt.c(f'-- Step cache: could not check the remote state ({e})')
+            return None
+
+    def _excluded_folders(self, instance):
+        user_options = getattr(instance, 'user_options', None)
+        return user_options.get('excluded_folders') if isinstance(user_options, dict) else None
+
+    def restore(self, instance, step_name, inputs, key):
+        '''Restores the step's recorded outputs if its inputs are unchanged. Returns whether it did.'''
+        try:
+            record_path = self._record_path(step_name, key)
+            paths = self.resolve_paths(instance, inputs)
+        except (KeyError, AttributeError, IndexError):
+            return False  ## An input isn't known yet
+        record = self._load(record_path)
+        if record is None:
+            return False
+
+        if self.file_signatures(paths, record['files'], self._excluded_folders(instance)) != record['files']:
+            return False
+        if inputs['remote']:
+            age = time.time() - record['remote_checked_at']
+            if not inputs['ttl'] or age > inputs['ttl']:
+                remote_state = self._remote_state(instance, inputs)
+                if remote_state is None or remote_state != record['remote']:
+                    return False
+                record['remote_checked_at'] = time.time()
+                self._save(record_path, record)
+
+        for name, value in record['outputs'].items():
+            setattr(instance, name, value)
+        if inputs['on_restore']:
+            getattr(instance, inputs['on_restore'])()
+        return True
+
+    def record(self, instance, step_name, inputs, key):
+        '''Records the step's inputs (files as they are now) and outputs under `key`.'''
+        try:
+            record_path = self._record_path(step_name, key)
+            paths = self.resolve_paths(instance, inputs)
+            outputs = json.loads(json.dumps({name: getattr(instance, name, None) for name in inputs['outputs']}))
+        except (KeyError, AttributeError, IndexError, TypeError, ValueError) as e:
+            pt.c(f'-- Step cache: not recording {step_name} ({e})')
+            return
+        previous = self._load(record_path) or {}
+        record = {
+            'files': self.file_signatures(paths, previous.get('files'), self._excluded_folders(instance)),
+            'remote': self._remote_state(instance, inputs) if inputs['remote'] else None,
+            'remote_checked_at': time.time(),
+            'outputs': outputs,
+        }
+        self._save(record_path, record)
@@ -0,0 +1,160 @@
+'''Opt-in profiling of the pipeline steps (`profile=True` / `--profile`).
+
+    For every step (everything it calls in-process included, e.g.
+    SetupFileManager and PyPIVerifier), written to distribution_directory/profiles:
+    - <nn>_<step>.prof             cProfile stats (snakeviz, `python -m pstats`, ...)
+    - <nn>_<step>.allocations.txt  peak memory and the top allocations (tracemalloc)
+    - <nn>_<step>.collapsed        sampled stacks of every thread, in the collapsed
+                                   format of flamegraph.pl / speedscope / inferno
+    - summary.txt                  one line per step: time, peak memory
+
+    Subprocesses (builds, pip, tests) only show up as the time spent waiting
+    for them: their own output is in the build logs.
+
+    tracemalloc and cProfile are process wide. Steps profiled concurrently
+    (Pipeline.run_many) share tracemalloc, which runs while any of them
+    does (their peaks then include each other's allocations), and only one
+    step at a time gets the cProfile stats (a second active profiler raises
+    on 3.12+). Profiling errors are reported, they never fail the step.
+'''
+
+import os, sys, time, cProfile, threading, tracemalloc
+from collections import Counter
+from print_tricks import pt
+
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0          ## Steps being profiled
+_tracing_started = False    ## tracemalloc was started by us (not by the user, e.g. PYTHONTRACEMALLOC)
+_cprofile_lock = threading.Lock()
+
+
+def _start_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        if _tracing_users == 0:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                _tracing_started = True
+            tracemalloc.reset_peak()
+        _tracing_users += 1
+
+def _stop_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+def _start_cprofile():
+    '''An enabled cProfile.Profile, or None while another step (or tool) is profiling.'''
+    if not _cprofile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        _cprofile_lock.release()
+        return None
+    return profiler
+
+def _stop_cprofile(profiler):
+    if profiler is None:
+        return
+    try:
+        profiler.disable()
+    finally:
+        _cprofile_lock.release()
+
+
+class _StackSampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name='pup_py-stack-sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.stacks[f'{thread_names.get(thread_id, thread_id)};{self._collapse(frame)}'] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+class StepProfiler:
+    def __init__(self, profile_directory, top_allocations=25, sample_interval=0.005):
+        self.profile_directory = profile_directory
+        self.top_allocations = top_allocations
+        self.sample_interval = sample_interval
+        self.depth = 0  ## Steps calling steps (e.g. the upload retry) are part of the outer profile
+        os.makedirs(profile_directory, exist_ok=True)
+
+    def profile(self, name, func, *args, **kwargs):
+        '''Runs func(*args, **kwargs) under the profilers and writes the reports as `name`.'''
+        if self.depth:
+            return func(*args, **kwargs)
+        self.depth += 1
+        _start_tracing()
+        try:
+            snapshot_before = tracemalloc.take_snapshot()
+            sampler = _StackSampler(self.sample_interval)
+            profiler = _start_cprofile()
+
+            start = time.perf_counter()
+            sampler.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                try:
+                    _stop_cprofile(profiler)
+                    sampler.stop()
+                    _, peak = tracemalloc.get_traced_memory()
+                    snapshot_after = tracemalloc.take_snapshot()
+                    self._write_reports(name, profiler, sampler, snapshot_before, snapshot_after, elapsed, peak)
+                except Exception as e:
+                    ## The step's own result (or exception) stands
+                    pt.c(f'-- Could not profile {name}: {e!r}')
+        finally:
+            _stop_tracing()
+            self.depth -= 1
+
+    def _write_reports(self, name, profiler, sampler, snapshot_before, snapshot_after, elapsed, peak):
+        base_path = os.path.join(self.profile_directory, name)
+        if profiler is not None:
+            profiler.dump_stats(f'{base_path}.prof')
+
+        ## Allocations made during the step (and still alive at its end)
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        differences = snapshot_after.filter_traces(filters).compare_to(snapshot_before.filter_traces(filters), 'lineno')
+        with open(f'{base_path}.allocations.txt', 'w', encoding='utf-8') as file:
+            file.write(f'{name}: {elapsed:.3f} s, peak traced memory {peak / 1024 ** 2:.1f} MB\n\n')
+            file.write(f'Top {self.top_allocations} allocations (size delta, count delta, location):\n')
+            for difference in differences[:self.top_allocations]:
+                frame = difference.traceback[0]
+                file.write(f'{difference.size_diff / 1024:>12.1f} KiB {difference.count_diff:>+9} {frame.filename}:{frame.lineno}\n')
+
+        with open(f'{base_path}.collapsed', 'w', encoding='utf-8') as file:
+            for stack, count in sampler.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+        with open(os.path.join(self.profile_directory, 'summary.txt'), 'a', encoding='utf-8') as file:
+            file.write(f'{time.strftime("%Y-%m-%d %H:%M:%S")} {name:<45} {elapsed:>9.3f} s {peak / 1024 ** 2:>9.1f} MB peak\n')
+        pt.c(f'-- Profile of {name}: {elapsed:.3f} s, {peak / 1024 ** 2:.1f} MB peak ({base_path}.*)')
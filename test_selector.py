@@ -0,0 +1,169 @@
+'''Affected-test selection for the project's own test suite.
+
+    The project and its tests are parsed (ast) into an import graph. The
+    content fingerprints of every file are compared with the ones of the last
+    *successful* run, and only the test files that (transitively) import a
+    changed module, or that changed themselves, are run.
+
+    Everything is run (a full run) when:
+    - there is no successful run to compare with yet, or it's forced
+    - a non-python file (data, metadata...) or a conftest.py changed, or a
+      module was removed: the import graph can't tell what those affect
+    - `full_run_every` successful selective runs happened since the last one
+    A failed run records nothing, so its tests are selected again next time.
+'''
+
+import os, ast, json
+from print_tricks import pt
+
+from artifact_store import file_digest
+from fix_and_optimize import DEFAULT_EXCLUDED_FOLDERS
+
+
+def is_test_file(path):
+    name = os.path.basename(path)
+    return name.endswith('.py') and (name.startswith('test_') or name.endswith('_test.py'))
+
+
+def _imported_names(path, package):
+    '''Dotted names of everything a file imports (relative imports resolved against `package`).'''
+    try:
+        with open(path, 'rb') as file:
+            tree = ast.parse(file.read(), filename=path)
+    except (OSError, SyntaxError, ValueError):
+        return set()
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                parts = package.split('.') if package else []
+                if node.level - 1 > len(parts):
+                    continue
+                base = '.'.join(parts[:len(parts) - (node.level - 1)])
+                module = '.'.join(p for p in (base, node.module) if p)
+            else:
+                module = node.module
+            if not module:
+                continue
+            names.add(module)
+            ## `from package import module` imports a submodule
+            names.update(f'{module}.{alias.name}' for alias in node.names if alias.name != '*')
+    return names
+
+
+class TestSelector:
+    def __init__(self, project_directory, state_path, excluded_folders=None, excluded_directories=None, full_run_every=20):
+        self.project_directory = os.path.abspath(project_directory)
+        self.state_path = state_path
+        self.excluded_folders = set(DEFAULT_EXCLUDED_FOLDERS) | set(f for f in (excluded_folders or []) if f)
+        self.excluded_directories = {os.path.abspath(d) for d in (excluded_directories or []) if d}
+        self.full_run_every = full_run_every
+        ## Modules are named from the project root, and from src/ for src layouts
+        self.roots = [self.project_directory]
+        if os.path.isdir(os.path.join(self.project_directory, 'src')):
+            self.roots.append(os.path.join(self.project_directory, 'src'))
+        self.fingerprints = None
+        self.test_files = None
+        self.full_run = False
+
+    def _files(self):
+        files = []
+        for root, dirs, names in os.walk(self.project_directory):
+            dirs[:] = sorted(d for d in dirs if d not in self.excluded_folders and not d.endswith('.egg-info')
+                and os.path.join(root, d) not in self.excluded_directories)
+            files.extend(os.path.join(root, name) for name in sorted(names) if not name.endswith(('.pyc', '.pyo')))
+        return files
+
+    def _module_names(self, python_files):
+        '''({dotted name: path}, {path: dotted name from its innermost root}).'''
+        modules, file_modules = {}, {}
+        for root in self.roots:
+            for path in python_files:
+                if not path.startswith(root + os.sep):
+                    continue
+                parts = os.path.relpath(path, root)[:-len('.py')].split(os.sep)
+                if parts[-1] == '__init__':
+                    parts = parts[:-1]
+                if parts and all(part.isidentifier() for part in parts):
+                    modules['.'.join(parts)] = path
+                    file_modules[path] = '.'.join(parts)
+        return modules, file_modules
+
+    def import_graph(self, python_files):
+        '''{path: set of the project files it imports directly}.'''
+        modules, file_modules = self._module_names(python_files)
+        graph = {}
+        for path in python_files:
+            module = file_modules.get(path, '')
+            package = module if path.endswith('__init__.py') else module.rpartition('.')[0]
+            dependencies = set()
+            for name in _imported_names(path, package):
+                parts = name.split('.')
+                ## Importing a.b.c runs a/__init__ and a/b/__init__ too
+                for i in range(1, len(parts) + 1):
+                    dependency = modules.get('.'.join(parts[:i]))
+                    if dependency and dependency != path:
+                        dependencies.add(dependency)
+            graph[path] = dependencies
+        return graph
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def select(self, force_full_run=False):
+        '''(test files to run, reason). Sets self.test_files (all of them) and self.full_run.'''
+        files = self._files()
+        self.fingerprints = {os.path.relpath(path, self.project_directory): file_digest(path) for path in files}
+        test_files = self.test_files = [path for path in files if is_test_file(path)]
+
+        state = self._load_state()
+        self.full_run = True
+        if force_full_run:
+            return test_files, 'full run requested'
+        if state is None:
+            return test_files, 'no previous successful run'
+        if state['runs_since_full_run'] + 1 >= self.full_run_every:
+            return test_files, f'periodic full run (every {self.full_run_every} runs)'
+
+        previous = state['fingerprints']
+        changed = {path for path in self.fingerprints.keys() | previous.keys()
+            if self.fingerprints.get(path) != previous.get(path)}
+        if not changed:
+            return [], 'nothing changed since the last successful run'
+        for path in sorted(changed):
+            if not path.endswith('.py') or os.path.basename(path) == 'conftest.py' or path not in self.fingerprints:
+                return test_files, f'{path} changed'
+        self.full_run = False
+
+        ## Everything that (transitively) imports a changed module
+        graph = self.import_graph([path for path in files if path.endswith('.py')])
+        importers = {}
+        for path, dependencies in graph.items():
+            for dependency in dependencies:
+                importers.setdefault(dependency, set()).add(path)
+        affected = {os.path.join(self.project_directory, path) for path in changed}
+        pending = list(affected)
+        while pending:
+            for importer in importers.get(pending.pop(), ()):
+                if importer not in affected:
+                    affected.add(importer)
+                    pending.append(importer)
+        selected = [path for path in test_files if path in affected]
+        return selected, f'{len(changed)} changed file(s) affect {len(selected)} of {len(test_files)} test file(s)'
+
+    def record_success(self):
+        '''Stores the fingerprints taken by select() as the new baseline.'''
+        state = self._load_state()
+        runs_since_full_run = 0 if self.full_run or state is None else state['runs_since_full_run'] + 1
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        temp_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'fingerprints': self.fingerprints, 'runs_since_full_run': runs_since_full_run}, file)
+        os.replace(temp_path, self.state_path)
+        pt.c(f'-- Test selection baseline updated ({len(self.fingerprints)} files)')
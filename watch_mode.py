@@ -0,0 +1,356 @@
+'''Watch mode for PUP (Pip Universal Projects)
+
+    Monitors a project tree and, on every change, reruns only the steps of the
+    PipUniversalProjects workflow that the change actually affects:
+    - requirements.txt is regenerated only if the imports of a file changed
+    - the pyproject/setup data is re-read only if the metadata files changed
+    - __init__ files are only re-created if python files were added/moved
+    - every source change rebuilds, reinstalls and retests the wheel (in dev
+      mode, only retests the editable install)
+
+    The same PipUniversalProjects instance is reused between iterations, so
+    everything it has already set up (directories, setup file manager,
+    verifier, caches) stays warm.
+
+    Changes are detected with inotify on Linux, with a polling fallback for
+    every other platform (or when inotify is unavailable / out of watches).
+'''
+
+import os, sys, time, ast, struct, select, ctypes, ctypes.util
+from print_tricks import pt
+
+from fix_and_optimize import DEFAULT_EXCLUDED_FOLDERS
+
+
+METADATA_FILES = ('pyproject.toml', 'setup.py', 'setup.cfg', 'MANIFEST.in')
+REQUIREMENTS_FILES = ('requirements.txt',)
+
+## Steps run after any change to the sources, in workflow order
+BUILD_AND_TEST_STEPS = [
+    'build_wheel',
+    'uninstall_package',
+    'install_package_locally',
+    'test_installed_package',
+    'run_project_tests',
+]
+## Dev mode: the editable install is only redone if the packaging metadata changed (see dev_mode.py)
+DEV_STEPS = [
+    'install_editable',
+    'test_installed_package',
+    'run_project_tests',
+]
+## The files of the project tree that steps write themselves (their changes
+## aren't edits to react to). Everything else a build writes lands in
+## excluded directories (build_dist, stages, caches).
+STEP_OUTPUTS = {
+    'check_or_gen_requirements': REQUIREMENTS_FILES,
+    'setup_file_data': METADATA_FILES,
+    'fix_and_optimize_package': ('__init__.py',),
+}
+
+
+class _InotifyBackend:
+    '''Recursive inotify watches through libc (Linux only).'''
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+        | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, project_directory, is_excluded):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.project_directory = project_directory
+        self.is_excluded = is_excluded
+        self.watch_descriptors = {}
+        self._add_tree(project_directory)
+
+    def _add_watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            ## ENOSPC here means we ran out of watches: let the caller fall back to polling
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {directory}')
+        self.watch_descriptors[wd] = directory
+
+    def _add_tree(self, directory):
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if not self.is_excluded(os.path.join(root, d))]
+            self._add_watch(root)
+
+    def read_changes(self, timeout):
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, cookie, name_length = self.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += self.EVENT_HEADER.size
+            name = buffer[offset:offset + name_length].rstrip(b'\0').decode(errors='replace')
+            offset += name_length
+
+            if mask & self.IN_Q_OVERFLOW:
+                ## Events were dropped: report the whole tree as changed
+                changed.add(self.project_directory)
+                continue
+            if mask & self.IN_IGNORED:
+                self.watch_descriptors.pop(wd, None)
+                continue
+            directory = self.watch_descriptors.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if self.is_excluded(path):
+                continue
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._add_tree(path)
+            changed.add(path)
+        return changed
+
+    def pending_changes(self):
+        '''Everything that is already queued (without waiting).'''
+        changed = set()
+        while True:
+            more = self.read_changes(0)
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _PollingBackend:
+    '''Portable fallback: compares (mtime, size) snapshots of the tree.'''
+    def __init__(self, project_directory, is_excluded, poll_interval=0.5):
+        self.project_directory = project_directory
+        self.is_excluded = is_excluded
+        self.poll_interval = poll_interval
+        self.snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for root, dirs, files in os.walk(self.project_directory):
+            dirs[:] = [d for d in dirs if not self.is_excluded(os.path.join(root, d))]
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def read_changes(self, timeout):
+        time.sleep(min(timeout, self.poll_interval))
+        new_snapshot = self._take_snapshot()
+        changed = {path for path in new_snapshot.keys() | self.snapshot.keys()
+            if new_snapshot.get(path) != self.snapshot.get(path)}
+        self.snapshot = new_snapshot
+        return changed
+
+    def pending_changes(self):
+        return self.read_changes(0)
+
+    def close(self):
+        pass
+
+
+class ProjectWatcher:
+    def __init__(self,
+            project_directory,
+            excluded_folders=None,
+            excluded_directories=None,
+            use_inotify=True,
+            poll_interval=0.5,
+            debounce=0.15,
+            ):
+        self.project_directory = os.path.abspath(project_directory)
+        self.excluded_folders = set(DEFAULT_EXCLUDED_FOLDERS) | set(f for f in (excluded_folders or []) if f)
+        self.excluded_directories = [os.path.abspath(d) for d in (excluded_directories or [])
+            if d and os.path.abspath(d) != self.project_directory]
+        self.debounce = debounce
+
+        self.backend = None
+        if use_inotify:
+            try:
+                self.backend = _InotifyBackend(self.project_directory, self.is_excluded)
+                print('Watching for changes using inotify.')
+            except (OSError, AttributeError) as e:
+                print(f'inotify unavailable ({e}), falling back to polling.')
+        if self.backend is None:
+            self.backend = _PollingBackend(self.project_directory, self.is_excluded, poll_interval)
+            print(f'Watching for changes by polling every {poll_interval}s.')
+
+    def is_excluded(self, path):
+        path = os.path.abspath(path)
+        if any(path == d or path.startswith(d + os.sep) for d in self.excluded_directories):
+            return True
+        relative_parts = os.path.relpath(path, self.project_directory).split(os.sep)
+        return any(part in self.excluded_folders or part.endswith('.egg-info') for part in relative_parts)
+
+    def wait_for_changes(self, changed=None):
+        '''Blocks until something changes (unless `changed` already holds
+        changes), then keeps collecting until the tree has been quiet for
+        `debounce` seconds (editors often write a file in several steps).'''
+        changed = set(changed or ())
+        while not changed:
+            changed = self.backend.read_changes(1.0)
+        while True:
+            more = self.backend.read_changes(self.debounce)
+            if not more:
+                return changed
+            changed |= more
+
+    def pending_changes(self):
+        return self.backend.pending_changes()
+
+    def close(self):
+        self.backend.close()
+
+
+def _import_signature(file_path):
+    '''The set of top level modules imported by a python file (or None if
+    the file can't be parsed right now, e.g. it's halfway through an edit).'''
+    try:
+        with open(file_path, 'rb') as file:
+            tree = ast.parse(file.read(), filename=file_path)
+    except (OSError, SyntaxError, ValueError):
+        return None
+    imports = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            imports.add(node.module.split('.')[0])
+    return frozenset(imports)
+
+
+class IncrementalStepPlanner:
+    '''Maps a set of changed paths onto the (ordered) workflow steps they affect.'''
+    def __init__(self, watcher, build_and_test_steps=None):
+        self.watcher = watcher
+        self.build_and_test_steps = BUILD_AND_TEST_STEPS if build_and_test_steps is None else build_and_test_steps
+        self.import_signatures = {}
+        for root, dirs, files in os.walk(watcher.project_directory):
+            dirs[:] = [d for d in dirs if not watcher.is_excluded(os.path.join(root, d))]
+            for file in files:
+                if file.endswith('.py'):
+                    path = os.path.join(root, file)
+                    self.import_signatures[path] = _import_signature(path)
+
+    def plan(self, changed_paths):
+        metadata_changed = False
+        requirements_changed = False
+        imports_changed = False
+        structure_changed = False
+        sources_changed = False
+
+        for path in changed_paths:
+            name = os.path.basename(path)
+            if path == self.watcher.project_directory or os.path.isdir(path):
+                ## Directory level events (or an inotify overflow): assume the worst
+                structure_changed = imports_changed = sources_changed = True
+                continue
+            if name in METADATA_FILES:
+                metadata_changed = True
+            elif name in REQUIREMENTS_FILES:
+                requirements_changed = True
+            elif name.endswith('.py'):
+                sources_changed = True
+                exists = os.path.exists(path)
+                if exists != (path in self.import_signatures):
+                    structure_changed = True
+                if not exists:
+                    self.import_signatures.pop(path, None)
+                    imports_changed = True
+                    continue
+                signature = _import_signature(path)
+                if signature is not None and signature != self.import_signatures.get(path):
+                    imports_changed = True
+                    self.import_signatures[path] = signature
+            else:
+                ## Package data etc.
+                sources_changed = True
+
+        steps = []
+        if requirements_changed or imports_changed:
+            steps.append('check_or_gen_requirements')
+        if metadata_changed:
+            steps.append('setup_file_data')
+        if structure_changed:
+            steps.append('fix_and_optimize_package')
+        if steps or sources_changed:
+            steps.extend(self.build_and_test_steps)
+        return steps
+
+
+def watch_project(pup, use_inotify=True, poll_interval=0.5):
+    '''Runs forever (until Ctrl+C), re-running only the affected steps of an
+    already initialized PipUniversalProjects instance on every change.'''
+    watcher = ProjectWatcher(
+        pup.project_directory,
+        excluded_folders=pup.user_options.get('excluded_folders'),
+        excluded_directories=[pup.distribution_directory, pup.pypi_structure_directory],
+        use_inotify=use_inotify,
+        poll_interval=poll_interval,
+    )
+    planner = IncrementalStepPlanner(watcher, DEV_STEPS if pup.dev_mode else BUILD_AND_TEST_STEPS)
+    pt.c(f'\n-- Watching {pup.project_directory} for changes. Press Ctrl+C to stop.')
+
+    iteration = 0
+    carried_paths = set()
+    try:
+        while True:
+            changed_paths = watcher.wait_for_changes(carried_paths)
+            steps = planner.plan(changed_paths)
+            if not steps:
+                continue
+            iteration += 1
+            pt.c(f'\n-- Change {iteration}: {len(changed_paths)} path(s) changed, running: {", ".join(steps)}')
+
+            start_time = time.perf_counter()
+            failed_step = None
+            for step in steps:
+                try:
+                    if step == 'check_or_gen_requirements':
+                        pup.check_or_gen_requirements(regenerate=True)
+                    else:
+                        getattr(pup, step)()
+                except (Exception, SystemExit) as e:
+                    failed_step = step
+                    print(f'Watch: step "{step}" failed: {e!r}')
+                    break
+            elapsed = time.perf_counter() - start_time
+
+            if failed_step:
+                pt.c(f'-- FAILED at "{failed_step}" after {elapsed:.2f}s. Waiting for the next change...')
+            else:
+                pt.c(f'-- PASSED ({len(steps)} steps) in {elapsed:.2f}s. Waiting for the next change...')
+
+            ## Changes made while the steps ran are the next iteration's, except
+            ## the files that our own steps wrote (requirements, __init__ files, etc.)
+            own_outputs = {name for step in steps for name in STEP_OUTPUTS.get(step, ())}
+            carried_paths = {path for path in watcher.pending_changes() if os.path.basename(path) not in own_outputs}
+    except KeyboardInterrupt:
+        print('\nStopped watching.')
+    finally:
+        watcher.close()
@@ -0,0 +1,137 @@
+'''Re-stamps an already built wheel with a new version, without rebuilding it.
+
+    A version bump only changes:
+    - the wheel's file name
+    - the name of the `.dist-info` (and `.data`) directory inside the zip
+    - the `Version:` header in METADATA
+    - the RECORD entries (paths and the hash/size of METADATA)
+
+    Every other member is streamed through unchanged, so re-stamping takes
+    milliseconds instead of a full backend build.
+'''
+
+import os, io, csv, base64, hashlib, shutil, tempfile, zipfile
+from print_tricks import pt
+
+try:
+    from packaging.version import Version, InvalidVersion
+except ImportError:  ## packaging comes with `build`, but don't require it
+    Version = None
+
+
+def _record_hash(data):
+    digest = hashlib.sha256(data).digest()
+    return 'sha256=' + base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+def _normalize_version(version):
+    if Version is None:
+        return version
+    try:
+        return str(Version(version))
+    except InvalidVersion:
+        return version
+
+def parse_wheel_filename(wheel_path):
+    '''Returns (distribution, version, tags) where tags is everything after
+    the version (optional build tag included), e.g. "py3-none-any".'''
+    file_name = os.path.basename(wheel_path)
+    if not file_name.endswith('.whl'):
+        raise ValueError(f'Not a wheel file: {file_name}')
+    parts = file_name[:-len('.whl')].split('-')
+    if len(parts) not in (5, 6):
+        raise ValueError(f'Invalid wheel file name: {file_name}')
+    return parts[0], parts[1], '-'.join(parts[2:])
+
+def _replace_metadata_version(metadata, new_version):
+    '''Only touches the first `Version:` header (headers end at the first blank line).'''
+    lines = metadata.decode('utf-8').splitlines(keepends=True)
+    for i, line in enumerate(lines):
+        if not line.strip():
+            break
+        if line.startswith('Version:'):
+            newline = line[len(line.rstrip('\r\n')):]
+            lines[i] = f'Version: {new_version}{newline}'
+            return ''.join(lines).encode('utf-8')
+    raise ValueError('No Version header found in METADATA')
+
+def restamp_wheel(wheel_path, new_version, output_directory=None, remove_original=True):
+    '''Writes a copy of `wheel_path` stamped with `new_version` and returns its path.'''
+    distribution, old_version, tags = parse_wheel_filename(wheel_path)
+    new_version = _normalize_version(new_version)
+    ## Versions in file names use "_" instead of "-" (PEP 427)
+    new_file_version = new_version.replace('-', '_')
+    output_directory = output_directory or os.path.dirname(os.path.abspath(wheel_path))
+    new_wheel_path = os.path.join(output_directory, f'{distribution}-{new_file_version}-{tags}.whl')
+
+    old_prefixes = (f'{distribution}-{old_version}.dist-info/', f'{distribution}-{old_version}.data/')
+    new_prefixes = (f'{distribution}-{new_file_version}.dist-info/', f'{distribution}-{new_file_version}.data/')
+
+    def rename(member_name):
+        for old_prefix, new_prefix in zip(old_prefixes, new_prefixes):
+            if member_name.startswith(old_prefix):
+                return new_prefix + member_name[len(old_prefix):]
+        return member_name
+
+    metadata_name = old_prefixes[0] + 'METADATA'
+    record_name = old_prefixes[0] + 'RECORD'
+
+    temp_fd, temp_path = tempfile.mkstemp(suffix='.whl.tmp', dir=output_directory)
+    os.close(temp_fd)
+    try:
+        with zipfile.ZipFile(wheel_path, 'r') as zin, zipfile.ZipFile(temp_path, 'w') as zout:
+            names = zin.namelist()
+            if metadata_name not in names or record_name not in names:
+                raise ValueError(f'{wheel_path} has no {old_prefixes[0]} METADATA/RECORD')
+
+            new_metadata = _replace_metadata_version(zin.read(metadata_name), new_version)
+
+            for info in zin.infolist():
+                if info.filename == record_name:
+                    continue  ## Written last, once everything else is known
+                new_info = zipfile.ZipInfo(rename(info.filename), date_time=info.date_time)
+                new_info.compress_type = info.compress_type
+                new_info.external_attr = info.external_attr
+                new_info.create_system = info.create_system
+                if info.filename == metadata_name:
+                    zout.writestr(new_info, new_metadata)
+                    continue
+                ## Stream unchanged members straight through
+                with zin.open(info) as source, zout.open(new_info, 'w') as destination:
+                    shutil.copyfileobj(source, destination, 1024 * 1024)
+
+            ## Rewrite RECORD: renamed paths + the new METADATA hash/size
+            record_info = zin.getinfo(record_name)
+            old_record = zin.read(record_name).decode('utf-8')
+            new_record = io.StringIO()
+            writer = csv.writer(new_record, lineterminator='\n')
+            for row in csv.reader(io.StringIO(old_record)):
+                if not row:
+                    continue
+                path = row[0]
+                if path == metadata_name:
+                    writer.writerow([rename(path), _record_hash(new_metadata), str(len(new_metadata))])
+                elif path == record_name:
+                    writer.writerow([rename(path), '', ''])
+                else:
+                    writer.writerow([rename(path)] + row[1:])
+            new_record_info = zipfile.ZipInfo(rename(record_name), date_time=record_info.date_time)
+            new_record_info.compress_type = record_info.compress_type
+            new_record_info.external_attr = record_info.external_attr
+            zout.writestr(new_record_info, new_record.getvalue().encode('utf-8'))
+
+        os.replace(temp_path, new_wheel_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if remove_original and os.path.abspath(wheel_path) != os.path.abspath(new_wheel_path):
+        os.remove(wheel_path)
+    print(f'Re-stamped wheel {os.path.basename(wheel_path)} -> {os.path.basename(new_wheel_path)}')
+    return new_wheel_path
+
+
+if __name__ == '__main__':
+    import sys
+    restamped = restamp_wheel(sys.argv[1], sys.argv[2], remove_original=False)
+    pt(restamped)
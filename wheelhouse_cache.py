@@ -0,0 +1,118 @@
+'''Local wheelhouse + resolution cache for the install stages.
+
+    - wheelhouse/        every dependency wheel we've ever needed (shared by all projects)
+    - resolutions.json   requirement set (+ interpreter tag) -> the exact wheels pip resolved it to
+
+    When a requirement set has been resolved before (and all of its wheels are
+    still in the wheelhouse), installs run with `--no-index --find-links`, so no
+    network access or resolution against the remote index is needed.
+'''
+
+import os, re, sys, json, shutil, hashlib, tempfile, subprocess
+from print_tricks import pt
+
+from artifact_store import interpreter_tag
+
+
+def read_wheel_requirements(wheel_path):
+    '''The Requires-Dist entries of a wheel (minus the ones that only apply to extras).'''
+    import zipfile
+    with zipfile.ZipFile(wheel_path) as wheel:
+        metadata_name = next(name for name in wheel.namelist()
+            if name.count('/') == 1 and name.endswith('.dist-info/METADATA'))
+        metadata = wheel.read(metadata_name).decode('utf-8')
+
+    requirements = []
+    for line in metadata.splitlines():
+        if not line.strip():
+            break  ## End of the headers, the rest is the long description
+        if line.startswith('Requires-Dist:'):
+            requirement = line[len('Requires-Dist:'):].strip()
+            if re.search(r'\bextra\s*==', requirement):
+                continue
+            requirements.append(requirement)
+    return requirements
+
+
+class WheelhouseCache:
+    def __init__(self, cache_directory, python_executable=None):
+        self.cache_directory = cache_directory
+        self.wheelhouse_directory = os.path.join(cache_directory, 'wheelhouse')
+        self.resolutions_path = os.path.join(cache_directory, 'resolutions.json')
+        self.python_executable = python_executable or sys.executable
+        self._python_tag = None
+        os.makedirs(self.wheelhouse_directory, exist_ok=True)
+
+    @property
+    def python_tag(self):
+        '''Resolutions differ per interpreter/platform, so they're part of the key.'''
+        if self._python_tag is None:
+            self._python_tag = interpreter_tag(self.python_executable)
+        return self._python_tag
+
+    def resolution_key(self, requirements):
+        normalized = sorted({' '.join(r.lower().split()) for r in requirements})
+        key_source = '\n'.join([self.python_tag] + normalized)
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def _load_resolutions(self):
+        try:
+            with open(self.resolutions_path, 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_resolution(self, key, requirements, wheel_files):
+        ## Re-read right before writing so concurrent runs don't drop each other's entries
+        resolutions = self._load_resolutions()
+        resolutions[key] = {
+            'python_tag': self.python_tag,
+            'requirements': sorted(requirements),
+            'wheels': sorted(wheel_files),
+        }
+        temp_fd, temp_path = tempfile.mkstemp(dir=self.cache_directory, suffix='.json.tmp')
+        with os.fdopen(temp_fd, 'w') as file:
+            json.dump(resolutions, file, indent=4)
+        os.replace(temp_path, self.resolutions_path)
+
+    def is_covered(self, requirements):
+        if not requirements:
+            return True
+        resolution = self._load_resolutions().get(self.resolution_key(requirements))
+        if resolution is None:
+            return False
+        return all(os.path.exists(os.path.join(self.wheelhouse_directory, wheel)) for wheel in resolution['wheels'])
+
+    def populate(self, requirements, index_url=None):
+        '''Resolves `requirements` once against the index and stores the resulting wheels.'''
+        pt.c(f'-- Resolving {len(requirements)} requirement(s) into the local wheelhouse')
+        download_directory = tempfile.mkdtemp(dir=self.cache_directory)
+        try:
+            command = [
+                self.python_executable, '-m', 'pip', 'wheel',
+                '--wheel-dir', download_directory,
+                ## Lets pip reuse what we already have instead of downloading it again
+                '--find-links', self.wheelhouse_directory,
+            ]
+            if index_url:
+                command += ['--index-url', index_url]
+            subprocess.run(command + list(requirements), check=True)
+
+            wheel_files = [f for f in os.listdir(download_directory) if f.endswith('.whl')]
+            for wheel_file in wheel_files:
+                destination = os.path.join(self.wheelhouse_directory, wheel_file)
+                if not os.path.exists(destination):
+                    shutil.move(os.path.join(download_directory, wheel_file), destination)
+        finally:
+            shutil.rmtree(download_directory, ignore_errors=True)
+
+        self._save_resolution(self.resolution_key(requirements), requirements, wheel_files)
+        return wheel_files
+
+    def install_arguments(self, requirements, index_url=None):
+        '''pip install arguments that satisfy `requirements` from the wheelhouse only.'''
+        if self.is_covered(requirements):
+            pt.c('-- Dependencies are covered by the local wheelhouse, installing without network access')
+        else:
+            self.populate(requirements, index_url)
+        return ['--no-index', '--find-links', self.wheelhouse_directory]
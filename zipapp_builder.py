@@ -0,0 +1,114 @@
+'''Single-file executable (.pyz zipapp) of a wheel and its dependencies.
+
+    exe_build_directory/zipapp/          staging (recreated on every build)
+        __main__.py                      the bootstrap (BOOTSTRAP below)
+        site/                            `pip install --target` of the wheel + dependencies
+    exe_distribution_directory/<name>-<version>.pyz
+
+    - Dependencies come from the local wheelhouse (no network on rebuilds)
+    - Everything is precompiled into __pycache__ with unchecked-hash .pyc
+      files: they're never revalidated against the (extracted) sources'
+      mtimes, and the sources stay in for tracebacks
+    - The bootstrap extracts site/ once per archive content, to
+      $PUP_PY_ZIPAPP_CACHE (default ~/.cache/pup_py/zipapps/<name>-<hash>),
+      and imports from there: extension modules work, and every later start
+      only costs a directory check
+    - Like the wheels it's made of, the archive targets the interpreter (and
+      platform) it was built with when a dependency has extension modules
+'''
+
+import os, sys, shutil, hashlib, zipfile, zipapp, compileall, configparser, py_compile, subprocess
+from print_tricks import pt
+
+from wheelhouse_cache import WheelhouseCache, read_wheel_requirements
+
+
+BOOTSTRAP = r'''import os, sys, shutil, zipfile, tempfile
+
+NAME = {name!r}
+PAYLOAD_HASH = {payload_hash!r}
+ENTRY_POINT = {entry_point!r}
+
+def extracted_site():
+    cache_directory = os.environ.get('PUP_PY_ZIPAPP_CACHE') or os.path.join(os.path.expanduser('~'), '.cache', 'pup_py', 'zipapps')
+    target = os.path.join(cache_directory, f'{{NAME}}-{{PAYLOAD_HASH}}')
+    if os.path.isdir(target):
+        return os.path.join(target, 'site')
+    os.makedirs(cache_directory, exist_ok=True)
+    temp_directory = tempfile.mkdtemp(prefix=f'.{{NAME}}-', dir=cache_directory)
+    try:
+        with zipfile.ZipFile(os.path.dirname(os.path.abspath(__file__))) as archive:
+            archive.extractall(temp_directory, [member for member in archive.namelist() if member.startswith('site/')])
+        try:
+            os.rename(temp_directory, target)
+        except OSError:
+            pass  ## Another process extracted it first
+    finally:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+    return os.path.join(target, 'site')
+
+sys.path.insert(0, extracted_site())
+if ENTRY_POINT:
+    import importlib
+    module_name, _, attribute = ENTRY_POINT.partition(':')
+    target = importlib.import_module(module_name)
+    for part in attribute.split('.'):
+        target = getattr(target, part)
+    sys.exit(target())
+else:
+    import runpy
+    runpy.run_module(NAME, run_name='__main__', alter_sys=True)
+'''
+
+
+def wheel_console_scripts(wheel_path):
+    '''{script name: "module:function"} of the wheel's console_scripts.'''
+    with zipfile.ZipFile(wheel_path) as wheel:
+        names = [name for name in wheel.namelist() if name.count('/') == 1 and name.endswith('.dist-info/entry_points.txt')]
+        if not names:
+            return {}
+        parser = configparser.ConfigParser(delimiters=('=',))
+        parser.optionxform = str
+        parser.read_string(wheel.read(names[0]).decode('utf-8'))
+    return dict(parser['console_scripts']) if parser.has_section('console_scripts') else {}
+
+def _tree_hash(directory):
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            digest.update(os.path.relpath(path, directory).replace(os.sep, '/').encode('utf-8') + b'\0')
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()[:16]
+
+def create_zipapp(wheel_path, package_name, staging_directory, output_directory, cache_directory, entry_point=None, interpreter='/usr/bin/env python3'):
+    '''Builds <output_directory>/<name>-<version>.pyz and returns its path.
+
+    `entry_point` ("module:function"): the wheel's console script named like
+    the package (else its only one) by default, else `python -m <package>`.'''
+    if entry_point is None:
+        scripts = wheel_console_scripts(wheel_path)
+        entry_point = scripts.get(package_name) or (next(iter(scripts.values())) if len(scripts) == 1 else None)
+
+    if os.path.exists(staging_directory):
+        shutil.rmtree(staging_directory)
+    site_directory = os.path.join(staging_directory, 'site')
+    os.makedirs(site_directory)
+    wheelhouse_args = WheelhouseCache(cache_directory).install_arguments(read_wheel_requirements(wheel_path))
+    subprocess.run([sys.executable, '-m', 'pip', 'install', '--quiet', '--no-compile', '--target', site_directory,
+        wheel_path, *wheelhouse_args], check=True)
+    ## Scripts are for the pip-installed layout, the archive has its own entry point
+    shutil.rmtree(os.path.join(site_directory, 'bin'), ignore_errors=True)
+    compileall.compile_dir(site_directory, quiet=1, workers=0, invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+
+    with open(os.path.join(staging_directory, '__main__.py'), 'w', encoding='utf-8') as file:
+        file.write(BOOTSTRAP.format(name=package_name, payload_hash=_tree_hash(site_directory), entry_point=entry_point))
+
+    os.makedirs(output_directory, exist_ok=True)
+    _, version = os.path.basename(wheel_path).split('-')[:2]
+    output_path = os.path.join(output_directory, f'{package_name}-{version}.pyz')
+    zipapp.create_archive(staging_directory, output_path, interpreter=interpreter, compressed=True)
+    pt.c(f'-- Created {output_path} ({os.path.getsize(output_path) / 1024 ** 2:.1f} MB, entry point: {entry_point or f"python -m {package_name}"})')
+    return output_path